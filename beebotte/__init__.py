@@ -5,13 +5,18 @@ Contains methods for sending persistent and transient messages and for reading d
 
 __version__ = '0.2.1'
 
+import sys
 import json
 import time
 import hmac
 import base64
+import bisect
 import hashlib
-import requests
-from email import utils
+import threading
+from array import array
+from beebotte.transport import defaultTransport
+from beebotte.encoding import BulkEncoder, SpooledBody, ArrayDecoder, compress
+from beebotte.metrics import RequestInfo
 try: import urllib.parse as urllib
 except ImportError: import urllib
 
@@ -29,20 +34,110 @@ class BBT:
 
   """
   Creates and maintains an object holding user credentials and connection parameters to be used as needed.
+  HTTP connections are pooled and kept alive across API calls. The pool is thread-safe and can be shared by
+  several threads; call close() (or use the object as a context manager) to release the connections.
+  Requests are sent through the requests package when it is installed, or the standard library http.client otherwise
+  (see beebotte.transport); either is only imported on the first API call.
 
   @param akey: The user's API key (access key) to be passed along the authentication parameters.
   @param skey: The user's secret key to be used to sign API calls.
   @param hostname: The host name where the API is implemented.
   @param port: The port number.
   @param ssl: Indicates if SSL (TLS) should be used.
+  @param pool_connections: optional number of per-host connection pools to keep (defaults to 10).
+  @param pool_maxsize: optional maximum number of connections kept alive per host (defaults to 10).
+  @param pool_block: optional indicates if calls should wait for a free connection when pool_maxsize connections are in use (defaults to False).
+  @param keepalive_timeout: optional number of seconds an idle pool is kept before its connections are closed (defaults to 60). None keeps connections open until close() is called.
+  @param encoder: optional BulkEncoder used to serialize write and publish bodies (defaults to a BulkEncoder with the fastest available JSON backend).
+  @param cache: optional ReadCache (beebotte.cache) used to serve repeated read and readPublic calls. Writes made through this object invalidate the affected entries.
+  @param retry_policy: optional RetryPolicy (beebotte.retry) deciding if and when failed calls are retried. None disables retries.
+  @param rate_limiter: optional RateLimiter (beebotte.retry) bounding the rate of API calls made through this object.
+  @param circuit_breaker: optional CircuitBreaker (beebotte.retry) failing calls fast while the backend is unhealthy.
+  @param compression: optional content encoding used to compress write and publish bodies ('gzip' or 'deflate'). None disables compression (default).
+  @param compression_threshold: optional minimum body size in bytes to compress (defaults to 1024).
+  @param compression_level: optional compression level from 1 to 9 (defaults to 6).
+  @param stream_threshold: optional number of records from which writeBulk and publishBulk bodies are encoded to a spooled temporary file
+    instead of memory (defaults to 10000). Generators are always streamed. None disables streaming.
+  @param transport: optional Transport (beebotte.transport) sending the HTTP requests. The pool parameters above only apply to the default transport.
   """
-  def __init__(self, akey, skey, hostname = "api.beebotte.com", port = "80", ssl = False):
+  def __init__(self, akey, skey, hostname = "api.beebotte.com", port = "80", ssl = False,
+               pool_connections = 10, pool_maxsize = 10, pool_block = False, keepalive_timeout = 60, encoder = None, cache = None,
+               retry_policy = None, rate_limiter = None, circuit_breaker = None, compression = None, compression_threshold = 1024,
+               compression_level = 6, stream_threshold = 10000, transport = None):
     self.akey     = akey
     self.skey     = skey
     self.hostname = hostname
     self.port     = port
     self.ssl      = ssl
 
+    self.pool_connections  = pool_connections
+    self.pool_maxsize      = pool_maxsize
+    self.pool_block        = pool_block
+    self.keepalive_timeout = keepalive_timeout
+    self.encoder           = encoder if encoder is not None else BulkEncoder()
+    self.cache             = cache
+    self.retry_policy      = retry_policy
+    self.rate_limiter      = rate_limiter
+    self.circuit_breaker   = circuit_breaker
+    self.compression       = compression
+    self.compression_threshold = compression_threshold
+    self.compression_level = compression_level
+    self.stream_threshold  = stream_threshold
+    self.transport         = transport if transport is not None else self.__newTransport__()
+    self._hooks            = ()
+
+    self._baseUrl  = "%s://%s:%s" % ( 'https' if ssl else 'http', hostname, port )
+    self._signKey  = None
+    self._hmac     = None
+    self._date     = ( None, None )
+    self._urls     = {}
+    self._lock     = threading.Lock()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Returns the transport used when none is given to the constructor, configured with the pool parameters.
+  """
+  def __newTransport__(self):
+    return defaultTransport( self.pool_connections, self.pool_maxsize, self.pool_block, self.keepalive_timeout )
+
+  """
+  Closes all pooled connections. The client remains usable; a new pool is created on the next API call.
+  """
+  def close(self):
+    self.transport.close()
+
+  """
+  Registers an instrumentation hook. A hook is an object with request_start(info) and request_end(info) methods,
+  called with a RequestInfo (beebotte.metrics) at the start and at the end of every API call. Errors raised by hooks
+  are ignored. When no hook is registered, API calls are not timed.
+
+  @param hook: required the hook to register.
+  """
+  def add_hook(self, hook):
+    with self._lock:
+      self._hooks = self._hooks + ( hook, )
+
+  """
+  Unregisters an instrumentation hook.
+
+  @param hook: required the hook to unregister.
+  """
+  def remove_hook(self, hook):
+    with self._lock:
+      self._hooks = tuple( h for h in self._hooks if h is not hook )
+
+  """
+  Returns statistics of the connection pool: number of host pools, connections opened, requests sent and
+  connections currently idle in the pool.
+  """
+  def pool_stats(self):
+    return self.transport.pool_stats()
+
   """
   Utility function that signs the given string with the secret key using SHA1 HMAC and returns a string containing
   the access key followed by column followed by the hash in base64.
@@ -53,9 +148,58 @@ class BBT:
     This signature format is used to authenticate API calls
   """
   def sign(self, stringToSign):
-    signature = hmac.new(self.skey.encode(), stringToSign.encode(), hashlib.sha1)
+    signature = self.__hmac__()
+    signature.update(stringToSign.encode())
     return "%s:%s" % (self.akey, bytes.decode(base64.b64encode(signature.digest())))
 
+  """
+  Returns a copy of the HMAC state keyed with the secret key. The key is processed once and the state copied
+  for each signature; it is prepared again if skey is changed.
+  """
+  def __hmac__(self):
+    skey = self.skey
+    if self._signKey is not skey:
+      self._hmac = hmac.new( skey.encode(), digestmod = hashlib.sha1 )
+      self._signKey = skey
+    return self._hmac.copy()
+
+  """
+  Returns the Date header value of the current second, formatted once per second.
+  """
+  def __date__(self):
+    now = int( time.time() )
+    cached = self._date
+    if cached[0] != now:
+      from email import utils
+      cached = ( now, utils.formatdate( now ) )
+      self._date = cached
+    return cached[1]
+
+  """
+  Returns the full URL of the given endpoint. URLs are built once per endpoint and reused; the table is reset
+  when it grows over 4096 entries.
+  """
+  def __url__(self, uri):
+    url = self._urls.get( uri )
+    if url is None:
+      if len(self._urls) >= 4096:
+        self._urls = {}
+      url = self._urls[uri] = self._baseUrl + uri
+    return url
+
+  """
+  Returns the endpoint of an API call on a channel (bulk calls) or on a channel resource. Endpoint strings are
+  interned, so that repeated calls on the same resource share the same string and URL.
+
+  @param base: The API endpoint prefix.
+  @param channel: The channel name.
+  @param resource: optional The resource name.
+  """
+  def __endpoint__(self, base, channel, resource = None):
+    if resource is None:
+      return sys.intern( "%s/%s" % ( base, channel ) )
+    return sys.intern( "%s/%s/%s" % ( base, channel, resource ) )
+
   """
   Creates a signature of an API call to authenticate the user and verify message integrity.
 
@@ -72,88 +216,297 @@ class BBT:
     return self.sign(stringToSign)
 
   """
-  Checks if the given response data is OK or if an error occurred
+  Checks if the given response data is OK or if an error occurred.
+  The raised exception carries the HTTP status (status attribute), the Beebotte error code (code attribute) and the
+  delay in seconds requested by a Retry-After response header, if any (retry_after attribute).
 
-  @param response: The response containing the response status and data
+  @param response: The response containing the response status and data, and optionally the response headers
 
   @return: The response data in JSON if the status is OK, raises an exception otherwise (with the status code and error code)
   """
   def __processResponse__(self, response):
     code    = response['status']
-    data   = json.loads(response['data'])
     if code < 400:
-      return data
-    else:
+      return json.loads(response['data'])
+    errcode = None
+    errmsg  = response['data']
+    try:
+      data = json.loads(response['data'])
+    except ValueError:
+      data = None
+    # the body of an error that did not come from Beebotte (proxy, load balancer) can be any JSON value
+    if isinstance(data, dict) and isinstance(data.get('error'), dict) and 'code' in data['error']:
       errcode = data['error']['code']
-      errmsg  = data['error']['message']
-      if code == 400:
-        if errcode == 1101:
-          raise AuthenticationError("Status: 400; Code 1101; Message: %s" % errmsg)
-        elif errcode == 1401:
-          raise ParameterError("Status: 400; Code 1401; Message: %s" % errmsg)
-        elif errcode == 1403:
-          raise BadRequestError("Status: 400; Code 1403; Message: %s" % errmsg)
-        elif errcode == 1404:
-          raise TypeError("Status: 400; Code 1404; Message: %s" % errmsg)
-        elif errcode == 1405:
-          raise BadTypeError("Status: 400; Code 1405; Message: %s" % errmsg)
-        elif errcode == 1406:
-          raise PayloadLimitError("Status: 400; Code 1406; Message: %s" % errmsg)
-        else:
-          raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
-      elif code == 405:
-        if errcode == 1102:
-          raise NotAllowedError("Status: 405; Code 1102; Message: %s" % errmsg)
-        else:
-          raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
-      elif code == 500:
-        if errcode == 1201:
-          raise InternalError("Status: 500; Code 1201; Message: %s" % errmsg)
-        else:
-          raise InternalError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
-      elif code == 404:
-        if errcode == 1301:
-          raise NotFoundError("Status: 404; Code 1301; Message: %s" % errmsg)
-        if errcode == 1302:
-          raise NotFoundError("Status: 404; Code 1302; Message: %s" % errmsg)
-        if errcode == 1303:
-          raise NotFoundError("Status: 404; Code 1303; Message: %s" % errmsg)
-        if errcode == 1304:
-          raise AlreadyExistError("Status: 404; Code 1304; Message: %s" % errmsg)
-        if errcode == 1305:
-          raise AlreadyExistError("Status: 404; Code 1305; Message: %s" % errmsg)
-        if errcode == 1306:
-          raise AlreadyExistError("Status: 404; Code 1306; Message: %s" % errmsg)
-        else:
-          raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+      errmsg  = data['error'].get('message', errmsg)
+    try:
+      self.__raiseError__( code, errcode, errmsg )
+    except Exception as e:
+      e.status      = code
+      e.code        = errcode
+      e.retry_after = None
+      retry_after   = ( response.get('headers') or {} ).get('Retry-After')
+      if retry_after:
+        try:
+          e.retry_after = max( 0, int(retry_after) )
+        except ValueError:
+          from email import utils
+          parsed = utils.parsedate_tz( retry_after )
+          if parsed is not None:
+            e.retry_after = max( 0, utils.mktime_tz( parsed ) - time.time() )
+      raise
+
+  """
+  Raises the exception matching the given error response.
+
+  @param code: The HTTP status code.
+  @param errcode: The Beebotte error code (None if the response body is not a Beebotte error).
+  @param errmsg: The error message.
+  """
+  def __raiseError__(self, code, errcode, errmsg):
+    if code == 400:
+      if errcode == 1101:
+        raise AuthenticationError("Status: 400; Code 1101; Message: %s" % errmsg)
+      elif errcode == 1401:
+        raise ParameterError("Status: 400; Code 1401; Message: %s" % errmsg)
+      elif errcode == 1403:
+        raise BadRequestError("Status: 400; Code 1403; Message: %s" % errmsg)
+      elif errcode == 1404:
+        raise TypeError("Status: 400; Code 1404; Message: %s" % errmsg)
+      elif errcode == 1405:
+        raise BadTypeError("Status: 400; Code 1405; Message: %s" % errmsg)
+      elif errcode == 1406:
+        raise PayloadLimitError("Status: 400; Code 1406; Message: %s" % errmsg)
       else:
         raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    elif code == 405:
+      if errcode == 1102:
+        raise NotAllowedError("Status: 405; Code 1102; Message: %s" % errmsg)
+      else:
+        raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    elif code == 429:
+      raise UsageLimitError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    elif code == 500:
+      if errcode == 1201:
+        raise InternalError("Status: 500; Code 1201; Message: %s" % errmsg)
+      else:
+        raise InternalError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    elif code == 503:
+      raise ServiceUnavailableError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    elif code == 404:
+      if errcode == 1301:
+        raise NotFoundError("Status: 404; Code 1301; Message: %s" % errmsg)
+      if errcode == 1302:
+        raise NotFoundError("Status: 404; Code 1302; Message: %s" % errmsg)
+      if errcode == 1303:
+        raise NotFoundError("Status: 404; Code 1303; Message: %s" % errmsg)
+      if errcode == 1304:
+        raise AlreadyExistError("Status: 404; Code 1304; Message: %s" % errmsg)
+      if errcode == 1305:
+        raise AlreadyExistError("Status: 404; Code 1305; Message: %s" % errmsg)
+      if errcode == 1306:
+        raise AlreadyExistError("Status: 404; Code 1306; Message: %s" % errmsg)
+      else:
+        raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
+    else:
+      raise UnexpectedError("Status: %s; Code %s; Message: %s" % (code, errcode, errmsg) )
 
   """
-  Sends a POST request with the given data to the given URI endpoint and returns the response data.
+  Performs an API call, applying the rate limiter, circuit breaker and retry policy if configured.
+
+  @param send: function sending the request (with freshly signed headers) and returning the processed response.
+  @param idempotent: Indicates if the call can be safely repeated (reads).
+
+  @return: The result of send, raises the last error if the call fails. If the circuit opens while the call is being
+    retried, the error of the last attempt is raised rather than CircuitOpenError.
+  """
+  def __execute__(self, send, idempotent):
+    if self.retry_policy is None and self.rate_limiter is None and self.circuit_breaker is None:
+      return send()
+    attempt = 0
+    error = None
+    while True:
+      attempt += 1
+      if self.circuit_breaker is not None:
+        try:
+          self.circuit_breaker.before()
+        except CircuitOpenError:
+          if error is None:
+            raise
+          raise error
+      if self.rate_limiter is not None:
+        self.rate_limiter.acquire()
+      try:
+        result = send()
+      except Exception as e:
+        if self.circuit_breaker is not None:
+          self.circuit_breaker.record(e)
+        delay = self.retry_policy.delay( e, attempt, idempotent ) if self.retry_policy is not None else None
+        if delay is None:
+          raise
+        error = e
+        time.sleep( delay )
+        continue
+      if self.circuit_breaker is not None:
+        self.circuit_breaker.record()
+      return result
+
+  """
+  Performs an instrumented API call: notifies the registered hooks before and after the call and records its
+  duration, outcome and number of attempts in the given RequestInfo.
+
+  @param info: the RequestInfo describing the call, filled in by send.
+  @param send: function sending the request and returning the processed response.
+  @param idempotent: Indicates if the call can be safely repeated (reads).
+  """
+  def __instrument__(self, info, send, idempotent):
+    hooks = self._hooks
+    for hook in hooks:
+      try:
+        hook.request_start(info)
+      except Exception:
+        pass
+    try:
+      return self.__execute__( send, idempotent )
+    except Exception as e:
+      info.error = e
+      info.error_code = getattr(e, 'code', None)
+      raise
+    finally:
+      info.duration = time.perf_counter() - info.started
+      for hook in hooks:
+        try:
+          hook.request_end(info)
+        except Exception:
+          pass
+
+  """
+  Builds the headers of a POST request (content hash, date and, if requested, the authorization signature).
 
   @param uri: The uri endpoint.
-  @param data: the data to send.
-  @param auth: Indicates if the Post request should be authenticated (defaults to true).
+  @param data: the data to send (string, bytes or SpooledBody). The content hash is computed on the data as sent.
+  @param auth: Indicates if the Post request should be authenticated.
+  @param phases: optional dict in which the durations of the 'md5' and 'sign' phases are recorded.
+  @param encoding: optional the content encoding of the data ('gzip' or 'deflate').
 
-  @return: The response data in JSON format if success, raises an error or failure.
+  @return: The request headers.
   """
-  def __postData__(self, uri, data, auth = True):
-    if self.ssl:
-      url = "%s://%s:%s%s" % ( 'https', self.hostname, self.port, uri )
+  def __postHeaders__(self, uri, data, auth, phases = None, encoding = None):
+    if phases is not None:
+      started = time.perf_counter()
+    if isinstance(data, SpooledBody):
+      md5 = data.md5
     else:
-      url = "%s://%s:%s%s" % ( 'http', self.hostname, self.port, uri )
-
-    md5 = bytes.decode( base64.b64encode( hashlib.md5( str.encode( data ) ).digest() ) )
-    date = utils.formatdate()
+      if not isinstance(data, bytes):
+        data = str.encode( data )
+      md5 = bytes.decode( base64.b64encode( hashlib.md5( data ).digest() ) )
+    date = self.__date__()
+    if phases is not None:
+      signed = time.perf_counter()
+      phases['md5'] = signed - started
     if auth:
       sig = self.__signRequest__('POST', uri, date, "application/json", md5)
+      if phases is not None:
+        phases['sign'] = time.perf_counter() - signed
       headers = { 'Content-MD5': md5, 'Content-Type': 'application/json', 'Date': date, 'Authorization': sig }
     else:
       headers = { 'Content-MD5': md5, 'Content-Type': 'application/json', 'Date': date }
+    if encoding is not None:
+      headers['Content-Encoding'] = encoding
+    if isinstance(data, SpooledBody):
+      headers['Content-Length'] = str( data.length )
+    return headers
 
-    r = requests.post( url, data=data, headers=headers )
-    return self.__processResponse__( { 'status': r.status_code, 'data': r.text } )
+  """
+  Compresses the data of a POST request if compression is enabled and the data is large enough.
+
+  @param data: the data to send (string, bytes or SpooledBody).
+
+  @return: a tuple of the data to send and its content encoding (None if not compressed).
+  """
+  def __compress__(self, data):
+    if isinstance(data, SpooledBody):
+      return data, data.encoding
+    if self.compression is None:
+      return data, None
+    if not isinstance(data, bytes):
+      data = str.encode( data )
+    if len(data) < self.compression_threshold:
+      return data, None
+    return compress( data, self.compression, self.compression_level ), self.compression
+
+  """
+  Encodes the body of a bulk call, in memory or, for generators and arrays of at least stream_threshold records,
+  to a spooled temporary file (compressed on the fly if compression is enabled). A SpooledBody must be closed once sent.
+  """
+  def __encodeBulk__(self, data_array):
+    if self.stream_threshold is not None and ( not hasattr(data_array, '__len__') or len(data_array) >= self.stream_threshold ):
+      return self.encoder.encodeStream( data_array, self.compression, self.compression_level )
+    return self.encoder.encode( data_array )
+
+  """
+  Builds the headers of a GET request (date and, if requested, the authorization signature).
+
+  @param full_uri: The uri endpoint including the url encoded query parameters.
+  @param auth: Indicates if the Get request should be authenticated.
+  @param phases: optional dict in which the duration of the 'sign' phase is recorded.
+
+  @return: The request headers.
+  """
+  def __getHeaders__(self, full_uri, auth, phases = None):
+    date = self.__date__()
+    if auth:
+      if phases is not None:
+        started = time.perf_counter()
+      sig = self.__signRequest__('GET', full_uri, date, "application/json")
+      if phases is not None:
+        phases['sign'] = time.perf_counter() - started
+      return { 'Content-Type': 'application/json', 'Accept-Encoding': 'gzip, deflate', 'Date': date, 'Authorization': sig }
+    else:
+      return { 'Content-Type': 'application/json', 'Accept-Encoding': 'gzip, deflate', 'Date': date }
+
+  """
+  Sends a POST request with the given data to the given URI endpoint and returns the response data.
+
+  @param uri: The uri endpoint.
+  @param data: the data to send (string, bytes or SpooledBody). Compressed if compression is enabled.
+  @param auth: Indicates if the Post request should be authenticated (defaults to true).
+  @param encode_started: optional perf_counter() value taken before the data was encoded, to report the 'encode' phase to the hooks.
+
+  @return: The response data in JSON format if success, raises an error or failure.
+  """
+  def __postData__(self, uri, data, auth = True, encode_started = None):
+    if not self._hooks:
+      data, encoding = self.__compress__( data )
+      def send():
+        headers = self.__postHeaders__( uri, data, auth, None, encoding )
+        body = data.rewind() if isinstance(data, SpooledBody) else data
+        r = self.transport.request( 'POST', self.__url__( uri ), body, headers )
+        return self.__processResponse__( { 'status': r.status, 'data': r.text, 'headers': r.headers } )
+      return self.__execute__( send, False )
+
+    info = RequestInfo( 'POST', uri )
+    if encode_started is not None:
+      info.phases['encode'] = info.started - encode_started
+    data, encoding = self.__compress__( data )
+    if encoding is not None:
+      info.phases['compress'] = time.perf_counter() - info.started
+    info.bytes_sent = len(data)
+    def send():
+      info.attempts += 1
+      headers = self.__postHeaders__( uri, data, auth, info.phases, encoding )
+      body = data.rewind() if isinstance(data, SpooledBody) else data
+      started = time.perf_counter()
+      r = self.transport.request( 'POST', self.__url__( uri ), body, headers )
+      text = r.text
+      parsing = time.perf_counter()
+      info.phases['network'] = parsing - started
+      info.status = r.status
+      info.bytes_received = len(r.content)
+      try:
+        return self.__processResponse__( { 'status': r.status, 'data': text, 'headers': r.headers } )
+      finally:
+        info.phases['parse'] = time.perf_counter() - parsing
+    return self.__instrument__( info, send, False )
 
   """
   Sends a GET request with the given query parameters to the given URI endpoint and returns the response data.
@@ -165,21 +518,95 @@ class BBT:
   @return: The response data in JSON format if success, raises an error or failure.
   """
   def __getData__(self, uri, query, auth = True):
-    if self.ssl:
-      url = "%s://%s:%s%s" % ( 'https', self.hostname, self.port, uri )
-    else:
-      url = "%s://%s:%s%s" % ( 'http', self.hostname, self.port, uri )
-
     full_uri = "%s?%s" % ( uri, urllib.urlencode( query ) )
-    date = utils.formatdate()
-    if auth:
-      sig = self.__signRequest__('GET', full_uri, date, "application/json")
-      headers = { 'Content-Type': 'application/json', 'Date': date, 'Authorization': sig }
-    else:
-      headers = { 'Content-Type': 'application/json', 'Date': date }
+    if not self._hooks:
+      def send():
+        headers = self.__getHeaders__( full_uri, auth )
+        r = self.transport.request( 'GET', self._baseUrl + full_uri, None, headers )
+        return self.__processResponse__( { 'status': r.status, 'data': r.text, 'headers': r.headers } )
+      return self.__execute__( send, True )
+
+    info = RequestInfo( 'GET', full_uri )
+    def send():
+      info.attempts += 1
+      headers = self.__getHeaders__( full_uri, auth, info.phases )
+      started = time.perf_counter()
+      r = self.transport.request( 'GET', self._baseUrl + full_uri, None, headers )
+      text = r.text
+      parsing = time.perf_counter()
+      info.phases['network'] = parsing - started
+      info.status = r.status
+      info.bytes_received = len(r.content)
+      try:
+        return self.__processResponse__( { 'status': r.status, 'data': text, 'headers': r.headers } )
+      finally:
+        info.phases['parse'] = time.perf_counter() - parsing
+    return self.__instrument__( info, send, True )
+
+  """
+  Sends a GET request with the given query parameters to the given URI endpoint and decodes the response array
+  as it is received, one chunk at a time.
 
-    r = requests.get( url, params=query, headers=headers )
-    return self.__processResponse__( { 'status': r.status_code, 'data': r.text } )
+  @param uri: The uri endpoint.
+  @param query: the query parameters in JSON format.
+  @param auth: Indicates if the Get request should be authenticated (defaults to true).
+  @param chunk_size: optional number of bytes of the response read at a time (defaults to 64 KiB).
+
+  @return: iterator of the elements of the response, raises an error or failure. The request is sent (and retried
+    if a retry policy is set) when the iteration starts; failures while the response is being read are not retried.
+  """
+  def __getStream__(self, uri, query, auth = True, chunk_size = 1 << 16):
+    full_uri = "%s?%s" % ( uri, urllib.urlencode( query ) )
+    info = RequestInfo( 'GET', full_uri ) if self._hooks else None
+    hooks = self._hooks if info is not None else ()
+    def send():
+      if info is not None:
+        info.attempts += 1
+      headers = self.__getHeaders__( full_uri, auth, info.phases if info is not None else None )
+      started = time.perf_counter()
+      r = self.transport.stream( 'GET', self._baseUrl + full_uri, None, headers )
+      if info is not None:
+        info.phases['network'] = time.perf_counter() - started
+        info.status = r.status
+      if r.status < 400:
+        return r
+      with r:
+        text = r.read().decode( 'utf-8', 'replace' )
+      return self.__processResponse__( { 'status': r.status, 'data': text, 'headers': r.headers } )
+
+    for hook in hooks:
+      try:
+        hook.request_start(info)
+      except Exception:
+        pass
+    try:
+      with self.__execute__( send, True ) as r:
+        decoder = ArrayDecoder()
+        for chunk in r.iter_content( chunk_size ):
+          if info is None:
+            records = decoder.feed( chunk )
+          else:
+            started = time.perf_counter()
+            records = decoder.feed( chunk )
+            info.phases['parse'] = info.phases.get( 'parse', 0 ) + time.perf_counter() - started
+            info.bytes_received += len(chunk)
+          for record in records:
+            yield record
+        for record in decoder.close():
+          yield record
+    except Exception as e:
+      if info is not None:
+        info.error = e
+        info.error_code = getattr(e, 'code', None)
+      raise
+    finally:
+      if info is not None:
+        info.duration = time.perf_counter() - info.started
+        for hook in hooks:
+          try:
+            hook.request_end(info)
+          except Exception:
+            pass
 
   """
   Public Read
@@ -197,18 +624,28 @@ class BBT:
   @param data_filter filters data records to be returned
   @param sample_rate reduces the number of records to return (number between 0 and 1)
   
-  @return: The response data in JSON format if success, raises an error or failure.
+  @param as_columns: optional returns a DataPointArray instead of a list of records (defaults to False). Without a cache, the
+    response is decoded into the columns as it is received.
+  
+  @return: The response data in JSON format (or a DataPointArray) if success, raises an error or failure.
   """
-  def readPublic(self, owner, channel, resource, limit = 750, source = "raw", time_range = None, data_filter = None, sample_rate = None):
+  def readPublic(self, owner, channel, resource, limit = 750, source = "raw", time_range = None, data_filter = None, sample_rate = None, as_columns = False):
     query = {'limit': limit, 'source': source}
     if time_range:
       query['time-range'] = time_range
     if data_filter:
       query['filter'] = data_filter
     if sample_rate:
-      query['sample-rate'] = sample-rate
+      query['sample-rate'] = sample_rate
     endpoint = "%s/%s/%s/%s" % ( __publicReadEndpoint__, owner, channel, resource )
-    response = self.__getData__( endpoint, query, False )
+    if self.cache is not None:
+      response = self.cache.fetch( owner, channel, resource, query, lambda: self.__getData__( endpoint, query, False ) )
+    elif as_columns:
+      return DataPointArray.fromJSON( self.__getStream__( endpoint, query, False ), channel, resource )
+    else:
+      response = self.__getData__( endpoint, query, False )
+    if as_columns:
+      return DataPointArray.fromJSON( response, channel, resource )
     return response;
 
   """
@@ -226,21 +663,234 @@ class BBT:
   @param data_filter filters data records to be returned
   @param sample_rate reduces the number of records to return (number between 0 and 1)
   
-  @return: The response data in JSON format if success, raises an error or failure.
+  @param as_columns: optional returns a DataPointArray instead of a list of records (defaults to False). Without a cache, the
+    response is decoded into the columns as it is received.
+  
+  @return: The response data in JSON format (or a DataPointArray) if success, raises an error or failure.
   """
-  def read(self, channel, resource, limit = 1, source = "raw", time_range = None, data_filter = None, sample_rate = None ):
+  def read(self, channel, resource, limit = 1, source = "raw", time_range = None, data_filter = None, sample_rate = None, as_columns = False ):
     query = {'limit': limit, 'source': source}
     if time_range:
       query['time-range'] = time_range
     if data_filter:
       query['filter'] = data_filter
     if sample_rate:
-      query['sample-rate'] = sample-rate
+      query['sample-rate'] = sample_rate
 
-    endpoint = "%s/%s/%s" % ( __readEndpoint__, channel, resource )
-    response = self.__getData__( endpoint, query, False )
+    endpoint = self.__endpoint__( __readEndpoint__, channel, resource )
+    if self.cache is not None:
+      response = self.cache.fetch( None, channel, resource, query, lambda: self.__getData__( endpoint, query, True ) )
+    elif as_columns:
+      return DataPointArray.fromJSON( self.__getStream__( endpoint, query, True ), channel, resource )
+    else:
+      response = self.__getData__( endpoint, query, True )
+    if as_columns:
+      return DataPointArray.fromJSON( response, channel, resource )
     return response;
 
+  """
+  Multiple Read
+  Reads several resources concurrently over the connection pool. Each read is performed by read() (or readPublic()
+  if its options contain an 'owner') and errors are reported per read instead of aborting the whole batch.
+  For the reads to reuse pooled connections, max_concurrency should not exceed pool_maxsize.
+
+  @param reads: required list of reads, each a tuple (channel, resource) or (channel, resource, options) where options is a dict of keyword arguments of read() (limit, source, time_range, data_filter, sample_rate, as_columns) or of readPublic() if it contains 'owner'.
+  @param max_concurrency: optional maximum number of reads in flight at once (defaults to pool_maxsize).
+  @param timeout: optional number of seconds after which reads that have not completed are abandoned. None waits for all the reads.
+
+  @return: list with, in the order of the reads, the result of each read or the exception it raised (TimeoutError for the reads abandoned at the deadline).
+  """
+  def read_many(self, reads, max_concurrency = None, timeout = None):
+    from concurrent.futures import ThreadPoolExecutor, wait
+    executor = ThreadPoolExecutor( max_workers = max_concurrency or self.pool_maxsize )
+    try:
+      futures = [ executor.submit( self.__readEntry__, entry ) for entry in reads ]
+      wait( futures, timeout )
+      results = []
+      for future in futures:
+        if not future.done():
+          future.cancel()
+          results.append( TimeoutError("read did not complete before the deadline") )
+        elif future.exception() is not None:
+          results.append( future.exception() )
+        else:
+          results.append( future.result() )
+      return results
+    finally:
+      executor.shutdown( wait = False, cancel_futures = True )
+
+  """
+  Performs one read of read_many: read() or, if its options contain an 'owner', readPublic().
+  """
+  def __readEntry__(self, entry):
+    options = dict( entry[2] ) if len(entry) > 2 and entry[2] else {}
+    owner = options.pop( 'owner', None )
+    if owner:
+      return self.readPublic( owner, entry[0], entry[1], **options )
+    return self.read( entry[0], entry[1], **options )
+
+  """
+  Iterative Read
+  Reads all the records of the resource within the given time range, one page of page_size records at a time.
+  Pages are requested with a timestamp cursor ('to' query parameter set to the oldest timestamp received so far)
+  and the next page is fetched in the background while the current one is consumed, so that memory use does not
+  depend on the size of the time range.
+  If the owner is set (value different than None) the behaviour is Public Read (no authentication).
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to read from.
+  @param time_range: optional the time range to read. Accepts the values supported by read() or a tuple (from, to) of timestamps in milliseconds (since epoch), either of which can be None.
+  @param page_size: optional number of records requested per API call (defaults to 750). Should be larger than the number of records sharing a single timestamp.
+  @param source: optional indicates whether to read from database or from historical statistics. Accepts ('raw', 'hour-stats', 'day-stats').
+  @param owner: optional the owner (username) of the resource to read from for public read. None to read from the user's owned channel.
+  @param data_filter filters data records to be returned
+  @param sample_rate reduces the number of records to return (number between 0 and 1)
+
+  @return: iterator of DataPoint objects, most recent first, raises an error or failure.
+  """
+  def read_iter(self, channel, resource, time_range = None, page_size = 750, source = "raw", owner = None, data_filter = None, sample_rate = None):
+    endpoint, query, cursor = self.__pageQuery__( channel, resource, time_range, page_size, source, owner, data_filter, sample_rate )
+
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor( max_workers = 1 )
+    try:
+      page = self.__fetchPage__( endpoint, query, cursor, not owner )
+      skip = 0
+      while page:
+        following = self.__nextPage__( page, cursor, page_size )
+        future = executor.submit( self.__fetchPage__, endpoint, query, following[0], not owner ) if following else None
+        for point in self.__pagePoints__( page, cursor, skip, channel, resource ):
+          yield point
+        if future is None:
+          return
+        cursor, skip = following
+        page = future.result()
+    finally:
+      executor.shutdown( wait = False, cancel_futures = True )
+
+  """
+  Returns the endpoint, the query parameters and the initial cursor of an iterative read. See read_iter.
+  """
+  def __pageQuery__(self, channel, resource, time_range, page_size, source, owner, data_filter, sample_rate):
+    query = {'limit': page_size, 'source': source}
+    cursor = None
+    if isinstance(time_range, (tuple, list)):
+      if time_range[0] is not None:
+        query['from'] = time_range[0]
+      cursor = time_range[1]
+    elif time_range:
+      query['time-range'] = time_range
+    if data_filter:
+      query['filter'] = data_filter
+    if sample_rate:
+      query['sample-rate'] = sample_rate
+
+    if owner:
+      endpoint = "%s/%s/%s/%s" % ( __publicReadEndpoint__, owner, channel, resource )
+    else:
+      endpoint = "%s/%s/%s" % ( __readEndpoint__, channel, resource )
+    return endpoint, query, cursor
+
+  """
+  Requests the page of an iterative read ending at the given cursor (most recent timestamp, inclusive).
+  """
+  def __fetchPage__(self, endpoint, query, cursor, auth):
+    page_query = dict(query)
+    if cursor is not None:
+      page_query['to'] = cursor
+    return self.__getData__( endpoint, page_query, auth )
+
+  """
+  Returns the cursor of the page following the given one and the number of its first records to skip, or None
+  if the given page is the last one.
+  The cursor is inclusive: records sharing the oldest timestamp of a page are requested again and the ones
+  already returned are skipped. A page made of a single timestamp moves the cursor past it.
+  """
+  def __nextPage__(self, page, cursor, page_size):
+    if len(page) < page_size:
+      return None
+    oldest = min( record['ts'] for record in page )
+    if oldest == cursor:
+      return oldest - 1, 0
+    return oldest, sum( 1 for record in page if record['ts'] == oldest )
+
+  """
+  Returns the records of a page as DataPoint objects, leaving out the first skip records of the cursor timestamp.
+  """
+  def __pagePoints__(self, page, cursor, skip, channel, resource):
+    for record in page:
+      if skip and record['ts'] == cursor:
+        skip -= 1
+        continue
+      yield DataPoint( record['data'], record['ts'], channel, resource )
+
+  """
+  Streamed Read
+  Reads data from the resource like read() (or readPublic() if the owner is set), but decodes the response as it
+  is received instead of loading it whole, so that memory use is bounded by chunk_size and batch_size rather than
+  by the number of records returned. The request is sent when the iteration starts. Streamed reads are not cached.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to read from.
+  @param limit: optional number of records to return (defaults to 750).
+  @param source: optional indicates whether to read from database or from historical statistics. Accepts ('raw', 'hour-stats', 'day-stats').
+  @param time_range: optional indicates the timerange for the returned records. Accepts the values supported by read().
+  @param data_filter filters data records to be returned
+  @param sample_rate reduces the number of records to return (number between 0 and 1)
+  @param owner: optional the owner (username) of the resource to read from for public read. None to read from the user's owned channel.
+  @param batch_size: optional number of records per batch. None yields DataPoint objects one at a time, otherwise lists of up to batch_size DataPoint objects.
+  @param as_columns: optional yields the batches as DataPointArray objects (defaults to False). Requires batch_size.
+  @param chunk_size: optional number of bytes of the response read at a time (defaults to 64 KiB).
+
+  @return: iterator of DataPoint objects or batches, in the order of the response (most recent first), raises an error or failure.
+  """
+  def read_stream(self, channel, resource, limit = 750, source = "raw", time_range = None, data_filter = None, sample_rate = None,
+                  owner = None, batch_size = None, as_columns = False, chunk_size = 1 << 16):
+    if as_columns and not batch_size:
+      raise ValueError("as_columns requires a batch_size")
+    endpoint, query = self.__readQuery__( channel, resource, limit, source, time_range, data_filter, sample_rate, owner )
+    return self.__batches__( self.__getStream__( endpoint, query, not owner, chunk_size ), channel, resource, batch_size, as_columns )
+
+  """
+  Returns the endpoint and the query parameters of a read (public read if the owner is set).
+  """
+  def __readQuery__(self, channel, resource, limit, source, time_range, data_filter, sample_rate, owner):
+    query = {'limit': limit, 'source': source}
+    if time_range:
+      query['time-range'] = time_range
+    if data_filter:
+      query['filter'] = data_filter
+    if sample_rate:
+      query['sample-rate'] = sample_rate
+
+    if owner:
+      endpoint = "%s/%s/%s/%s" % ( __publicReadEndpoint__, owner, channel, resource )
+    else:
+      endpoint = self.__endpoint__( __readEndpoint__, channel, resource )
+    return endpoint, query
+
+  """
+  Converts the records of a streamed read to DataPoint objects, grouped in batches if batch_size is set.
+  """
+  def __batches__(self, records, channel, resource, batch_size, as_columns):
+    if not batch_size:
+      for record in records:
+        yield DataPoint( record['data'], record['ts'], channel, resource )
+      return
+    batch = []
+    for record in records:
+      batch.append( record )
+      if len(batch) >= batch_size:
+        yield self.__batch__( batch, channel, resource, as_columns )
+        batch = []
+    if batch:
+      yield self.__batch__( batch, channel, resource, as_columns )
+
+  def __batch__(self, records, channel, resource, as_columns):
+    if as_columns:
+      return DataPointArray.fromJSON( records, channel, resource )
+    return [ DataPoint( record['data'], record['ts'], channel, resource ) for record in records ]
+
   """
   Write (Persistent messages)
   Writes data to the resource with the given metadata. 
@@ -256,14 +906,13 @@ class BBT:
   @return: true on success, raises an error or failure.
   """
   def write(self, channel, resource, data, ts = None ):
-    body = { 'data': data }
-    if ts:
-      body['ts'] = ts
-    else:
-      body['ts'] = round(time.time() * 1000)
+    started = time.perf_counter() if self._hooks else None
+    body = self.encoder.encodeRecord( data, ts if ts else round(time.time() * 1000) )
 
-    endpoint = "%s/%s/%s" % ( __writeEndpoint__, channel, resource )    
-    response = self.__postData__( endpoint, json.dumps(body, separators=(',', ':')), True )
+    endpoint = self.__endpoint__( __writeEndpoint__, channel, resource )
+    response = self.__postData__( endpoint, body, True, started )
+    if self.cache is not None:
+      self.cache.invalidate( channel, resource )
     return response;
 
   """
@@ -280,14 +929,27 @@ class BBT:
       data required the value to write (persist).
       ts optional timestamp in milliseconds (since epoch). If this parameter is not given, it will be automatically added with a value equal to the local system time.
     }]
+    DataPoint objects (with the resource set) can be given instead of dicts.
    
   @return: true on success, raises an error or failure.
   """
   def writeBulk(self, channel, data_array ):
-    body = { 'data': data_array }
-
-    endpoint = "%s/%s" % ( __writeEndpoint__, channel, resource )
-    response = self.__postData__( endpoint, json.dumps(body, separators=(',', ':')), True )
+    started = time.perf_counter() if self._hooks else None
+    body = self.__encodeBulk__( data_array )
+
+    endpoint = self.__endpoint__( __writeEndpoint__, channel )
+    try:
+      response = self.__postData__( endpoint, body, True, started )
+    finally:
+      if isinstance(body, SpooledBody):
+        body.close()
+    if self.cache is not None:
+      if isinstance(body, SpooledBody):
+        resources = body.resources
+      else:
+        resources = set( record['resource'] if type(record) is dict else record.resource for record in data_array )
+      for resource in resources:
+        self.cache.invalidate( channel, resource )
     return response;
 
   """
@@ -307,17 +969,11 @@ class BBT:
   @return: true on success, raises an error or failure.
   """
   def publish(self, channel, resource, data, ts = None, source = None ):
-    body = { 'data': data }
-    if source:
-      body['source'] = source
+    started = time.perf_counter() if self._hooks else None
+    body = self.encoder.encodeRecord( data, ts if ts else round(time.time() * 1000), source )
     
-    if ts:
-      body['ts'] = ts
-    else:
-      body['ts'] = round(time.time() * 1000)
-    
-    endpoint = "%s/%s/%s" % ( __publishEndpoint__, channel, resource )
-    response = self.__postData__( endpoint, json.dumps(body, separators=(',', ':')), True )
+    endpoint = self.__endpoint__( __publishEndpoint__, channel, resource )
+    response = self.__postData__( endpoint, body, True, started )
     return response;
 
   """
@@ -336,14 +992,20 @@ class BBT:
       ts optional timestamp in milliseconds (since epoch). If this parameter is not given, it will be automatically added with a value equal to the local system time.
       source: optional additional data that will be appended to the published message. This can be a logical identifier (session id) of the originator. Use this as suits you.
     }]
+    DataPoint objects (with the resource set) can be given instead of dicts.
 
   @return: true on success, raises an error or failure.
   """
   def publishBulk(self, channel, data_array ):
-    body = { 'data': data_array }
-
-    endpoint = "%s/%s" % ( __publishEndpoint__, channel, resource )
-    response = self.__postData__( endpoint, json.dumps(body, separators=(',', ':')), True )
+    started = time.perf_counter() if self._hooks else None
+    body = self.__encodeBulk__( data_array )
+
+    endpoint = self.__endpoint__( __publishEndpoint__, channel )
+    try:
+      response = self.__postData__( endpoint, body, True, started )
+    finally:
+      if isinstance(body, SpooledBody):
+        body.close()
     return response;
 
   """
@@ -351,7 +1013,7 @@ class BBT:
   Signs the given subscribe metadata and returns the signature.
 
   @param sid: required the session id of the client.
-  @param channel: required the channel name. Should start with 'presence:' for presence channels and starts with 'private:' for private channels.
+  @param channel: required the channel name. Should start with 'presence-' for presence channels and with 'private-' for private channels.
   @param resource: optional the resource name to read from.
   @param ttl: optional the number of seconds the signature should be considered as valid (currently ignored) for future use.
   @param read: optional indicates if read access is requested.
@@ -369,6 +1031,32 @@ class BBT:
     stringToSign = "%s:%s.%s.:ttl=%s:read=%s:write=%s" % ( sid, channel, resource, ttl, r, w )
     return self.sign(stringToSign)
 
+  """
+  Batch Client Authentication
+  Signs the subscribe metadata of many client sessions requesting the same channel resource and permissions.
+  The common part of the string to sign and the keyed HMAC state are prepared once for the whole batch.
+
+  @param sids: required iterable of client session ids.
+  @param channel: required the channel name. See auth_client.
+  @param resource: optional the resource name to read from.
+  @param ttl: optional the number of seconds the signature should be considered as valid (currently ignored) for future use.
+  @param read: optional indicates if read access is requested.
+  @param write: optional indicates if write access is requested.
+
+  @return: the list of signatures, in the order of sids, each equal to what auth_client returns for the session.
+  """
+  def auth_clients( self, sids, channel, resource = '*', ttl = 0, read = False, write = False ):
+    suffix = (":%s.%s.:ttl=%s:read=%s:write=%s" % ( channel, resource, ttl, 'true' if read else 'false', 'true' if write else 'false' )).encode()
+    prefix = "%s:" % self.akey
+    state = self.__hmac__()
+    b64encode = base64.b64encode
+    result = []
+    for sid in sids:
+      signature = state.copy()
+      signature.update( str(sid).encode() + suffix )
+      result.append( prefix + b64encode( signature.digest() ).decode() )
+    return result
+
 """
 Utility class for dealing with Resources
 Contains methods for sending persistent and transient messages and for reading data.
@@ -378,6 +1066,7 @@ class Resource:
   channel   = None
   resource = None
   bbt      = None
+  write_filter = None
 
   """
   Constructor, initializes the Resource object.
@@ -387,24 +1076,47 @@ class Resource:
   @param bbt: required reference to the Beebotte client connector.
   @param channel: required channel name.
   @param resource: required resource name.
+  @param write_filter: optional filter deciding which written samples are sent (Deadband, ChangeOnly or Window from beebotte.aggregate).
   """
-  def __init__(self, bbt, channel, resource):
+  def __init__(self, bbt, channel, resource, write_filter = None):
     self.channel   = channel
     self.resource = resource
     self.bbt      = bbt
+    self.write_filter = write_filter
 
   """
   Write (Persistent messages)
   Writes data to this resource. 
   This call will be signed to authenticate the calling user.
   
+  If a write filter is set, the sample is given to it and only what it returns (the sample itself, an aggregate or
+  nothing) is written.
+
   @param data: required the value to write (persist).
   @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, it will be automatically added with a value equal to the local system time.
    
-  @return: true on success, raises an error or failure.
+  @return: true on success, None if the write filter did not send anything, raises an error or failure.
   """
   def write(self, data, ts = None):
-    return self.bbt.write(self.channel, self.resource, ts = ts, data = data)
+    if self.write_filter is None:
+      return self.bbt.write(self.channel, self.resource, ts = ts, data = data)
+    return self.__writeAll__( self.write_filter.feed( data, ts if ts else round(time.time() * 1000) ) )
+
+  """
+  Writes what the write filter still holds (the aggregate of the current window).
+
+  @return: true on success, None if there was nothing to write, raises an error or failure.
+  """
+  def flush(self):
+    if self.write_filter is None:
+      return None
+    return self.__writeAll__( self.write_filter.flush() )
+
+  def __writeAll__(self, samples):
+    response = None
+    for data, ts in samples:
+      response = self.bbt.write(self.channel, self.resource, ts = ts, data = data)
+    return response
 
   """
   Publish (Transient messages)
@@ -431,14 +1143,20 @@ class Resource:
   @param time_range: optional indicates the timerange for the returned records. Accepts ('Xhour', 'Xday', 'Xweek', 'Xmonth') with X a positive integer, or ('today', 'yesterday', 'current-ween', 'last-week', 'current-month', 'last-month', 'ytd' ).
   @param data_filter filters data records to be returned
   @param sample_rate reduces the number of records to return (number between 0 and 1)
+  @param max_points optional maximum number of records to return, selected on the client side to keep the shape of the series (numeric data only).
+  @param method optional the downsampling method used with max_points: 'lttb' or 'minmax' (defaults to 'lttb'). See beebotte.aggregate.
   
   @return: array of records (JSON) on success, raises an error or failure.
   """
-  def read(self, limit = 750, owner = None, source = "live", time_range = None, data_filter = None, sample_rate = None):
+  def read(self, limit = 750, owner = None, source = "raw", time_range = None, data_filter = None, sample_rate = None, max_points = None, method = 'lttb'):
     if owner:
-      return self.bbt.publicRead( owner, self.channel, self.resource, limit, source, time_range, data_filter, sample_rate )
+      records = self.bbt.readPublic( owner, self.channel, self.resource, limit, source, time_range, data_filter, sample_rate )
     else:
-      return self.bbt.read(self.channel, self.resource, limit, source, time_range)
+      records = self.bbt.read(self.channel, self.resource, limit, source, time_range, data_filter, sample_rate)
+    if max_points is not None:
+      from beebotte.aggregate import downsample
+      records = downsample( records, max_points, method )
+    return records
 
   """
   Read
@@ -449,17 +1167,39 @@ class Resource:
   def recentVal(self):
     return self.bbt.read(self.channel, self.resource, limit = 1)[0]
 
+"""
+A single data record of a resource. DataPoint objects are immutable and use __slots__ to keep them compact.
+They compare equal when all their attributes are equal, and are hashable when their data is.
+"""
 class DataPoint:
-  channel  = None
-  resource = None
-  data     = None
-  ts       = None
+  __slots__ = ('channel', 'resource', 'data', 'ts')
 
   def __init__(self, data, ts, channel = None, resource = None):
-    self.channel  = channel
-    self.resource = resource
-    self.data     = data
-    self.ts       = ts
+    setattr = object.__setattr__
+    setattr(self, 'channel', channel)
+    setattr(self, 'resource', resource)
+    setattr(self, 'data', data)
+    setattr(self, 'ts', ts)
+
+  def __setattr__(self, name, value):
+    raise AttributeError("DataPoint is immutable")
+
+  def __delattr__(self, name):
+    raise AttributeError("DataPoint is immutable")
+
+  def __reduce__(self):
+    return ( DataPoint, ( self.data, self.ts, self.channel, self.resource ) )
+
+  def __eq__(self, other):
+    if type(other) is not DataPoint:
+      return NotImplemented
+    return self.ts == other.ts and self.data == other.data and self.channel == other.channel and self.resource == other.resource
+
+  def __hash__(self):
+    return hash( ( self.data, self.ts, self.channel, self.resource ) )
+
+  def __repr__(self):
+    return "DataPoint(data=%r, ts=%r, channel=%r, resource=%r)" % ( self.data, self.ts, self.channel, self.resource )
 
   @classmethod
   def fromJSON(cls, params):
@@ -469,6 +1209,157 @@ class DataPoint:
   def toJSON(self, owner = None):
     return {'owner': owner, 'channel': self.channel, 'resource': self.resource, 'data': self.data, 'ts': self.ts}
 
+"""
+Columnar sequence of data points of one resource, sorted by ascending timestamp.
+Timestamps are stored in a contiguous int64 array (milliseconds since epoch) and values in a contiguous float64 array
+when they are all numbers, or in a list otherwise. Slicing and time window selection return DataPointArray views
+sharing the underlying storage (no copy).
+"""
+class DataPointArray:
+  channel  = None
+  resource = None
+
+  """
+  Creates a columnar array from the given columns.
+
+  @param ts: optional array('q') of timestamps in milliseconds sorted in ascending order.
+  @param data: optional array('d') or list of values, same length as ts.
+  @param channel: optional channel name.
+  @param resource: optional resource name.
+  @param start: optional index of the first point of the columns exposed by this array (defaults to 0).
+  @param stop: optional index following the last point exposed by this array (defaults to the length of ts).
+  """
+  def __init__(self, ts = None, data = None, channel = None, resource = None, start = 0, stop = None):
+    self.channel  = channel
+    self.resource = resource
+    self._ts      = ts if ts is not None else array('q')
+    self._data    = data if data is not None else array('d')
+    self._start   = start
+    self._stop    = len(self._ts) if stop is None else stop
+
+  """
+  Builds a columnar array from records as returned by BBT.read (most recent first or oldest first).
+  The records are appended to the columns one at a time, so that they can be given by an iterator (such as a
+  streamed response) without being held in a list.
+
+  @param records: required iterable of records, each holding 'data' and 'ts' elements.
+  @param channel: optional channel name.
+  @param resource: optional resource name.
+  """
+  @classmethod
+  def fromJSON(cls, records, channel = None, resource = None):
+    ts = array('q')
+    data = array('d')
+    for record in records:
+      data = cls.__append__( ts, data, record )
+    return cls.__ordered__( ts, data, channel, resource )
+
+  """
+  Appends a record to the columns and returns the values column, turned into a list if the value is not a number.
+  """
+  @staticmethod
+  def __append__(ts, data, record):
+    value = record['data']
+    if type(data) is array and type(value) is not float and type(value) is not int:
+      data = list(data)
+    ts.append( record['ts'] )
+    data.append( value )
+    return data
+
+  """
+  Returns a columnar array of the given columns, reversed in place if they are sorted by descending timestamp.
+  """
+  @classmethod
+  def __ordered__(cls, ts, data, channel, resource):
+    if len(ts) > 1 and ts[0] > ts[-1]:
+      ts.reverse()
+      data.reverse()
+    return cls( ts, data, channel, resource )
+
+  """
+  Concatenates several columnar arrays (for instance the pages of a long read) into a new array.
+  The arrays are ordered by their first timestamp and should not overlap.
+  """
+  @classmethod
+  def concat(cls, arrays):
+    arrays = sorted( ( a for a in arrays if len(a) ), key = lambda a: a._ts[a._start] )
+    ts = array('q')
+    data = array('d')
+    for a in arrays:
+      if type(data) is array and type(a._data) is not array:
+        data = list(data)
+      ts.extend( a.ts )
+      if type(data) is array and type(a._data) is array:
+        data.frombytes( a.data.tobytes() )
+      else:
+        data.extend( a.data )
+    channel = arrays[0].channel if arrays else None
+    resource = arrays[0].resource if arrays else None
+    return cls( ts, data, channel, resource )
+
+  """
+  Timestamps column, a memoryview on the underlying int64 array.
+  """
+  @property
+  def ts(self):
+    return memoryview(self._ts)[self._start:self._stop]
+
+  """
+  Values column, a memoryview on the underlying float64 array. When the values are not all numbers, a list holding
+  a copy of the selected values.
+  """
+  @property
+  def data(self):
+    if type(self._data) is array:
+      return memoryview(self._data)[self._start:self._stop]
+    return self._data[self._start:self._stop]
+
+  def __len__(self):
+    return self._stop - self._start
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start, stop, step = index.indices( len(self) )
+      if step != 1:
+        raise ValueError("DataPointArray slices do not support steps")
+      return DataPointArray( self._ts, self._data, self.channel, self.resource, self._start + start, self._start + max(start, stop) )
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("DataPointArray index out of range")
+    return DataPoint( self._data[self._start + index], self._ts[self._start + index], self.channel, self.resource )
+
+  def __iter__(self):
+    for i in range( self._start, self._stop ):
+      yield DataPoint( self._data[i], self._ts[i], self.channel, self.resource )
+
+  """
+  Selects the points within a time window using a binary search on the timestamps.
+
+  @param start: optional first timestamp (inclusive) in milliseconds. None for no lower bound.
+  @param end: optional last timestamp (exclusive) in milliseconds. None for no upper bound.
+
+  @return: a DataPointArray view of the selected points.
+  """
+  def between(self, start = None, end = None):
+    lo = self._start if start is None else bisect.bisect_left( self._ts, start, self._start, self._stop )
+    hi = self._stop if end is None else bisect.bisect_left( self._ts, end, lo, self._stop )
+    return DataPointArray( self._ts, self._data, self.channel, self.resource, lo, hi )
+
+  """
+  Returns the columns as NumPy arrays (int64 timestamps and float64 or object values).
+  Numeric columns share memory with this array. Requires the numpy package.
+  """
+  def numpy(self):
+    import numpy
+    ts = numpy.frombuffer( self._ts, dtype = numpy.int64 )[self._start:self._stop]
+    if type(self._data) is array:
+      return ts, numpy.frombuffer( self._data, dtype = numpy.float64 )[self._start:self._stop]
+    return ts, numpy.array( self.data, dtype = object )
+
+  def toJSON(self, owner = None):
+    return [ point.toJSON(owner) for point in self ]
+
 class AuthenticationError(Exception):
     pass
 
@@ -493,6 +1384,12 @@ class PayloadLimitError(Exception):
 class UnexpectedError(Exception):
     pass
 
+class ServiceUnavailableError(Exception):
+    pass
+
+class CircuitOpenError(Exception):
+    pass
+
 class BadRequestError(Exception):
     pass
 
@@ -0,0 +1,299 @@
+"""Client-side filtering, aggregation and downsampling of resource data.
+
+Write side: Deadband, ChangeOnly and Window keep a small per-resource state and decide which samples (or
+aggregates) are sent; they are given to Resource (write_filter parameter). Read side: lttb and minmax select
+the indices of the points that best represent a series for charting, and downsample applies them to records
+or DataPointArray objects. aggregate computes windowed statistics over whole columns, with NumPy when installed.
+"""
+
+from array import array
+
+try: import numpy
+except ImportError: numpy = None
+
+from beebotte import DataPointArray
+
+__stats__ = ( 'mean', 'min', 'max', 'count', 'sum', 'first', 'last' )
+
+class Deadband:
+  __slots__ = ('threshold', 'max_silence', '_value', '_ts')
+
+  """
+  Sends a sample only if it differs from the last sent value by at least threshold, or if no sample was sent
+  for max_silence seconds. Non numeric samples are sent when they change.
+
+  @param threshold: required the minimum absolute change to send.
+  @param max_silence: optional maximum number of seconds between two sent samples. None for no limit.
+  """
+  def __init__(self, threshold, max_silence = None):
+    self.threshold   = threshold
+    self.max_silence = max_silence
+    self._value      = None
+    self._ts         = None
+
+  """
+  Feeds a sample and returns the list of (data, ts) to send (empty or with this sample).
+  """
+  def feed(self, data, ts):
+    last = self._value
+    if self._ts is not None and not self.__changed__( last, data ):
+      if self.max_silence is None or ts - self._ts < self.max_silence * 1000:
+        return []
+    self._value = data
+    self._ts    = ts
+    return [ ( data, ts ) ]
+
+  def flush(self):
+    return []
+
+  def __changed__(self, last, data):
+    try:
+      return abs( data - last ) >= self.threshold
+    except TypeError:
+      return data != last
+
+class ChangeOnly(Deadband):
+  __slots__ = ()
+
+  """
+  Sends a sample only if it differs from the last sent value, or if no sample was sent for max_silence seconds.
+
+  @param max_silence: optional maximum number of seconds between two sent samples. None for no limit.
+  """
+  def __init__(self, max_silence = None):
+    Deadband.__init__( self, 0, max_silence )
+
+  def __changed__(self, last, data):
+    return data != last
+
+class Window:
+  __slots__ = ('seconds', 'stat', '_start', '_count', '_sum', '_min', '_max', '_first', '_last')
+
+  """
+  Aggregates the samples over consecutive windows of the given duration, aligned on multiples of it, and sends
+  one aggregate per window, timestamped with the start of the window. The aggregate of a window is sent when
+  a sample of a later window is fed, or by flush().
+
+  @param seconds: required the duration of a window in seconds.
+  @param stat: optional the statistic to send: one of 'mean', 'min', 'max', 'count', 'sum', 'first', 'last', or a
+    tuple of them to send a dict of statistics (defaults to 'mean').
+  """
+  def __init__(self, seconds, stat = 'mean'):
+    for name in ( stat if isinstance(stat, tuple) else ( stat, ) ):
+      if name not in __stats__:
+        raise ValueError("unknown statistic %r" % (name,))
+    self.seconds = seconds
+    self.stat    = stat
+    self._start  = None
+
+  """
+  Feeds a sample and returns the list of (data, ts) to send: the aggregate of the previous window when this
+  sample starts a new one.
+  """
+  def feed(self, data, ts):
+    width = int( self.seconds * 1000 )
+    start = ts - ts % width
+    result = []
+    if self._start is not None and start != self._start:
+      result = self.flush()
+    if self._start is None:
+      self._start = start
+      self._count = 0
+      self._sum   = 0
+      self._min   = data
+      self._max   = data
+      self._first = data
+    self._count += 1
+    self._sum   += data
+    if data < self._min:
+      self._min = data
+    if data > self._max:
+      self._max = data
+    self._last = data
+    return result
+
+  """
+  Returns the aggregate of the current window as a list of (data, ts), and starts a new window.
+  """
+  def flush(self):
+    if self._start is None:
+      return []
+    values = { 'mean': self._sum / float(self._count), 'min': self._min, 'max': self._max, 'count': self._count,
+               'sum': self._sum, 'first': self._first, 'last': self._last }
+    start = self._start
+    self._start = None
+    if isinstance(self.stat, tuple):
+      return [ ( dict( ( name, values[name] ) for name in self.stat ), start ) ]
+    return [ ( values[self.stat], start ) ]
+
+"""
+Largest-Triangle-Three-Buckets downsampling: selects threshold points keeping the visual shape of the series.
+
+@param ts: required sequence of timestamps in ascending order.
+@param values: required sequence of numeric values.
+@param threshold: required the number of points to keep.
+
+@return: the list of the indices of the selected points, in ascending order.
+"""
+def lttb(ts, values, threshold):
+  n = len(ts)
+  if threshold >= n:
+    return list( range(n) )
+  if threshold < 3:
+    return [ 0, n - 1 ][:max( threshold, 0 )]
+  if numpy is not None:
+    return __lttbNumpy__( ts, values, threshold )
+  every = ( n - 2 ) / float( threshold - 2 )
+  selected = [ 0 ]
+  a = 0
+  for i in range( threshold - 2 ):
+    start = int( i * every ) + 1
+    end = int( ( i + 1 ) * every ) + 1
+    nextStart = end
+    nextEnd = min( int( ( i + 2 ) * every ) + 1, n )
+    count = nextEnd - nextStart
+    avgX = sum( ts[j] for j in range( nextStart, nextEnd ) ) / float(count)
+    avgY = sum( values[j] for j in range( nextStart, nextEnd ) ) / float(count)
+    ax = ts[a]
+    ay = values[a]
+    best = -1.0
+    chosen = start
+    for j in range( start, end ):
+      area = abs( ( ax - avgX ) * ( values[j] - ay ) - ( ax - ts[j] ) * ( avgY - ay ) )
+      if area > best:
+        best = area
+        chosen = j
+    selected.append( chosen )
+    a = chosen
+  selected.append( n - 1 )
+  return selected
+
+def __lttbNumpy__(ts, values, threshold):
+  n = len(ts)
+  x = numpy.asarray( ts, dtype = numpy.float64 )
+  y = numpy.asarray( values, dtype = numpy.float64 )
+  every = ( n - 2 ) / float( threshold - 2 )
+  edges = ( numpy.arange( threshold - 1 ) * every ).astype( numpy.int64 ) + 1
+  edges[-1] = n - 1
+  selected = [ 0 ]
+  a = 0
+  for i in range( threshold - 2 ):
+    start, end = edges[i], edges[i + 1]
+    if i + 2 < len(edges):
+      avgX = x[end:edges[i + 2]].mean()
+      avgY = y[end:edges[i + 2]].mean()
+    else:
+      avgX, avgY = x[n - 1], y[n - 1]
+    area = numpy.abs( ( x[a] - avgX ) * ( y[start:end] - y[a] ) - ( x[a] - x[start:end] ) * ( avgY - y[a] ) )
+    a = int( start + area.argmax() )
+    selected.append( a )
+  selected.append( n - 1 )
+  return selected
+
+"""
+Min-max downsampling: splits the series in threshold / 2 buckets and keeps the minimum and the maximum of each,
+preserving the peaks.
+
+@param ts: required sequence of timestamps in ascending order.
+@param values: required sequence of numeric values.
+@param threshold: required the maximum number of points to keep.
+
+@return: the list of the indices of the selected points, in ascending order.
+"""
+def minmax(ts, values, threshold):
+  n = len(ts)
+  buckets = threshold // 2
+  if threshold >= n or buckets < 1:
+    return list( range( min( n, threshold ) ) )
+  selected = []
+  size = n / float(buckets)
+  for b in range(buckets):
+    start = int( b * size )
+    end = int( ( b + 1 ) * size ) if b < buckets - 1 else n
+    if start >= end:
+      continue
+    low = high = start
+    for j in range( start + 1, end ):
+      v = values[j]
+      if v < values[low]:
+        low = j
+      elif v > values[high]:
+        high = j
+    selected.extend( sorted( set( ( low, high ) ) ) )
+  return selected
+
+"""
+Downsamples records (as returned by BBT.read) or a DataPointArray to at most threshold points.
+
+@param points: required a list of records with numeric 'data' and 'ts' elements, or a DataPointArray.
+@param threshold: required the maximum number of points to keep.
+@param method: optional 'lttb' or 'minmax' (defaults to 'lttb').
+
+@return: the selected records (in their original order) or a new DataPointArray.
+"""
+def downsample(points, threshold, method = 'lttb'):
+  select = { 'lttb': lttb, 'minmax': minmax }.get( method )
+  if select is None:
+    raise ValueError("unknown downsampling method %r" % (method,))
+  if isinstance(points, DataPointArray):
+    indices = select( points.ts, points.data, threshold )
+    ts = array( 'q', ( points.ts[i] for i in indices ) )
+    data = points.data
+    values = array( 'd', ( data[i] for i in indices ) ) if isinstance(data, memoryview) else [ data[i] for i in indices ]
+    return DataPointArray( ts, values, points.channel, points.resource )
+  if len(points) <= threshold:
+    return list(points)
+  descending = len(points) > 1 and points[0]['ts'] > points[-1]['ts']
+  ordered = points[::-1] if descending else points
+  indices = select( [ r['ts'] for r in ordered ], [ r['data'] for r in ordered ], threshold )
+  result = [ ordered[i] for i in indices ]
+  return result[::-1] if descending else result
+
+"""
+Computes a statistic over consecutive time windows of a DataPointArray, aligned on multiples of the window
+duration. Uses NumPy when installed.
+
+@param points: required a DataPointArray with numeric values.
+@param seconds: required the duration of a window in seconds.
+@param stat: optional one of 'mean', 'min', 'max', 'count', 'sum', 'first', 'last' (defaults to 'mean').
+
+@return: a DataPointArray with one point per non empty window, timestamped with the start of the window.
+"""
+def aggregate(points, seconds, stat = 'mean'):
+  if stat not in __stats__:
+    raise ValueError("unknown statistic %r" % (stat,))
+  width = int( seconds * 1000 )
+  if not len(points):
+    return DataPointArray( channel = points.channel, resource = points.resource )
+  if numpy is not None:
+    ts, values = points.numpy()
+    values = values.astype( numpy.float64 )
+    starts = ts - ts % width
+    index = numpy.flatnonzero( numpy.r_[ True, starts[1:] != starts[:-1] ] )
+    counts = numpy.diff( numpy.r_[ index, len(ts) ] )
+    if stat == 'mean':
+      result = numpy.add.reduceat( values, index ) / counts
+    elif stat == 'sum':
+      result = numpy.add.reduceat( values, index )
+    elif stat == 'min':
+      result = numpy.minimum.reduceat( values, index )
+    elif stat == 'max':
+      result = numpy.maximum.reduceat( values, index )
+    elif stat == 'count':
+      result = counts.astype( numpy.float64 )
+    elif stat == 'first':
+      result = values[index]
+    else:
+      result = values[ numpy.r_[ index[1:], len(ts) ] - 1 ]
+    return DataPointArray( array( 'q', starts[index].tobytes() ), array( 'd', result.tobytes() ), points.channel, points.resource )
+  window = Window( seconds, stat )
+  ts = array('q')
+  data = array('d')
+  for point in points:
+    for value, start in window.feed( point.data, point.ts ):
+      ts.append( start )
+      data.append( value )
+  for value, start in window.flush():
+    ts.append( start )
+    data.append( value )
+  return DataPointArray( ts, data, points.channel, points.resource )
@@ -0,0 +1,453 @@
+"""Asyncio client for Beebotte.
+
+Provides coroutine versions of the BBT API calls on top of a pooled aiohttp transport.
+Requires the aiohttp package.
+"""
+
+import time
+import asyncio
+from array import array
+
+try: import aiohttp
+except ImportError: aiohttp = None
+
+try: import urllib.parse as urllib
+except ImportError: import urllib
+
+from beebotte import BBT, DataPoint, DataPointArray, CircuitOpenError, __writeEndpoint__, __publishEndpoint__
+from beebotte.metrics import RequestInfo
+from beebotte.encoding import SpooledBody, ArrayDecoder
+
+class AsyncBBT(BBT):
+  max_concurrency = None
+
+  """
+  Creates an asyncio connector holding user credentials and connection parameters.
+  Request signing and error mapping are shared with BBT; only the transport differs.
+  Use it as an asynchronous context manager or call close() to release the connections.
+
+  @param akey: The user's API key (access key) to be passed along the authentication parameters.
+  @param skey: The user's secret key to be used to sign API calls.
+  @param hostname: The host name where the API is implemented.
+  @param port: The port number.
+  @param ssl: Indicates if SSL (TLS) should be used.
+  @param pool_connections: optional number of hosts the connection pool may hold connections to (defaults to 10).
+  @param pool_maxsize: optional maximum number of connections kept alive per host (defaults to 100).
+  @param keepalive_timeout: optional number of seconds an idle connection is kept before being closed (defaults to 60).
+  @param max_concurrency: optional maximum number of API calls in flight at once, further calls wait for a free slot (defaults to 1000).
+  @param retry_policy: optional RetryPolicy (beebotte.retry). Give it transient_errors = (aiohttp.ClientError, asyncio.TimeoutError) to retry on aiohttp network errors.
+  @param rate_limiter: optional RateLimiter (beebotte.retry) bounding the rate of API calls.
+  @param circuit_breaker: optional CircuitBreaker (beebotte.retry) failing calls fast while the backend is unhealthy.
+  @param encoder: optional BulkEncoder used to serialize write and publish bodies. See BBT.
+  @param compression: optional content encoding used to compress write and publish bodies ('gzip' or 'deflate'). See BBT.
+  @param compression_threshold: optional minimum body size in bytes to compress (defaults to 1024).
+  @param compression_level: optional compression level from 1 to 9 (defaults to 6).
+  @param stream_threshold: optional number of records from which bulk bodies are encoded to a spooled temporary file (defaults to 10000). See BBT.
+  @param transport: optional aiohttp.ClientSession to send the requests through instead of a session created by the connector.
+    The pool parameters do not apply to it and close() does not close it.
+  @param cache: not supported: a ReadCache (beebotte.cache) shares results between threads, not coroutines. Must be None.
+  """
+  def __init__(self, akey, skey, hostname = "api.beebotte.com", port = "80", ssl = False,
+               pool_connections = 10, pool_maxsize = 100, keepalive_timeout = 60, max_concurrency = 1000,
+               retry_policy = None, rate_limiter = None, circuit_breaker = None, encoder = None, compression = None,
+               compression_threshold = 1024, compression_level = 6, stream_threshold = 10000, transport = None, cache = None):
+    if aiohttp is None:
+      raise ImportError("AsyncBBT requires the aiohttp package")
+    if cache is not None:
+      raise ValueError("AsyncBBT does not support a read cache")
+    BBT.__init__(self, akey, skey, hostname, port, ssl, pool_connections = pool_connections,
+                 pool_maxsize = pool_maxsize, keepalive_timeout = keepalive_timeout, encoder = encoder,
+                 retry_policy = retry_policy, rate_limiter = rate_limiter, circuit_breaker = circuit_breaker,
+                 compression = compression, compression_threshold = compression_threshold,
+                 compression_level = compression_level, stream_threshold = stream_threshold)
+    self.max_concurrency = max_concurrency
+    self._session        = transport
+    self._ownSession     = transport is None
+    self._semaphore      = None
+
+  """
+  The connector sends its requests through an aiohttp session, created on first use: no BBT transport is built.
+  """
+  def __newTransport__(self):
+    return None
+
+  def __enter__(self):
+    raise TypeError("AsyncBBT must be used with 'async with'")
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    await self.close()
+
+  """
+  Closes all pooled connections. The client remains usable; a new pool is created on the next API call.
+  """
+  async def close(self):
+    if not self._ownSession:
+      return
+    session = self._session
+    self._session = None
+    if session is not None:
+      await session.close()
+
+  """
+  Returns statistics of the connection pool: connections in use and connections currently idle in the pool.
+  See BBT.pool_stats. aiohttp does not expose these counts publicly: they are read from its connector on a best
+  effort basis and are reported as 0 if it does not have them. 'limit' and 'limit_per_host' give the connector limits.
+  """
+  def pool_stats(self):
+    stats = { 'pools': 0, 'connections': 0, 'requests': 0, 'idle': 0 }
+    session = self._session
+    if session is None or session.closed:
+      return stats
+    connector = session.connector
+    stats['limit'] = connector.limit
+    stats['limit_per_host'] = connector.limit_per_host
+    idle = sum( len(conns) for conns in getattr(connector, '_conns', {}).values() )
+    stats['pools'] = len( getattr(connector, '_conns', {}) )
+    stats['idle'] = idle
+    stats['connections'] = len( getattr(connector, '_acquired', ()) ) + idle
+    return stats
+
+  """
+  Returns the pooled aiohttp session, creating it on first use. Must be called from within the event loop.
+  """
+  def __connection__(self):
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore( self.max_concurrency )
+    if self._ownSession and ( self._session is None or self._session.closed ):
+      if self.keepalive_timeout is None:
+        connector = aiohttp.TCPConnector( limit = self.pool_connections * self.pool_maxsize, limit_per_host = self.pool_maxsize )
+      else:
+        connector = aiohttp.TCPConnector( limit = self.pool_connections * self.pool_maxsize, limit_per_host = self.pool_maxsize,
+                                          keepalive_timeout = self.keepalive_timeout )
+      self._session   = aiohttp.ClientSession( connector = connector )
+      self._semaphore = asyncio.Semaphore( self.max_concurrency )
+    return self._session
+
+  async def __execute__(self, send, idempotent):
+    attempt = 0
+    error = None
+    while True:
+      attempt += 1
+      if self.circuit_breaker is not None:
+        try:
+          self.circuit_breaker.before()
+        except CircuitOpenError:
+          if error is None:
+            raise
+          raise error
+      if self.rate_limiter is not None:
+        wait = self.rate_limiter.reserve()
+        if wait > 0:
+          await asyncio.sleep( wait )
+      try:
+        result = await send()
+      except Exception as e:
+        if self.circuit_breaker is not None:
+          self.circuit_breaker.record(e)
+        delay = self.retry_policy.delay( e, attempt, idempotent ) if self.retry_policy is not None else None
+        if delay is None:
+          raise
+        error = e
+        await asyncio.sleep( delay )
+        continue
+      if self.circuit_breaker is not None:
+        self.circuit_breaker.record()
+      return result
+
+  async def __instrument__(self, info, send, idempotent):
+    hooks = self._hooks
+    for hook in hooks:
+      try:
+        hook.request_start(info)
+      except Exception:
+        pass
+    try:
+      return await self.__execute__( send, idempotent )
+    except Exception as e:
+      info.error = e
+      info.error_code = getattr(e, 'code', None)
+      raise
+    finally:
+      info.duration = time.perf_counter() - info.started
+      for hook in hooks:
+        try:
+          hook.request_end(info)
+        except Exception:
+          pass
+
+  async def __request__(self, method, url, data, headers, info):
+    session = self.__connection__()
+    async with self._semaphore:
+      started = time.perf_counter()
+      async with session.request( method, url, data = data, headers = headers ) as r:
+        body = await r.read()
+        parsing = time.perf_counter()
+        if info is not None:
+          info.phases['network'] = parsing - started
+          info.status = r.status
+          info.bytes_received = len(body)
+        text = await r.text()
+        try:
+          return self.__processResponse__( { 'status': r.status, 'data': text, 'headers': r.headers } )
+        finally:
+          if info is not None:
+            info.phases['parse'] = time.perf_counter() - parsing
+
+  async def __chunks__(self, file, chunk_size = 1 << 16):
+    while True:
+      chunk = file.read( chunk_size )
+      if not chunk:
+        return
+      yield chunk
+
+  async def __postData__(self, uri, data, auth = True, encode_started = None):
+    info = None
+    if self._hooks:
+      info = RequestInfo( 'POST', uri )
+      if encode_started is not None:
+        info.phases['encode'] = info.started - encode_started
+    data, encoding = self.__compress__( data )
+    if info is not None:
+      if encoding is not None:
+        info.phases['compress'] = time.perf_counter() - info.started
+      info.bytes_sent = len(data)
+    async def send():
+      if info is not None:
+        info.attempts += 1
+      headers = self.__postHeaders__( uri, data, auth, info.phases if info is not None else None, encoding )
+      body = self.__chunks__( data.rewind() ) if isinstance(data, SpooledBody) else data
+      return await self.__request__( 'POST', self.__url__( uri ), body, headers, info )
+    if info is None:
+      return await self.__execute__( send, False )
+    return await self.__instrument__( info, send, False )
+
+  async def __getData__(self, uri, query, auth = True):
+    full_uri = "%s?%s" % ( uri, urllib.urlencode( query ) )
+    info = RequestInfo( 'GET', full_uri ) if self._hooks else None
+    async def send():
+      if info is not None:
+        info.attempts += 1
+      headers = self.__getHeaders__( full_uri, auth, info.phases if info is not None else None )
+      return await self.__request__( 'GET', self._baseUrl + full_uri, None, headers, info )
+    if info is None:
+      return await self.__execute__( send, True )
+    return await self.__instrument__( info, send, True )
+
+  """
+  Sends a GET request and decodes the response array as it is received (asynchronous iterator). See BBT.__getStream__.
+  The concurrency slot of the call is held until the response is read or the iteration is abandoned.
+  """
+  async def __getStream__(self, uri, query, auth = True, chunk_size = 1 << 16):
+    full_uri = "%s?%s" % ( uri, urllib.urlencode( query ) )
+    info = RequestInfo( 'GET', full_uri ) if self._hooks else None
+    hooks = self._hooks if info is not None else ()
+    async def send():
+      if info is not None:
+        info.attempts += 1
+      headers = self.__getHeaders__( full_uri, auth, info.phases if info is not None else None )
+      session = self.__connection__()
+      await self._semaphore.acquire()
+      try:
+        started = time.perf_counter()
+        r = await session.request( 'GET', self._baseUrl + full_uri, headers = headers )
+      except BaseException:
+        self._semaphore.release()
+        raise
+      if info is not None:
+        info.phases['network'] = time.perf_counter() - started
+        info.status = r.status
+      if r.status < 400:
+        return r
+      try:
+        text = await r.text()
+      finally:
+        r.release()
+        self._semaphore.release()
+      return self.__processResponse__( { 'status': r.status, 'data': text, 'headers': r.headers } )
+
+    for hook in hooks:
+      try:
+        hook.request_start(info)
+      except Exception:
+        pass
+    try:
+      r = await self.__execute__( send, True )
+      try:
+        decoder = ArrayDecoder()
+        async for chunk in r.content.iter_chunked( chunk_size ):
+          if info is None:
+            records = decoder.feed( chunk )
+          else:
+            started = time.perf_counter()
+            records = decoder.feed( chunk )
+            info.phases['parse'] = info.phases.get( 'parse', 0 ) + time.perf_counter() - started
+            info.bytes_received += len(chunk)
+          for record in records:
+            yield record
+        for record in decoder.close():
+          yield record
+      finally:
+        r.release()
+        self._semaphore.release()
+    except Exception as e:
+      if info is not None:
+        info.error = e
+        info.error_code = getattr(e, 'code', None)
+      raise
+    finally:
+      if info is not None:
+        info.duration = time.perf_counter() - info.started
+        for hook in hooks:
+          try:
+            hook.request_end(info)
+          except Exception:
+            pass
+
+  async def __batches__(self, records, channel, resource, batch_size, as_columns):
+    if not batch_size:
+      async for record in records:
+        yield DataPoint( record['data'], record['ts'], channel, resource )
+      return
+    batch = []
+    async for record in records:
+      batch.append( record )
+      if len(batch) >= batch_size:
+        yield self.__batch__( batch, channel, resource, as_columns )
+        batch = []
+    if batch:
+      yield self.__batch__( batch, channel, resource, as_columns )
+
+  """
+  Streamed Read (asynchronous iterator, used with 'async for'). See BBT.read_stream.
+  """
+  def read_stream(self, channel, resource, limit = 750, source = "raw", time_range = None, data_filter = None, sample_rate = None,
+                  owner = None, batch_size = None, as_columns = False, chunk_size = 1 << 16):
+    return BBT.read_stream( self, channel, resource, limit, source, time_range, data_filter, sample_rate, owner, batch_size, as_columns, chunk_size )
+
+  """
+  Multiple Read (coroutine). See BBT.read_many.
+  The reads run as tasks of the event loop, at most max_concurrency of them at once.
+  """
+  async def read_many(self, reads, max_concurrency = None, timeout = None):
+    semaphore = asyncio.Semaphore( max_concurrency or self.pool_maxsize )
+    async def run(entry):
+      async with semaphore:
+        return await self.__readEntry__( entry )
+
+    tasks = [ asyncio.ensure_future( run(entry) ) for entry in reads ]
+    if not tasks:
+      return []
+    done, pending = await asyncio.wait( tasks, timeout = timeout )
+    results = []
+    for task in tasks:
+      if task in pending:
+        task.cancel()
+        results.append( TimeoutError("read did not complete before the deadline") )
+      elif task.exception() is not None:
+        results.append( task.exception() )
+      else:
+        results.append( task.result() )
+    return results
+
+  """
+  Iterative Read (asynchronous iterator, used with 'async for'). See BBT.read_iter.
+  The next page is requested in a background task while the current one is consumed.
+  """
+  async def read_iter(self, channel, resource, time_range = None, page_size = 750, source = "raw", owner = None, data_filter = None, sample_rate = None):
+    endpoint, query, cursor = self.__pageQuery__( channel, resource, time_range, page_size, source, owner, data_filter, sample_rate )
+    future = None
+    try:
+      page = await self.__fetchPage__( endpoint, query, cursor, not owner )
+      skip = 0
+      while page:
+        following = self.__nextPage__( page, cursor, page_size )
+        future = asyncio.ensure_future( self.__fetchPage__( endpoint, query, following[0], not owner ) ) if following else None
+        for point in self.__pagePoints__( page, cursor, skip, channel, resource ):
+          yield point
+        if future is None:
+          return
+        cursor, skip = following
+        page = await future
+        future = None
+    finally:
+      if future is not None:
+        future.cancel()
+
+  """
+  Public Read (coroutine). See BBT.readPublic.
+  """
+  async def readPublic(self, owner, channel, resource, limit = 750, source = "raw", time_range = None, data_filter = None, sample_rate = None, as_columns = False):
+    if as_columns:
+      endpoint, query = self.__readQuery__( channel, resource, limit, source, time_range, data_filter, sample_rate, owner )
+      return await self.__columns__( self.__getStream__( endpoint, query, False ), channel, resource )
+    return await BBT.readPublic( self, owner, channel, resource, limit, source, time_range, data_filter, sample_rate )
+
+  """
+  Read (coroutine). See BBT.read.
+  """
+  async def read(self, channel, resource, limit = 1, source = "raw", time_range = None, data_filter = None, sample_rate = None, as_columns = False):
+    if as_columns:
+      endpoint, query = self.__readQuery__( channel, resource, limit, source, time_range, data_filter, sample_rate, None )
+      return await self.__columns__( self.__getStream__( endpoint, query, True ), channel, resource )
+    return await BBT.read( self, channel, resource, limit, source, time_range, data_filter, sample_rate )
+
+  """
+  Decodes a streamed read into a DataPointArray as the response is received. See DataPointArray.fromJSON.
+  """
+  async def __columns__(self, records, channel, resource):
+    ts = array('q')
+    data = array('d')
+    async for record in records:
+      data = DataPointArray.__append__( ts, data, record )
+    return DataPointArray.__ordered__( ts, data, channel, resource )
+
+  """
+  Write (coroutine). See BBT.write.
+  """
+  async def write(self, channel, resource, data, ts = None):
+    return await BBT.write( self, channel, resource, data, ts )
+
+  """
+  Bulk Write (coroutine). See BBT.writeBulk.
+  """
+  async def writeBulk(self, channel, data_array):
+    return await self.__postBulk__( __writeEndpoint__, channel, data_array )
+
+  """
+  Publish (coroutine). See BBT.publish.
+  """
+  async def publish(self, channel, resource, data, ts = None, source = None):
+    return await BBT.publish( self, channel, resource, data, ts, source )
+
+  """
+  Bulk Publish (coroutine). See BBT.publishBulk.
+  """
+  async def publishBulk(self, channel, data_array):
+    return await self.__postBulk__( __publishEndpoint__, channel, data_array )
+
+  """
+  Encodes and sends the body of a bulk call, closing it once sent if it was streamed to a temporary file.
+  """
+  async def __postBulk__(self, base, channel, data_array):
+    started = time.perf_counter() if self._hooks else None
+    body = self.__encodeBulk__( data_array )
+    try:
+      return await self.__postData__( self.__endpoint__( base, channel ), body, True, started )
+    finally:
+      if isinstance(body, SpooledBody):
+        body.close()
+
+  """
+  Client Authentication (coroutine). See BBT.auth_client.
+  """
+  async def auth_client(self, sid, channel, resource = '*', ttl = 0, read = False, write = False):
+    return BBT.auth_client( self, sid, channel, resource, ttl, read, write )
+
+  """
+  Batch Client Authentication (coroutine). See BBT.auth_clients.
+  """
+  async def auth_clients(self, sids, channel, resource = '*', ttl = 0, read = False, write = False):
+    return BBT.auth_clients( self, sids, channel, resource, ttl, read, write )
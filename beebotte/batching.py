@@ -0,0 +1,350 @@
+"""Background batching of Beebotte write and publish calls.
+
+Coalesces individual write/publish calls into writeBulk/publishBulk API calls. CoalescingPublisher keeps only
+the latest value of each resource and publishes the changed ones at a fixed rate.
+"""
+
+import time
+import threading
+import collections
+from concurrent.futures import Future, wait
+
+from beebotte import PayloadLimitError
+from beebotte.encoding import BulkEncoder
+
+__bulkOverhead__ = len('{"data":[]}')
+
+class _Batch:
+  __slots__ = ('kind', 'channel', 'deadline', 'size', 'items')
+
+  def __init__(self, kind, channel, deadline):
+    self.kind     = kind
+    self.channel  = channel
+    self.deadline = deadline
+    self.size     = __bulkOverhead__
+    self.items    = []
+
+class BatchingWriter:
+  bbt               = None
+  max_batch_size    = None
+  max_linger        = None
+  max_payload_bytes = None
+
+  """
+  Queues write and publish calls and sends them from a background thread as bulk API calls, one bulk call per
+  channel and message kind. A batch is sent as soon as it holds max_batch_size records, when adding a record would
+  take its JSON body over max_payload_bytes, or max_linger seconds after its first record was queued. Record sizes
+  are measured with the encoder of the connector, as they are sent (before compression).
+  If the server still rejects a batch as too large (PayloadLimitError), the batch is split in two and resent, and
+  max_payload_bytes is lowered accordingly.
+
+  @param bbt: required reference to the Beebotte client connector.
+  @param max_batch_size: optional maximum number of records per bulk call (defaults to 500).
+  @param max_linger: optional maximum number of seconds a record waits in the queue before being sent (defaults to 0.5).
+  @param max_payload_bytes: optional maximum size in bytes of a bulk call body (defaults to 32768).
+  """
+  def __init__(self, bbt, max_batch_size = 500, max_linger = 0.5, max_payload_bytes = 32768):
+    self.bbt               = bbt
+    self.max_batch_size    = max_batch_size
+    self.max_linger        = max_linger
+    self.max_payload_bytes = max_payload_bytes
+
+    self._encoder  = getattr(bbt, 'encoder', None) or BulkEncoder()
+    self._cond     = threading.Condition()
+    self._pending  = {}
+    self._ready    = collections.deque()
+    self._inflight = []
+    self._closed   = False
+    self._thread   = threading.Thread( target = self.__run__, name = "beebotte-batching-writer", daemon = True )
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Write (Persistent messages)
+  Queues data to be written to the resource with the given metadata.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to write to.
+  @param data: required the value to write (persist).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+
+  @return: a Future resolved with the bulk call response once the record is sent, or with the error raised by the bulk call.
+  """
+  def write(self, channel, resource, data, ts = None):
+    record = { 'resource': resource, 'data': data, 'ts': ts if ts else round(time.time() * 1000) }
+    return self.__enqueue__( 'write', channel, record )
+
+  """
+  Publish (Transient messages)
+  Queues data to be published to the resource with the given metadata.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to publish to.
+  @param data: required the data to publish (transient).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+  @param source: optional additional data that will be appended to the published message.
+
+  @return: a Future resolved with the bulk call response once the record is sent, or with the error raised by the bulk call.
+  """
+  def publish(self, channel, resource, data, ts = None, source = None):
+    record = { 'resource': resource, 'data': data, 'ts': ts if ts else round(time.time() * 1000) }
+    if source:
+      record['source'] = source
+    return self.__enqueue__( 'publish', channel, record )
+
+  """
+  Sends all queued records without waiting for their linger time and waits until they are acknowledged.
+
+  @param timeout: optional maximum number of seconds to wait.
+
+  @return: true if all the records queued before the call have been sent, false if the timeout expired.
+  """
+  def flush(self, timeout = None):
+    with self._cond:
+      self._ready.extend( self._pending.values() )
+      self._pending.clear()
+      futures = [ f for batch in self._ready for _, f, _ in batch.items ] + self._inflight
+      self._cond.notify_all()
+    done, not_done = wait( futures, timeout )
+    return not not_done
+
+  """
+  Flushes the queued records and stops the background thread. Further write/publish calls raise a RuntimeError.
+
+  @param timeout: optional maximum number of seconds to wait for the queued records to be sent.
+  """
+  def close(self, timeout = None):
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    self._thread.join( timeout )
+
+  def __enqueue__(self, kind, channel, record):
+    future = Future()
+    size = self._encoder.recordSize( record )
+    key = (kind, channel)
+    with self._cond:
+      if self._closed:
+        raise RuntimeError("BatchingWriter is closed")
+      batch = self._pending.get(key)
+      if batch is not None and batch.size + size > self.max_payload_bytes:
+        self._ready.append( self._pending.pop(key) )
+        batch = None
+      if batch is None:
+        batch = _Batch( kind, channel, time.monotonic() + self.max_linger )
+        self._pending[key] = batch
+      batch.items.append( (record, future, size) )
+      batch.size += size
+      if len(batch.items) >= self.max_batch_size:
+        self._ready.append( self._pending.pop(key) )
+      self._cond.notify()
+    return future
+
+  def __nextBatch__(self):
+    with self._cond:
+      while True:
+        now = time.monotonic()
+        for key in [ k for k, b in self._pending.items() if b.deadline <= now or self._closed ]:
+          self._ready.append( self._pending.pop(key) )
+        if self._ready:
+          batch = self._ready.popleft()
+          self._inflight = [ f for _, f, _ in batch.items ]
+          return batch
+        if self._closed:
+          return None
+        if self._pending:
+          self._cond.wait( min( b.deadline for b in self._pending.values() ) - now )
+        else:
+          self._cond.wait()
+
+  def __run__(self):
+    while True:
+      batch = self.__nextBatch__()
+      if batch is None:
+        return
+      items = [ item for item in batch.items if item[1].set_running_or_notify_cancel() ]
+      if items:
+        self.__send__( batch.kind, batch.channel, items )
+      with self._cond:
+        self._inflight = []
+
+  def __send__(self, kind, channel, items):
+    try:
+      records = [ record for record, _, _ in items ]
+      if kind == 'write':
+        response = self.bbt.writeBulk( channel, records )
+      else:
+        response = self.bbt.publishBulk( channel, records )
+    except PayloadLimitError as e:
+      if len(items) == 1:
+        items[0][1].set_exception(e)
+        return
+      size = __bulkOverhead__ + sum( s for _, _, s in items )
+      with self._cond:
+        self.max_payload_bytes = min( self.max_payload_bytes, max( size // 2, __bulkOverhead__ + 1 ) )
+      half = len(items) // 2
+      self.__send__( kind, channel, items[:half] )
+      self.__send__( kind, channel, items[half:] )
+      return
+    except Exception as e:
+      for _, future, _ in items:
+        future.set_exception(e)
+      return
+    for _, future, _ in items:
+      future.set_result(response)
+
+class _Slot:
+  __slots__ = ('data', 'ts', 'source', 'dirty', 'sent', 'min_interval')
+
+  def __init__(self, min_interval):
+    self.dirty        = False
+    self.sent         = None
+    self.min_interval = min_interval
+
+class CoalescingPublisher:
+  bbt          = None
+  interval     = None
+  min_interval = None
+  published    = 0
+  coalesced    = 0
+  calls        = 0
+  errors       = 0
+  last_error   = None
+
+  """
+  Publishes the latest value of each channel resource at a bounded rate: publish() only stores the value in the
+  slot of its resource (last value wins), and a background thread sends the values that changed since the last
+  flush every interval seconds, as one publishBulk call per channel. A resource is not sent more often than its
+  minimum interval; its latest value waits for the next flush. Values whose publication failed are sent again at
+  the next flush unless replaced by a newer one.
+
+  @param bbt: required reference to the Beebotte client connector.
+  @param interval: optional number of seconds between two flushes (defaults to 1).
+  @param min_interval: optional minimum number of seconds between two publications of the same resource (defaults to 0).
+  @param min_intervals: optional dict of per resource minimum intervals, keyed by (channel, resource) tuples.
+  """
+  def __init__(self, bbt, interval = 1.0, min_interval = 0, min_intervals = None):
+    self.bbt          = bbt
+    self.interval     = interval
+    self.min_interval = min_interval
+    self._intervals   = dict( min_intervals or {} )
+    self._slots       = {}
+    self._cond        = threading.Condition()
+    self._closed      = False
+    self._thread      = threading.Thread( target = self.__run__, name = "beebotte-coalescing-publisher", daemon = True )
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Publish (Transient messages)
+  Stores the latest value of the resource, to be published at the next flush. Never blocks on the network.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to publish to.
+  @param data: required the data to publish (transient).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+  @param source: optional additional data that will be appended to the published message.
+  """
+  def publish(self, channel, resource, data, ts = None, source = None):
+    key = ( channel, resource )
+    ts = ts if ts else round(time.time() * 1000)
+    with self._cond:
+      if self._closed:
+        raise RuntimeError("CoalescingPublisher is closed")
+      slot = self._slots.get( key )
+      if slot is None:
+        slot = self._slots[key] = _Slot( self._intervals.get( key, self.min_interval ) )
+      elif slot.dirty:
+        self.coalesced += 1
+      slot.data   = data
+      slot.ts     = ts
+      slot.source = source
+      slot.dirty  = True
+
+  """
+  Sets the minimum number of seconds between two publications of a resource.
+  """
+  def set_min_interval(self, channel, resource, seconds):
+    key = ( channel, resource )
+    with self._cond:
+      self._intervals[key] = seconds
+      if key in self._slots:
+        self._slots[key].min_interval = seconds
+
+  """
+  Publishes the values changed since the last flush now.
+
+  @param force: optional publish the changed values even if their minimum interval has not elapsed (defaults to False).
+
+  @return: the number of values published.
+  """
+  def flush(self, force = False):
+    now = time.monotonic()
+    batches = {}
+    with self._cond:
+      for ( channel, resource ), slot in self._slots.items():
+        if not slot.dirty or ( not force and slot.sent is not None and now - slot.sent < slot.min_interval ):
+          continue
+        record = { 'resource': resource, 'data': slot.data, 'ts': slot.ts }
+        if slot.source:
+          record['source'] = slot.source
+        batches.setdefault( channel, [] ).append( ( slot, record ) )
+        slot.dirty = False
+        slot.sent  = now
+    count = 0
+    for channel, items in batches.items():
+      try:
+        self.bbt.publishBulk( channel, [ record for _, record in items ] )
+      except Exception as e:
+        with self._cond:
+          self.errors += 1
+          self.last_error = e
+          for slot, record in items:
+            if not slot.dirty:
+              slot.dirty = True
+              slot.sent  = None
+        continue
+      count += len(items)
+    with self._cond:
+      self.calls += len(batches)
+      self.published += count
+    return count
+
+  """
+  Publishes all the pending values and stops the background thread. Further publish calls raise a RuntimeError.
+
+  @param timeout: optional maximum number of seconds to wait for the background thread to stop.
+  """
+  def close(self, timeout = None):
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    self._thread.join( timeout )
+    self.flush( True )
+
+  def stats(self):
+    return { 'published': self.published, 'coalesced': self.coalesced, 'calls': self.calls, 'errors': self.errors }
+
+  def __run__(self):
+    deadline = time.monotonic() + self.interval
+    while True:
+      with self._cond:
+        while not self._closed:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            break
+          self._cond.wait( remaining )
+        if self._closed:
+          return
+      deadline = time.monotonic() + self.interval
+      self.flush()
@@ -0,0 +1,175 @@
+"""Client-side cache for Beebotte read calls.
+
+Keeps recent read results in memory, keyed by the normalized query, with per-source time to live,
+LRU eviction and coalescing of concurrent identical reads.
+"""
+
+import time
+import threading
+import collections
+
+class _Call:
+  __slots__ = ('event', 'result', 'error', 'invalidated')
+
+  def __init__(self):
+    self.event       = threading.Event()
+    self.result      = None
+    self.error       = None
+    self.invalidated = False
+
+class ReadCache:
+  max_entries = None
+  ttl         = None
+  default_ttl = None
+  stale_ttl   = None
+  hits        = 0
+  misses      = 0
+  stale_hits  = 0
+
+  """
+  Creates a read cache to be given to the BBT connector (cache parameter).
+  Results are shared between callers and must not be modified.
+  Writes made through the connector invalidate the cached reads of the resources they write to.
+  With stale_ttl, an expired result is still returned for up to stale_ttl seconds while a single background read
+  refreshes it (stale-while-revalidate), so that callers do not wait on the network when an entry expires. The
+  Beebotte API has no validators (ETag, Last-Modified) for conditional reads, so a refresh is a full read.
+
+  @param max_entries: optional maximum number of cached results; the least recently used result is evicted first (defaults to 1024).
+  @param ttl: optional dict giving the number of seconds results are kept for each read source (defaults to 1 second for 'raw', 5 minutes for 'hour-stats' and 1 hour for 'day-stats').
+  @param default_ttl: optional number of seconds results are kept for sources missing from ttl (defaults to 1).
+  @param stale_ttl: optional number of seconds an expired result is served while it is refreshed in the background (defaults to 0, expired results are read again in the foreground).
+  """
+  def __init__(self, max_entries = 1024, ttl = None, default_ttl = 1.0, stale_ttl = 0):
+    self.max_entries = max_entries
+    self.ttl         = ttl if ttl is not None else { 'raw': 1.0, 'hour-stats': 300.0, 'day-stats': 3600.0 }
+    self.default_ttl = default_ttl
+    self.stale_ttl   = stale_ttl
+
+    self._lock       = threading.Lock()
+    self._entries    = collections.OrderedDict()
+    self._index      = {}
+    self._inflight   = {}
+
+  """
+  Returns the cached result of a read, or calls loader to perform it. Concurrent calls for the same read
+  wait for the first one instead of calling loader again.
+
+  @param owner: required the owner of the resource for public reads, None for authenticated reads.
+  @param channel: required the channel name.
+  @param resource: required the resource name.
+  @param query: required dict of query parameters of the read.
+  @param loader: required function performing the read and returning its result.
+
+  @return: the result of the read, raises the error raised by loader.
+  """
+  def fetch(self, owner, channel, resource, query, loader):
+    ttl = self.ttl.get( query.get('source'), self.default_ttl )
+    if not ttl or ttl <= 0:
+      return loader()
+    key = ( owner, channel, resource, tuple(sorted(query.items())) )
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        now = time.monotonic()
+        if entry[0] > now:
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return entry[1]
+        if entry[2] > now:
+          self._entries.move_to_end(key)
+          self.stale_hits += 1
+          if key not in self._inflight:
+            call = self._inflight[key] = _Call()
+            threading.Thread( target = self.__refresh__, args = ( key, ttl, call, loader ),
+                              name = "beebotte-cache-refresh", daemon = True ).start()
+          return entry[1]
+        self.__remove__(key)
+      self.misses += 1
+      call = self._inflight.get(key)
+      if call is not None:
+        leader = False
+      else:
+        leader = True
+        call = _Call()
+        self._inflight[key] = call
+
+    if not leader:
+      call.event.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result
+    return self.__load__( key, ttl, call, loader )
+
+  """
+  Drops the cached results of the given resource, or of all the resources of the channel if resource is None.
+  Reads in flight when this is called are not cached.
+
+  @param channel: required the channel name.
+  @param resource: optional the resource name.
+  """
+  def invalidate(self, channel, resource = None):
+    with self._lock:
+      for key, call in self._inflight.items():
+        if key[1] == channel and ( resource is None or key[2] == resource ):
+          call.invalidated = True
+      if resource is None:
+        names = [ name for name in self._index if name[0] == channel ]
+      else:
+        names = [ (channel, resource) ]
+      for name in names:
+        for key in list( self._index.get( name, () ) ):
+          self.__remove__(key)
+
+  """
+  Drops all the cached results.
+  """
+  def clear(self):
+    with self._lock:
+      for call in self._inflight.values():
+        call.invalidated = True
+      self._entries.clear()
+      self._index.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+  """
+  Calls loader for the in-flight read of key, caches its result unless the read was invalidated meanwhile, and
+  releases the callers waiting for it.
+  """
+  def __load__(self, key, ttl, call, loader):
+    try:
+      call.result = loader()
+    except BaseException as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._inflight[key]
+        if call.error is None and not call.invalidated:
+          expires = time.monotonic() + ttl
+          self.__store__( key, expires, call.result, expires + self.stale_ttl )
+      call.event.set()
+    return call.result
+
+  def __refresh__(self, key, ttl, call, loader):
+    try:
+      self.__load__( key, ttl, call, loader )
+    except Exception:
+      pass
+
+  def __store__(self, key, expires, result, stale_until):
+    if key in self._entries:
+      self.__remove__(key)
+    self._entries[key] = ( expires, result, stale_until )
+    self._index.setdefault( (key[1], key[2]), set() ).add(key)
+    while len(self._entries) > self.max_entries:
+      self.__remove__( next(iter(self._entries)) )
+
+  def __remove__(self, key):
+    del self._entries[key]
+    name = ( key[1], key[2] )
+    keys = self._index[name]
+    keys.discard(key)
+    if not keys:
+      del self._index[name]
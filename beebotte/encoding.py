@@ -0,0 +1,381 @@
+"""JSON encoding of Beebotte write and publish payloads.
+
+Serializes single records and bulk data arrays in one pass into a reused output buffer,
+using orjson when it is installed and the standard json module otherwise. Large bulk bodies can be
+streamed to a spooled temporary file instead, and bodies can be gzip or deflate compressed.
+Read responses can be decoded incrementally, one record at a time, as they are received.
+"""
+
+import re
+import json
+import math
+import zlib
+import base64
+import codecs
+import hashlib
+import threading
+
+__compressionBits__ = { 'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS }
+
+"""
+Returns a compressor for the given HTTP content encoding ('gzip' or 'deflate').
+"""
+def compressor(encoding, level = 6):
+  if encoding not in __compressionBits__:
+    raise ValueError("unsupported content encoding %r" % (encoding,))
+  return zlib.compressobj( level, zlib.DEFLATED, __compressionBits__[encoding] )
+
+"""
+Compresses a request body with the given HTTP content encoding ('gzip' or 'deflate').
+"""
+def compress(data, encoding, level = 6):
+  c = compressor( encoding, level )
+  return c.compress( data ) + c.flush()
+
+class SpooledBody:
+  file      = None
+  length    = 0
+  md5       = None
+  encoding  = None
+  resources = None
+
+  """
+  Request body encoded to a spooled temporary file (kept in memory up to a size, then written to disk), with
+  its length and base64 MD5 hash computed while it was written. Produced by BulkEncoder.encodeStream.
+  """
+  def __init__(self, file, length, md5, encoding, resources):
+    self.file      = file
+    self.length    = length
+    self.md5       = md5
+    self.encoding  = encoding
+    self.resources = resources
+
+  def __len__(self):
+    return self.length
+
+  """
+  Returns the file positioned at the start of the body, to be sent (again).
+  """
+  def rewind(self):
+    self.file.seek(0)
+    return self.file
+
+  def close(self):
+    self.file.close()
+
+class BulkEncoder:
+  backend = None
+
+  """
+  Creates an encoder for write and publish request bodies.
+
+  @param backend: optional JSON backend used for values that are not plain numbers. Accepts ('json', 'orjson') or a callable
+    taking a value and returning its JSON encoding as bytes. None selects orjson if installed, json otherwise.
+  """
+  def __init__(self, backend = None):
+    orjson = None
+    if backend is None or backend == 'orjson':
+      try: import orjson
+      except ImportError: pass
+    if backend is None:
+      backend = 'orjson' if orjson is not None else 'json'
+    if backend == 'orjson':
+      if orjson is None:
+        raise ImportError("the orjson backend requires the orjson package")
+      self._dumps = orjson.dumps
+    elif backend == 'json':
+      encode = json.JSONEncoder( separators=(',', ':') ).encode
+      self._dumps = lambda value: encode(value).encode()
+    elif callable(backend):
+      self._dumps = backend
+    else:
+      raise ValueError("unknown JSON backend %r" % (backend,))
+    self.backend = backend
+    self._names  = {}
+    self._buffer = bytearray()
+    self._lock   = threading.Lock()
+
+  """
+  Encodes the body of a write or publish call for a single record.
+
+  @param data: required the value to send.
+  @param ts: optional timestamp in milliseconds (since epoch).
+  @param source: optional source metadata (publish only).
+
+  @return: the request body as bytes.
+  """
+  def encodeRecord(self, data, ts = None, source = None):
+    with self._lock:
+      buf = self._buffer
+      del buf[:]
+      buf += b'{"data":'
+      buf += self.__value__( data )
+      if ts is not None:
+        buf += b',"ts":'
+        buf += self.__value__( ts )
+      if source:
+        buf += b',"source":'
+        buf += self._dumps( source )
+      buf += b'}'
+      return bytes(buf)
+
+  """
+  Encodes the body of a writeBulk or publishBulk call.
+
+  @param data_array: required sequence of records. Each record is either a dict following the writeBulk/publishBulk format
+    or an object with resource, data and ts attributes (such as DataPoint); a ts equal to None is left out.
+
+  @return: the request body as bytes.
+  """
+  def encode(self, data_array):
+    with self._lock:
+      buf = self._buffer
+      del buf[:]
+      buf += b'{"data":['
+      for record in data_array:
+        if type(record) is dict:
+          buf += self._dumps( record )
+        else:
+          buf += self.__prefix__( record.resource )
+          buf += self.__value__( record.data )
+          if record.ts is not None:
+            buf += b',"ts":'
+            buf += self.__value__( record.ts )
+          buf += b'}'
+        buf += b','
+      if buf[-1] == 44:
+        buf[-1] = 93
+      else:
+        buf += b']'
+      buf += b'}'
+      return bytes(buf)
+
+  """
+  Returns the number of bytes a record takes in the body of a writeBulk or publishBulk call encoded by encode(),
+  including the separator that follows it.
+
+  @param record: required the record (see encode).
+  """
+  def recordSize(self, record):
+    if type(record) is dict:
+      return len( self._dumps( record ) ) + 1
+    size = len( self.__prefix__( record.resource ) ) + len( self.__value__( record.data ) ) + 2
+    if record.ts is not None:
+      size += 6 + len( self.__value__( record.ts ) )
+    return size
+
+  """
+  Encodes the body of a writeBulk or publishBulk call from parallel columns.
+
+  @param resource: required the resource name, either a single name for all the records or a sequence of names.
+  @param data: required sequence of values.
+  @param ts: optional sequence of timestamps in milliseconds (since epoch), same length as data.
+  @param source: optional source metadata added to every record (publish only).
+
+  @return: the request body as bytes.
+  """
+  def encodeColumns(self, resource, data, ts = None, source = None):
+    if isinstance(resource, str):
+      resource = [ resource ] * len(data)
+    tail = b',"source":' + self._dumps( source ) + b'}' if source else b'}'
+    with self._lock:
+      buf = self._buffer
+      del buf[:]
+      buf += b'{"data":['
+      for i in range( len(data) ):
+        buf += self.__prefix__( resource[i] )
+        buf += self.__value__( data[i] )
+        if ts is not None:
+          buf += b',"ts":'
+          buf += self.__value__( ts[i] )
+        buf += tail
+        buf += b','
+      if buf[-1] == 44:
+        buf[-1] = 93
+      else:
+        buf += b']'
+      buf += b'}'
+      return bytes(buf)
+
+  """
+  Encodes the body of a writeBulk or publishBulk call to a spooled temporary file, chunk by chunk, without
+  building the whole body in memory. The body can be compressed on the fly; its MD5 hash is computed on what
+  is written (the compressed bytes if compressed).
+
+  @param data_array: required iterable of records (see encode), possibly a generator.
+  @param encoding: optional content encoding to compress the body with ('gzip' or 'deflate'), None for no compression.
+  @param level: optional compression level from 1 to 9 (defaults to 6).
+  @param max_memory: optional number of bytes kept in memory before the body is written to disk (defaults to 1 MiB).
+  @param chunk_size: optional number of bytes encoded before they are compressed and written (defaults to 64 KiB).
+
+  @return: a SpooledBody.
+  """
+  def encodeStream(self, data_array, encoding = None, level = 6, max_memory = 1 << 20, chunk_size = 1 << 16):
+    import tempfile
+    out = tempfile.SpooledTemporaryFile( max_size = max_memory )
+    md5 = hashlib.md5()
+    length = [ 0 ]
+    resources = set()
+    c = compressor( encoding, level ) if encoding else None
+
+    def write(chunk):
+      if c is not None:
+        chunk = c.compress( chunk )
+      if chunk:
+        out.write( chunk )
+        md5.update( chunk )
+        length[0] += len(chunk)
+
+    buf = bytearray( b'{"data":[' )
+    first = True
+    for record in data_array:
+      if not first:
+        buf += b','
+      first = False
+      if type(record) is dict:
+        resources.add( record.get('resource') )
+        buf += self._dumps( record )
+      else:
+        resources.add( record.resource )
+        buf += self.__prefix__( record.resource )
+        buf += self.__value__( record.data )
+        if record.ts is not None:
+          buf += b',"ts":'
+          buf += self.__value__( record.ts )
+        buf += b'}'
+      if len(buf) >= chunk_size:
+        write( bytes(buf) )
+        del buf[:]
+    buf += b']}'
+    write( bytes(buf) )
+    if c is not None:
+      tail = c.flush()
+      out.write( tail )
+      md5.update( tail )
+      length[0] += len(tail)
+    out.seek(0)
+    return SpooledBody( out, length[0], bytes.decode( base64.b64encode( md5.digest() ) ), encoding, resources )
+
+  def __prefix__(self, resource):
+    prefix = self._names.get( resource )
+    if prefix is None:
+      prefix = b'{"resource":' + self._dumps( resource ) + b',"data":'
+      if len(self._names) < 4096:
+        self._names[resource] = prefix
+    return prefix
+
+  def __value__(self, value):
+    t = type(value)
+    if t is int:
+      return str(value).encode()
+    if t is float and math.isfinite(value):
+      return repr(value).encode()
+    return self._dumps( value )
+
+class ArrayDecoder:
+  __whitespace__ = re.compile( r'[ \t\n\r]*' )
+
+  """
+  Incremental decoder of a JSON array, such as the body of a read response, fed with the body as it is received.
+  Elements are decoded as soon as they are complete, so that only the unparsed tail of the body (at most one
+  element plus one chunk) is held in memory. The complete objects of a chunk are decoded together with one
+  json.loads call, up to the last '},' of the chunk; the other elements one at a time with raw_decode.
+  """
+  def __init__(self):
+    self._loads   = json.JSONDecoder().decode
+    self._decode  = json.JSONDecoder().raw_decode
+    self._text    = codecs.getincrementaldecoder( 'utf-8' )()
+    self._buffer  = ''
+    self._state   = 'start'
+
+  """
+  Feeds the next chunk of the body.
+
+  @param chunk: required bytes of the body (UTF-8).
+
+  @return: the list of the elements completed by this chunk. Raises ValueError if the body is not a JSON array.
+  """
+  def feed(self, chunk):
+    self._buffer += self._text.decode( chunk )
+    return self.__parse__( False )
+
+  """
+  Ends the body.
+
+  @return: the list of the last elements. Raises ValueError if the array is incomplete.
+  """
+  def close(self):
+    self._buffer += self._text.decode( b'', True )
+    values = self.__parse__( True )
+    if self._state != 'end':
+      raise ValueError("truncated JSON array")
+    return values
+
+  def __parse__(self, final):
+    buf = self._buffer
+    pos = 0
+    values = []
+    state = self._state
+    bulk = not final
+    while True:
+      pos = self.__whitespace__.match( buf, pos ).end()
+      if pos == len(buf):
+        break
+      c = buf[pos]
+      if state == 'start':
+        if c != '[':
+          raise ValueError("expected a JSON array, got %r" % buf[pos:pos + 32])
+        state = 'first'
+        pos += 1
+      elif state == 'end':
+        raise ValueError("extra data after the JSON array: %r" % buf[pos:pos + 32])
+      elif c == ']' and state != 'value':
+        state = 'end'
+        pos += 1
+      elif state == 'next':
+        if c != ',':
+          raise ValueError("expected ',' or ']', got %r" % buf[pos:pos + 32])
+        state = 'value'
+        pos += 1
+      else:
+        # a '},' only parses as the end of a sequence of complete elements if it is outside any string or nested value
+        cut = buf.rfind( '},', pos ) if bulk else -1
+        bulk = False
+        if cut > pos:
+          try:
+            values.extend( self._loads( '[' + buf[pos:cut + 1] + ']' ) )
+            state = 'value'
+            pos = cut + 2
+            continue
+          except ValueError:
+            pass
+        try:
+          value, end = self._decode( buf, pos )
+        except ValueError:
+          if final:
+            raise
+          break
+        # a number at the end of the received data may continue in the next chunk ("1" of "1.5")
+        if not final and type(value) in ( int, float ) and ( end == len(buf) or buf[end] in '.eE+-0123456789' ):
+          break
+        values.append( value )
+        state = 'next'
+        pos = end
+    self._buffer = buf[pos:]
+    self._state = state
+    return values
+
+"""
+Decodes the elements of a JSON array from the chunks of its bytes, one element at a time.
+
+@param chunks: required iterable of bytes chunks (for instance the body of a streamed response).
+
+@return: iterator of the decoded elements. Raises ValueError if the body is not a complete JSON array.
+"""
+def iterArray(chunks):
+  decoder = ArrayDecoder()
+  for chunk in chunks:
+    for value in decoder.feed( chunk ):
+      yield value
+  for value in decoder.close():
+    yield value
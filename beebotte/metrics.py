@@ -0,0 +1,237 @@
+"""Instrumentation of Beebotte API calls.
+
+Defines the RequestInfo object passed to the hooks registered on a BBT connector (BBT.add_hook), an in-memory
+Metrics hook with latency histograms and counters that can be rendered in the Prometheus text format, and a
+StatsD exporter hook.
+"""
+
+import time
+import threading
+
+__buckets__ = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+
+class RequestInfo:
+  __slots__ = ('method', 'uri', 'operation', 'started', 'duration', 'phases', 'attempts', 'bytes_sent',
+               'bytes_received', 'status', 'error', 'error_code')
+
+  """
+  Describes one API call. Hooks receive it at the start of the call (request_start) and once it has completed
+  (request_end), with the timings of its phases in seconds: 'encode' (JSON encoding of the body), 'md5' (content
+  hash), 'sign' (HMAC signature), 'network' (sending the request and receiving the response) and 'parse'
+  (decoding of the response). The phases of retried calls are those of the last attempt.
+  """
+  def __init__(self, method, uri, bytes_sent = 0):
+    self.method         = method
+    self.uri            = uri
+    self.operation      = operation( method, uri )
+    self.started        = time.perf_counter()
+    self.duration       = None
+    self.phases         = {}
+    self.attempts       = 0
+    self.bytes_sent     = bytes_sent
+    self.bytes_received = 0
+    self.status         = None
+    self.error          = None
+    self.error_code     = None
+
+"""
+Returns the name of the API call ('read', 'readPublic', 'write', 'writeBulk', 'publish', 'publishBulk') matching
+the given method and endpoint: /vi/public/data/read/<owner>/<channel>/<resource>, /v1/data/read/<channel>/<resource>,
+and /v1/data/write (or publish)/<channel>[/<resource>].
+"""
+def operation(method, uri):
+  segments = uri.split('?', 1)[0].strip('/').split('/')
+  if segments[1:4] == [ 'public', 'data', 'read' ] and len(segments) == 7:
+    return 'readPublic'
+  if len(segments) < 4 or segments[1] != 'data':
+    return 'unknown'
+  if segments[2] == 'read' and len(segments) == 5:
+    return 'read'
+  if segments[2] in ('write', 'publish') and len(segments) <= 5:
+    return segments[2] + ( 'Bulk' if len(segments) == 4 else '' )
+  return 'unknown'
+
+class Histogram:
+  buckets = None
+  count   = 0
+  sum     = 0.0
+
+  """
+  Cumulative histogram with fixed upper bounds (in seconds), as used by Prometheus.
+  """
+  def __init__(self, buckets = __buckets__):
+    self.buckets = tuple(buckets)
+    self.counts  = [ 0 ] * ( len(self.buckets) + 1 )
+    self.count   = 0
+    self.sum     = 0.0
+
+  def observe(self, value):
+    i = 0
+    for bound in self.buckets:
+      if value <= bound:
+        break
+      i += 1
+    self.counts[i] += 1
+    self.count += 1
+    self.sum += value
+
+  """
+  Returns an estimate of the given quantile (between 0 and 1), interpolated within the matching bucket.
+  """
+  def quantile(self, q):
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    lower = 0.0
+    for i, n in enumerate(self.counts):
+      upper = self.buckets[i] if i < len(self.buckets) else lower
+      if n and seen + n >= rank:
+        return lower + ( upper - lower ) * ( rank - seen ) / n
+      seen += n
+      lower = upper
+    return lower
+
+class Metrics:
+  bbt     = None
+  buckets = None
+
+  """
+  In-memory metrics hook: latency histograms per API call and phase, call, error and byte counters, and
+  optionally the connection pool statistics of a connector.
+
+  @param bbt: optional connector to register the hook on and to report the pool statistics of.
+  @param buckets: optional histogram upper bounds in seconds.
+  """
+  def __init__(self, bbt = None, buckets = __buckets__):
+    self.bbt            = bbt
+    self.buckets        = tuple(buckets)
+    self.latency        = {}
+    self.phases         = {}
+    self.calls          = {}
+    self.errors         = {}
+    self.retries        = 0
+    self.bytes_sent     = 0
+    self.bytes_received = 0
+    self._lock          = threading.Lock()
+    if bbt is not None:
+      bbt.add_hook( self )
+
+  def request_start(self, info):
+    pass
+
+  def request_end(self, info):
+    with self._lock:
+      op = info.operation
+      self.calls[op] = self.calls.get( op, 0 ) + 1
+      self.retries += max( 0, info.attempts - 1 )
+      self.bytes_sent += info.bytes_sent
+      self.bytes_received += info.bytes_received
+      if info.error is not None:
+        key = ( op, info.status, info.error_code )
+        self.errors[key] = self.errors.get( key, 0 ) + 1
+      histogram = self.latency.get( op )
+      if histogram is None:
+        histogram = self.latency[op] = Histogram( self.buckets )
+      histogram.observe( info.duration )
+      for phase, value in info.phases.items():
+        histogram = self.phases.get( (op, phase) )
+        if histogram is None:
+          histogram = self.phases[(op, phase)] = Histogram( self.buckets )
+        histogram.observe( value )
+
+  """
+  Returns a summary of the collected metrics: per call count, mean, p50 and p99 latency in seconds, per phase
+  mean durations, error counts and byte counters.
+  """
+  def snapshot(self):
+    with self._lock:
+      result = {
+        'calls': {},
+        'errors': dict( ( "%s:%s:%s" % key, n ) for key, n in self.errors.items() ),
+        'retries': self.retries,
+        'bytes_sent': self.bytes_sent,
+        'bytes_received': self.bytes_received,
+      }
+      for op, h in self.latency.items():
+        result['calls'][op] = { 'count': h.count, 'mean': h.sum / h.count, 'p50': h.quantile(0.5), 'p99': h.quantile(0.99),
+                                'phases': dict( ( phase, p.sum / p.count ) for (o, phase), p in self.phases.items() if o == op ) }
+    if self.bbt is not None:
+      result['pool'] = self.bbt.pool_stats()
+    return result
+
+  """
+  Renders the metrics in the Prometheus text exposition format.
+
+  @param prefix: optional prefix of the metric names (defaults to 'beebotte').
+  """
+  def prometheus(self, prefix = 'beebotte'):
+    lines = []
+    def histogram(name, labels, h):
+      cumulative = 0
+      for bound, n in zip( self.buckets + ( '+Inf', ), h.counts ):
+        cumulative += n
+        lines.append( '%s_bucket{%sle="%s"} %d' % ( name, labels, bound, cumulative ) )
+      lines.append( '%s_sum{%s} %r' % ( name, labels.rstrip(','), h.sum ) )
+      lines.append( '%s_count{%s} %d' % ( name, labels.rstrip(','), h.count ) )
+
+    with self._lock:
+      lines.append( '# TYPE %s_request_duration_seconds histogram' % prefix )
+      for op, h in sorted( self.latency.items() ):
+        histogram( '%s_request_duration_seconds' % prefix, 'operation="%s",' % op, h )
+      lines.append( '# TYPE %s_phase_duration_seconds histogram' % prefix )
+      for (op, phase), h in sorted( self.phases.items() ):
+        histogram( '%s_phase_duration_seconds' % prefix, 'operation="%s",phase="%s",' % ( op, phase ), h )
+      lines.append( '# TYPE %s_errors_total counter' % prefix )
+      for (op, status, code), n in sorted( self.errors.items(), key = str ):
+        lines.append( '%s_errors_total{operation="%s",status="%s",code="%s"} %d' % ( prefix, op, status, code, n ) )
+      lines.append( '# TYPE %s_retries_total counter' % prefix )
+      lines.append( '%s_retries_total %d' % ( prefix, self.retries ) )
+      lines.append( '# TYPE %s_sent_bytes_total counter' % prefix )
+      lines.append( '%s_sent_bytes_total %d' % ( prefix, self.bytes_sent ) )
+      lines.append( '# TYPE %s_received_bytes_total counter' % prefix )
+      lines.append( '%s_received_bytes_total %d' % ( prefix, self.bytes_received ) )
+    if self.bbt is not None:
+      for name, value in sorted( self.bbt.pool_stats().items() ):
+        lines.append( '# TYPE %s_pool_%s gauge' % ( prefix, name ) )
+        lines.append( '%s_pool_%s %d' % ( prefix, name, value ) )
+    return "\n".join( lines ) + "\n"
+
+class StatsdExporter:
+  address = None
+  prefix  = None
+
+  """
+  Hook sending the duration of each API call and of its phases as StatsD timers, and error and byte counters,
+  over UDP. Sending is best effort: network errors are ignored.
+
+  @param host: optional StatsD host (defaults to 127.0.0.1).
+  @param port: optional StatsD port (defaults to 8125).
+  @param prefix: optional prefix of the metric names (defaults to 'beebotte').
+  """
+  def __init__(self, host = '127.0.0.1', port = 8125, prefix = 'beebotte'):
+    self.address = ( host, port )
+    self.prefix  = prefix
+    import socket
+    self._socket = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+    self._socket.setblocking( False )
+
+  def request_start(self, info):
+    pass
+
+  def request_end(self, info):
+    name = "%s.%s" % ( self.prefix, info.operation )
+    lines = [ "%s.duration:%.3f|ms" % ( name, info.duration * 1000 ) ]
+    for phase, value in info.phases.items():
+      lines.append( "%s.%s:%.3f|ms" % ( name, phase, value * 1000 ) )
+    lines.append( "%s.sent_bytes:%d|c" % ( name, info.bytes_sent ) )
+    lines.append( "%s.received_bytes:%d|c" % ( name, info.bytes_received ) )
+    if info.error is not None:
+      lines.append( "%s.errors.%s:1|c" % ( name, info.error_code if info.error_code is not None else info.status ) )
+    try:
+      self._socket.sendto( "\n".join( lines ).encode(), self.address )
+    except (IOError, OSError):
+      pass
+
+  def close(self):
+    self._socket.close()
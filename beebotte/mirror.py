@@ -0,0 +1,166 @@
+"""Local mirror of a Beebotte resource.
+
+Keeps the records of one numeric resource in two append-only column files (int64 timestamps and float64
+values) that are memory mapped for reading. Synchronizing only downloads the records newer than the last
+stored one, and time range queries are answered from the local files with a binary search.
+"""
+
+import os
+import mmap
+import bisect
+import threading
+from array import array
+
+from beebotte import DataPointArray
+
+class Mirror:
+  bbt       = None
+  channel   = None
+  resource  = None
+  path      = None
+  owner     = None
+  page_size = None
+  fsync     = None
+
+  """
+  Opens (or creates) the local mirror of a resource. The columns are stored in the files path + '.ts' and
+  path + '.val'. Records are appended in ascending timestamp order; after a crash, a partially appended record
+  is discarded when the mirror is opened again. Only numeric values can be stored.
+
+  @param bbt: required reference to the Beebotte client connector.
+  @param channel: required the channel name.
+  @param resource: required the resource name.
+  @param path: required the path prefix of the column files.
+  @param owner: optional the owner of the resource for public reads. None to read from the user's owned channel.
+  @param page_size: optional number of records requested per API call when synchronizing (defaults to 750).
+  @param fsync: optional indicates if the files are synced to disk after each synchronization (defaults to False).
+  """
+  def __init__(self, bbt, channel, resource, path, owner = None, page_size = 750, fsync = False):
+    self.bbt       = bbt
+    self.channel   = channel
+    self.resource  = resource
+    self.path      = path
+    self.owner     = owner
+    self.page_size = page_size
+    self.fsync     = fsync
+    self._lock     = threading.Lock()
+    self._maps     = None
+
+    directory = os.path.dirname( path )
+    if directory and not os.path.isdir( directory ):
+      os.makedirs( directory )
+    self._tsFile   = open( path + '.ts', 'a+b' )
+    self._dataFile = open( path + '.val', 'a+b' )
+    count = min( os.fstat( self._tsFile.fileno() ).st_size, os.fstat( self._dataFile.fileno() ).st_size ) // 8
+    self._tsFile.truncate( count * 8 )
+    self._dataFile.truncate( count * 8 )
+    self._count = count
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __len__(self):
+    return self._count
+
+  """
+  Timestamp of the oldest stored record, None if the mirror is empty.
+  """
+  @property
+  def first_ts(self):
+    with self._lock:
+      return self.__columns__()[0][0] if self._count else None
+
+  """
+  Timestamp of the most recent stored record, None if the mirror is empty.
+  """
+  @property
+  def last_ts(self):
+    with self._lock:
+      return self.__columns__()[0][self._count - 1] if self._count else None
+
+  """
+  Downloads the records newer than the most recent stored one and appends them. The new records are appended
+  only once they have all been received, so an interrupted synchronization leaves no gap.
+
+  @param since: optional timestamp in milliseconds from which to start when the mirror is empty. None downloads all the available history.
+
+  @return: the number of records added.
+  """
+  def sync(self, since = None):
+    last = self.last_ts
+    start = last + 1 if last is not None else since
+    ts = array('q')
+    data = array('d')
+    for point in self.bbt.read_iter( self.channel, self.resource, time_range = ( start, None ), page_size = self.page_size, owner = self.owner ):
+      if last is not None and point.ts <= last:
+        continue
+      try:
+        data.append( point.data )
+      except TypeError:
+        raise ValueError("Mirror only stores numeric values, got %r" % ( point.data, ))
+      ts.append( point.ts )
+    if not ts:
+      return 0
+    # read_iter returns the most recent records first
+    ts.reverse()
+    data.reverse()
+    with self._lock:
+      self.__release__()
+      self._dataFile.write( data.tobytes() )
+      self._dataFile.flush()
+      self._tsFile.write( ts.tobytes() )
+      self._tsFile.flush()
+      if self.fsync:
+        os.fsync( self._dataFile.fileno() )
+        os.fsync( self._tsFile.fileno() )
+      self._count += len(ts)
+    return len(ts)
+
+  """
+  Returns the stored records within a time window, found with a binary search on the mapped timestamps.
+
+  @param start: optional first timestamp (inclusive) in milliseconds. None for no lower bound.
+  @param end: optional last timestamp (exclusive) in milliseconds. None for no upper bound.
+
+  @return: a DataPointArray holding a copy of the selected records.
+  """
+  def range(self, start = None, end = None):
+    with self._lock:
+      ts = array('q')
+      data = array('d')
+      if self._count:
+        tsColumn, dataColumn = self.__columns__()
+        lo = 0 if start is None else bisect.bisect_left( tsColumn, start )
+        hi = self._count if end is None else bisect.bisect_left( tsColumn, end, lo )
+        ts.frombytes( tsColumn[lo:hi].cast('B') )
+        data.frombytes( dataColumn[lo:hi].cast('B') )
+      return DataPointArray( ts, data, self.channel, self.resource )
+
+  def close(self):
+    with self._lock:
+      self.__release__()
+      self._tsFile.close()
+      self._dataFile.close()
+
+  """
+  Returns the memory mapped columns, as int64 and float64 memoryviews. Must be called with the lock held.
+  """
+  def __columns__(self):
+    if self._maps is None:
+      size = self._count * 8
+      tsMap = mmap.mmap( self._tsFile.fileno(), size, access = mmap.ACCESS_READ )
+      dataMap = mmap.mmap( self._dataFile.fileno(), size, access = mmap.ACCESS_READ )
+      self._maps = ( tsMap, dataMap, memoryview( tsMap ).cast('q'), memoryview( dataMap ).cast('d') )
+    return self._maps[2], self._maps[3]
+
+  def __release__(self):
+    if self._maps is not None:
+      tsMap, dataMap, tsColumn, dataColumn = self._maps
+      self._maps = None
+      tsColumn.release()
+      dataColumn.release()
+      tsMap.close()
+      dataMap.close()
@@ -0,0 +1,207 @@
+"""Retry, rate limiting and circuit breaking for Beebotte API calls.
+
+The objects defined here are given to the BBT connector (retry_policy, rate_limiter and circuit_breaker
+parameters) and can be shared by several connectors. All of them are thread-safe and keep counters
+that can be read at any time.
+"""
+
+import time
+import random
+import threading
+
+from beebotte import CircuitOpenError
+
+"""
+Returns true if the given error means the server rejected the call without processing it (429 or 503),
+in which case it can be retried even if it is not idempotent.
+"""
+def isRejection(error):
+  return getattr(error, 'status', None) in (429, 503)
+
+"""
+Returns true if the given error is a server side or network failure: a 5xx status, a 429 status or an
+I/O error raised by the transport.
+"""
+def isFailure(error, transient_errors = ()):
+  status = getattr(error, 'status', None)
+  if status is not None:
+    return status >= 500 or status == 429
+  return isinstance(error, (IOError, OSError) + tuple(transient_errors))
+
+class RetryPolicy:
+  max_attempts    = None
+  backoff         = None
+  max_backoff     = None
+  max_retry_after = None
+  retry_writes    = None
+  retries         = 0
+  giveups         = 0
+
+  """
+  Retry policy with exponential backoff and full jitter.
+  Reads (GET) are retried on server side and network failures. Writes and publishes are only retried when the
+  server rejected them without processing them (429 Too Many Requests, 503 Service Unavailable), unless
+  retry_writes is set. A Retry-After response header is honored, up to max_retry_after seconds.
+
+  @param max_attempts: optional maximum number of attempts per call, including the first one (defaults to 4).
+  @param backoff: optional base delay in seconds, doubled at each attempt (defaults to 0.5).
+  @param max_backoff: optional maximum delay in seconds between two attempts (defaults to 30).
+  @param max_retry_after: optional maximum delay in seconds accepted from a Retry-After header; calls asking for a longer delay are not retried (defaults to 60).
+  @param retry_writes: optional retry writes and publishes on all failures, like reads. Can create duplicate records (defaults to False).
+  @param transient_errors: optional additional exception classes to be considered as network failures.
+  """
+  def __init__(self, max_attempts = 4, backoff = 0.5, max_backoff = 30.0, max_retry_after = 60.0, retry_writes = False, transient_errors = ()):
+    self.max_attempts     = max_attempts
+    self.backoff          = backoff
+    self.max_backoff      = max_backoff
+    self.max_retry_after  = max_retry_after
+    self.retry_writes     = retry_writes
+    self.transient_errors = tuple(transient_errors)
+    self._lock            = threading.Lock()
+
+  """
+  Returns the number of seconds to wait before retrying a failed call, or None if it should not be retried.
+
+  @param error: required the exception raised by the call.
+  @param attempt: required the number of attempts already made (1 after the first failure).
+  @param idempotent: required indicates if the call can safely be repeated (reads).
+  """
+  def delay(self, error, attempt, idempotent):
+    retry = attempt < self.max_attempts and ( isRejection(error) or
+              ( idempotent or self.retry_writes ) and isFailure(error, self.transient_errors) )
+    delay = None
+    if retry:
+      delay = random.uniform( 0, min( self.max_backoff, self.backoff * 2 ** (attempt - 1) ) )
+      retry_after = getattr(error, 'retry_after', None)
+      if retry_after is not None:
+        if retry_after > self.max_retry_after:
+          delay = None
+        else:
+          delay = max( delay, retry_after )
+    with self._lock:
+      if delay is None:
+        self.giveups += 1
+      else:
+        self.retries += 1
+    return delay
+
+  def stats(self):
+    return { 'retries': self.retries, 'giveups': self.giveups }
+
+class RateLimiter:
+  rate    = None
+  burst   = None
+  calls   = 0
+  delayed = 0
+  waited  = 0.0
+
+  """
+  Token bucket limiting the rate of API calls. Calls exceeding the rate wait for a token.
+
+  @param rate: required the sustained number of calls per second.
+  @param burst: optional the number of calls that can be made at once after an idle period (defaults to rate, at least 1).
+  """
+  def __init__(self, rate, burst = None):
+    self.rate    = float(rate)
+    self.burst   = float( burst if burst is not None else max( rate, 1 ) )
+    self._tokens = self.burst
+    self._last   = time.monotonic()
+    self._lock   = threading.Lock()
+
+  """
+  Takes a token and returns the number of seconds the caller must wait before making its call.
+  """
+  def reserve(self):
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min( self.burst, self._tokens + ( now - self._last ) * self.rate )
+      self._last = now
+      self._tokens -= 1
+      self.calls += 1
+      if self._tokens >= 0:
+        return 0.0
+      wait = -self._tokens / self.rate
+      self.delayed += 1
+      self.waited += wait
+      return wait
+
+  """
+  Takes a token, waiting until it is available.
+  """
+  def acquire(self):
+    wait = self.reserve()
+    if wait > 0:
+      time.sleep( wait )
+
+  def stats(self):
+    return { 'calls': self.calls, 'delayed': self.delayed, 'waited': self.waited }
+
+class CircuitBreaker:
+  CLOSED    = 'closed'
+  OPEN      = 'open'
+  HALF_OPEN = 'half-open'
+
+  failure_threshold = None
+  recovery_timeout  = None
+  state             = CLOSED
+  opens             = 0
+  rejected          = 0
+
+  """
+  Circuit breaker failing calls fast while the backend is unhealthy.
+  After failure_threshold consecutive server side or network failures the circuit opens and calls raise
+  CircuitOpenError without being sent. After recovery_timeout seconds a single trial call is let through
+  (half-open state): the circuit closes if it succeeds and opens again if it fails. Client errors
+  (4xx statuses other than 429) do not count as failures.
+
+  @param failure_threshold: optional number of consecutive failures that opens the circuit (defaults to 5).
+  @param recovery_timeout: optional number of seconds the circuit stays open before a trial call (defaults to 30).
+  @param transient_errors: optional additional exception classes to be considered as network failures.
+  """
+  def __init__(self, failure_threshold = 5, recovery_timeout = 30.0, transient_errors = ()):
+    self.failure_threshold = failure_threshold
+    self.recovery_timeout  = recovery_timeout
+    self.transient_errors  = tuple(transient_errors)
+    self._failures         = 0
+    self._openedAt         = 0
+    self._trial            = False
+    self._lock             = threading.Lock()
+
+  """
+  Called before an API call. Raises CircuitOpenError if the call must not be sent.
+  """
+  def before(self):
+    with self._lock:
+      if self.state == self.CLOSED:
+        return
+      if self.state == self.OPEN and time.monotonic() - self._openedAt >= self.recovery_timeout:
+        self.state = self.HALF_OPEN
+        self._trial = False
+      if self.state == self.HALF_OPEN and not self._trial:
+        self._trial = True
+        return
+      self.rejected += 1
+      raise CircuitOpenError("Circuit open after %s consecutive failures" % self._failures)
+
+  """
+  Records the outcome of an API call.
+
+  @param error: optional the exception raised by the call, None if it succeeded.
+  """
+  def record(self, error = None):
+    with self._lock:
+      if error is None or not isFailure(error, self.transient_errors):
+        self._failures = 0
+        self._trial = False
+        self.state = self.CLOSED
+        return
+      self._failures += 1
+      if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+        if self.state != self.OPEN:
+          self.opens += 1
+        self.state = self.OPEN
+        self._openedAt = time.monotonic()
+        self._trial = False
+
+  def stats(self):
+    return { 'state': self.state, 'failures': self._failures, 'opens': self.opens, 'rejected': self.rejected }
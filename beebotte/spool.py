@@ -0,0 +1,416 @@
+"""Durable write-ahead buffer for Beebotte writes.
+
+Persists write calls to an append-only, segment-rotated log on disk and drains them to Beebotte in bulk
+when the uplink is available, so that samples survive connectivity loss and process restarts.
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+from beebotte import AuthenticationError, PayloadLimitError
+
+__header__     = struct.Struct('>II')
+__segmentExt__ = ".log"
+__checkpoint__ = "checkpoint"
+__deadLetter__ = "dead-letter.jsonl"
+
+"""
+Returns true if the given error means Beebotte refused the records themselves, so that sending them again cannot
+succeed: a 413 (body too large), or a 4xx Beebotte error (with an error code) other than an authentication failure.
+408 (request timeout), 429 (rate limited) and 4xx responses that do not come from Beebotte, such as those of a
+proxy, are transient.
+"""
+def isRejection(error):
+  status = getattr(error, 'status', None)
+  if status is None or not 400 <= status < 500 or status in (408, 429):
+    return False
+  if status == 413:
+    return True
+  return getattr(error, 'code', None) is not None and not isinstance(error, AuthenticationError)
+
+class Spool:
+  bbt            = None
+  path           = None
+  segment_bytes  = None
+  max_bytes      = None
+  overflow       = None
+  fsync          = None
+  fsync_interval = None
+  batch_size     = None
+  max_rate       = None
+  retry_interval = None
+  dropped        = 0
+  rejected       = 0
+
+  """
+  Creates (or reopens) a write-ahead buffer in the given directory.
+  Records are appended to segment files of about segment_bytes bytes each, named after the log offset of
+  their first record. The offset of the last record acknowledged by Beebotte is kept in a checkpoint file, so
+  that after a crash draining resumes with the first record that was not acknowledged. A torn record at the
+  end of the log (partial write) is discarded when the buffer is reopened.
+  Batches rejected as too large (PayloadLimitError or 413) or as invalid (400) are split in two and resent. Records
+  refused by Beebotte (see isRejection) are moved to the dead-letter.jsonl file of the directory, one JSON object
+  per line with the error, instead of being retried. The background drain retries other failures every
+  retry_interval seconds, however many records are written in the meantime.
+
+  @param bbt: required reference to the Beebotte client connector.
+  @param path: required directory holding the log segments (created if needed).
+  @param segment_bytes: optional size in bytes after which a new segment is started (defaults to 4 MiB).
+  @param max_bytes: optional maximum size in bytes of the log on disk (defaults to 64 MiB).
+  @param overflow: optional policy when the log is full. Accepts ('drop-oldest', 'drop-newest'). 'drop-oldest' deletes the oldest segment, 'drop-newest' rejects the new record (defaults to 'drop-oldest').
+  @param fsync: optional fsync policy. Accepts ('always', 'interval', 'never'). 'always' syncs every record to disk before returning, 'interval' at most every fsync_interval seconds, 'never' leaves it to the operating system (defaults to 'interval').
+  @param fsync_interval: optional number of seconds between two syncs with the 'interval' policy (defaults to 1).
+  @param batch_size: optional maximum number of records sent per bulk write when draining (defaults to 500).
+  @param max_rate: optional maximum number of records per second sent when draining. None means unbounded.
+  @param retry_interval: optional number of seconds the background drain waits after a failed bulk write (defaults to 5).
+  """
+  def __init__(self, bbt, path, segment_bytes = 4 * 1024 * 1024, max_bytes = 64 * 1024 * 1024, overflow = 'drop-oldest',
+               fsync = 'interval', fsync_interval = 1.0, batch_size = 500, max_rate = None, retry_interval = 5.0):
+    if overflow not in ('drop-oldest', 'drop-newest'):
+      raise ValueError("overflow must be 'drop-oldest' or 'drop-newest'")
+    if fsync not in ('always', 'interval', 'never'):
+      raise ValueError("fsync must be 'always', 'interval' or 'never'")
+    self.bbt            = bbt
+    self.path           = path
+    self.segment_bytes  = segment_bytes
+    self.max_bytes      = max_bytes
+    self.overflow       = overflow
+    self.fsync          = fsync
+    self.fsync_interval = fsync_interval
+    self.batch_size     = batch_size
+    self.max_rate       = max_rate
+    self.retry_interval = retry_interval
+
+    self._lock      = threading.Lock()
+    self._cond      = threading.Condition( self._lock )
+    self._sendLock  = threading.Lock()
+    self._thread    = None
+    self._stopping  = False
+    self._lastSync  = time.monotonic()
+    self._dirty     = False
+
+    os.makedirs( path, exist_ok = True )
+    self.__recover__()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Write (Persistent messages)
+  Appends a record to the log. The record is sent to Beebotte by drain() or by the background drain thread.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to write to.
+  @param data: required the value to write (persist).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+
+  @return: true if the record was stored, false if it was dropped by the 'drop-newest' overflow policy.
+  """
+  def write(self, channel, resource, data, ts = None):
+    record = { 'channel': channel, 'resource': resource, 'data': data, 'ts': ts if ts else round(time.time() * 1000) }
+    return self.__append__( [ record ] ) == 1
+
+  """
+  Bulk Write (Persistent messages)
+  Appends an array of records to the log.
+
+  @param channel: required the channel name.
+  @param data_array: required the data array to store, in the format expected by BBT.writeBulk.
+
+  @return: the number of records stored.
+  """
+  def writeBulk(self, channel, data_array):
+    now = round(time.time() * 1000)
+    records = []
+    for item in data_array:
+      records.append({ 'channel': channel, 'resource': item['resource'], 'data': item['data'], 'ts': item.get('ts') or now })
+    return self.__append__( records )
+
+  """
+  Returns the number of bytes in the log that have not been acknowledged yet.
+  """
+  def pending(self):
+    with self._lock:
+      return self._end - self._ack
+
+  """
+  Sends the stored records to Beebotte in order, as bulk writes of at most batch_size consecutive records of the
+  same channel, and acknowledges each batch once written. Batches rejected as too large are split, and refused
+  records are moved to the dead-letter file and acknowledged. Stops at the first other failed bulk write, leaving
+  the remaining records in the log, and re-raises the error.
+
+  @param max_batches: optional maximum number of bulk writes to send. None drains the whole log.
+
+  @return: the number of records sent.
+  """
+  def drain(self, max_batches = None):
+    sent = 0
+    batches = 0
+    with self._sendLock:
+      while max_batches is None or batches < max_batches:
+        with self._lock:
+          channel, records, ends = self.__readBatch__()
+        if not records:
+          break
+        started = time.monotonic()
+        sent += self.__send__( channel, records, ends )
+        batches += 1
+        if self.max_rate:
+          delay = len(records) / float(self.max_rate) - ( time.monotonic() - started )
+          if delay > 0:
+            time.sleep( delay )
+    return sent
+
+  """
+  Starts a background thread draining the log whenever records are pending, retrying every retry_interval seconds
+  while Beebotte cannot be reached.
+  """
+  def start(self):
+    with self._lock:
+      if self._thread is None:
+        self._stopping = False
+        self._thread = threading.Thread( target = self.__run__, name = "beebotte-spool", daemon = True )
+        self._thread.start()
+
+  """
+  Stops the background drain thread, syncs the log to disk and closes it. Records not yet acknowledged are kept
+  and drained when the log is reopened.
+  """
+  def close(self):
+    with self._lock:
+      thread = self._thread
+      self._stopping = True
+      self._cond.notify_all()
+    if thread is not None:
+      thread.join()
+    with self._lock:
+      self._thread = None
+      if self._file is not None:
+        os.fsync( self._file.fileno() )
+        self._file.close()
+        self._file = None
+
+  """
+  Returns the path of the dead-letter file, holding the records refused by Beebotte.
+  """
+  def deadLetterPath(self):
+    return os.path.join( self.path, __deadLetter__ )
+
+  """
+  Writes a batch of consecutive records, splitting it if it is too large, and acknowledges the records written
+  or refused. Returns the number of records written, raises the error of a failed bulk write.
+  """
+  def __send__(self, channel, records, ends):
+    try:
+      self.bbt.writeBulk( channel, records )
+      written = len(records)
+    except Exception as e:
+      if not isRejection(e):
+        raise
+      if len(records) > 1 and ( isinstance(e, PayloadLimitError) or e.status in (400, 413) ):
+        half = len(records) // 2
+        return self.__send__( channel, records[:half], ends[:half] ) + self.__send__( channel, records[half:], ends[half:] )
+      self.__reject__( channel, records, e )
+      written = 0
+    with self._lock:
+      if ends[-1] > self._ack:
+        self.__acknowledge__( ends[-1] )
+    return written
+
+  def __reject__(self, channel, records, error):
+    with open( self.deadLetterPath(), 'a' ) as f:
+      for record in records:
+        entry = { 'channel': channel, 'resource': record['resource'], 'data': record['data'], 'ts': record['ts'],
+                  'status': getattr(error, 'status', None), 'code': getattr(error, 'code', None), 'error': str(error) }
+        f.write( json.dumps( entry, separators=(',', ':') ) + "\n" )
+      f.flush()
+      os.fsync( f.fileno() )
+    with self._lock:
+      self.rejected += len(records)
+
+  """
+  Drains the log whenever records are pending. After a failed drain, the next attempt waits until retry_at:
+  appends wake the thread up to sync the log but do not bring the retry forward.
+  """
+  def __run__(self):
+    retry_at = None
+    while True:
+      with self._lock:
+        while not self._stopping:
+          self.__sync__( False )
+          wait = None if retry_at is None else retry_at - time.monotonic()
+          if self._end != self._ack and ( wait is None or wait <= 0 ):
+            break
+          if self._dirty:
+            wait = self.fsync_interval if wait is None else min( wait, self.fsync_interval )
+          self._cond.wait( wait )
+        if self._stopping:
+          return
+      try:
+        self.drain()
+        retry_at = None
+      except Exception:
+        retry_at = time.monotonic() + self.retry_interval
+
+  def __segmentPath__(self, base):
+    return os.path.join( self.path, "%020d%s" % ( base, __segmentExt__ ) )
+
+  def __recover__(self):
+    bases = sorted( int(name[:-len(__segmentExt__)]) for name in os.listdir(self.path) if name.endswith(__segmentExt__) )
+    if not bases:
+      bases = [ 0 ]
+    last = self.__segmentPath__( bases[-1] )
+    with open( last, 'ab+' ) as f:
+      size = f.tell()
+      end = 0
+      if size:
+        with mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ ) as buf:
+          for _, end in self.__scan__( buf, 0 ):
+            pass
+      if end < size:
+        f.truncate( end )
+    self._bases = bases
+    self._end   = bases[-1] + end
+    self._file  = open( last, 'ab', buffering = 0 )
+    ack = bases[0]
+    try:
+      with open( os.path.join( self.path, __checkpoint__ ) ) as f:
+        ack = json.load(f)['offset']
+    except (IOError, ValueError, KeyError):
+      pass
+    self._ack = min( max( ack, bases[0] ), self._end )
+
+  def __scan__(self, buf, pos):
+    size = len(buf)
+    while pos + __header__.size <= size:
+      length, crc = __header__.unpack_from( buf, pos )
+      start = pos + __header__.size
+      if start + length > size or zlib.crc32( buf[start:start + length] ) != crc:
+        return
+      pos = start + length
+      yield buf[start:pos], pos
+
+  def __sync__(self, force):
+    if self._dirty and ( force or self.fsync != 'never' and time.monotonic() - self._lastSync >= self.fsync_interval ):
+      os.fsync( self._file.fileno() )
+      self._lastSync = time.monotonic()
+      self._dirty = False
+
+  def __append__(self, records):
+    stored = 0
+    with self._lock:
+      if self._file is None:
+        raise RuntimeError("Spool is closed")
+      for record in records:
+        payload = json.dumps( record, separators=(',', ':') ).encode()
+        entry = __header__.pack( len(payload), zlib.crc32(payload) ) + payload
+        if not self.__reserve__( len(entry) ):
+          self.dropped += 1
+          continue
+        if self._end - self._bases[-1] >= self.segment_bytes:
+          self.__rotate__()
+        self._file.write( entry )
+        self._end += len(entry)
+        self._dirty = True
+        stored += 1
+      if self.fsync == 'always':
+        self.__sync__( True )
+      else:
+        self.__sync__( False )
+      self._cond.notify_all()
+    return stored
+
+  def __rotate__(self):
+    os.fsync( self._file.fileno() )
+    self._file.close()
+    self._bases.append( self._end )
+    self._file = open( self.__segmentPath__( self._end ), 'ab', buffering = 0 )
+    self._dirty = False
+
+  def __reserve__(self, size):
+    while self._end - self._bases[0] + size > self.max_bytes:
+      if self._ack == self._end and self._end > self._bases[-1]:
+        self.__rotate__()
+        self.__acknowledge__( self._end )
+        continue
+      if self.overflow == 'drop-newest':
+        return False
+      if len(self._bases) == 1:
+        if self._end == self._bases[0]:
+          return False
+        self.__rotate__()
+      if self._ack < self._bases[1]:
+        self.dropped += self.__count__( self._ack, self._bases[1] )
+        self.__acknowledge__( self._bases[1] )
+      else:
+        os.remove( self.__segmentPath__( self._bases.pop(0) ) )
+    return True
+
+  def __count__(self, start, end):
+    count = 0
+    offset = start
+    while offset < end:
+      _, records, ends = self.__readRecords__( offset, None, end )
+      if not records:
+        break
+      count += len(records)
+      offset = ends[-1]
+    return count
+
+  def __acknowledge__(self, offset):
+    self._ack = offset
+    checkpoint = os.path.join( self.path, __checkpoint__ )
+    with open( checkpoint + ".tmp", 'w' ) as f:
+      json.dump( { 'offset': offset }, f )
+      f.flush()
+      os.fsync( f.fileno() )
+    os.replace( checkpoint + ".tmp", checkpoint )
+    while len(self._bases) > 1 and self._bases[1] <= offset:
+      os.remove( self.__segmentPath__( self._bases.pop(0) ) )
+
+  def __readBatch__(self):
+    if self._ack == self._end:
+      return None, [], []
+    channel, records, ends = self.__readRecords__( self._ack, self.batch_size, self._end )
+    return channel, [ { 'resource': r['resource'], 'data': r['data'], 'ts': r['ts'] } for r in records ], ends
+
+  """
+  Reads consecutive records of one channel starting at the given log offset, crossing segment boundaries.
+  Returns the channel, the decoded records and the list of the offsets following each record read.
+  """
+  def __readRecords__(self, offset, limit, end):
+    channel = None
+    records = []
+    ends = []
+    while offset < end and ( limit is None or len(records) < limit ):
+      index = max( i for i, base in enumerate(self._bases) if base <= offset )
+      base = self._bases[index]
+      with open( self.__segmentPath__( base ), 'rb' ) as f:
+        size = os.fstat( f.fileno() ).st_size
+        if size == 0:
+          break
+        with mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ ) as buf:
+          for payload, pos in self.__scan__( buf, offset - base ):
+            record = json.loads( payload )
+            if channel is None:
+              channel = record['channel']
+            elif record['channel'] != channel and limit is not None:
+              return channel, records, ends
+            records.append( record )
+            offset = base + pos
+            ends.append( offset )
+            if offset >= end or ( limit is not None and len(records) >= limit ):
+              return channel, records, ends
+      if index + 1 < len(self._bases):
+        offset = self._bases[index + 1]
+      else:
+        break
+    return channel, records, ends
@@ -0,0 +1,549 @@
+"""Real-time subscriptions to Beebotte channels.
+
+A Subscriber receives the messages published to the subscribed channels and resources, and delivers them as
+batches of DataPoint objects to callbacks or to an (async) iterator, through a bounded queue. The transport is
+pluggable; MQTTTransport is a minimal MQTT 3.1.1 client over a TCP (or TLS) socket for the Beebotte MQTT broker.
+"""
+
+import ssl
+import json
+import time
+import uuid
+import random
+import socket
+import struct
+import asyncio
+import threading
+from collections import deque
+
+from beebotte import DataPoint
+
+__mqttHostname__ = "mqtt.beebotte.com"
+
+"""
+Returns the MQTT topic filter of a channel / resource subscription. '*' matches any channel or resource.
+"""
+def topic(channel, resource = '*'):
+  return "%s/%s" % ( '+' if channel == '*' else channel, '+' if resource == '*' else resource )
+
+"""
+Returns true if the given topic name matches the given MQTT topic filter ('+' and '#' wildcards).
+"""
+def matches(topic_filter, topic_name):
+  filters = topic_filter.split('/')
+  names = topic_name.split('/')
+  for i, f in enumerate(filters):
+    if f == '#':
+      return True
+    if i >= len(names) or ( f != '+' and f != names[i] ):
+      return False
+  return len(filters) == len(names)
+
+def __string__(value):
+  if not isinstance(value, bytes):
+    value = value.encode('utf-8')
+  return struct.pack('!H', len(value)) + value
+
+def __packet__(kind, body):
+  header = bytearray( ( kind, ) )
+  length = len(body)
+  while True:
+    byte = length % 128
+    length //= 128
+    header.append( byte | 0x80 if length else byte )
+    if not length:
+      break
+  return bytes(header) + body
+
+class MQTTTransport:
+  hostname  = None
+  port      = None
+  ssl       = None
+  keepalive = None
+  username  = None
+  password  = None
+  signed    = False
+
+  """
+  Minimal MQTT 3.1.1 client transport: CONNECT, SUBSCRIBE / UNSUBSCRIBE, PUBLISH reception (QoS 0 and 1) and keep
+  alive pings. Not thread-safe: it is driven by the Subscriber reader thread.
+  The Beebotte broker authenticates the whole connection with the username (secret key, or 'token:' followed by a
+  channel token); subscription signatures are not needed by this transport (signed is False), so the Subscriber
+  does not compute them.
+
+  @param hostname: optional broker host name (defaults to mqtt.beebotte.com).
+  @param port: optional broker port (defaults to 8883 with ssl, 1883 otherwise).
+  @param ssl: optional indicates if TLS should be used (defaults to False).
+  @param keepalive: optional keep alive interval in seconds (defaults to 60).
+  @param username: optional user name sent with CONNECT.
+  @param password: optional password sent with CONNECT.
+  @param timeout: optional connection timeout in seconds (defaults to 10).
+  """
+  def __init__(self, hostname = __mqttHostname__, port = None, ssl = False, keepalive = 60, username = None, password = None, timeout = 10):
+    self.hostname  = hostname
+    self.port      = port if port is not None else ( 8883 if ssl else 1883 )
+    self.ssl       = ssl
+    self.keepalive = keepalive
+    self.username  = username
+    self.password  = password
+    self.timeout   = timeout
+    self._socket   = None
+    self._buffer   = bytearray()
+    self._packetId = 0
+    self._lastSent = 0
+
+  """
+  Opens the connection and sends CONNECT. Raises IOError if the broker refuses it.
+
+  @param client_id: required the MQTT client identifier.
+  """
+  def connect(self, client_id):
+    sock = socket.create_connection( ( self.hostname, int(self.port) ), self.timeout )
+    sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+    if self.ssl:
+      sock = ssl.create_default_context().wrap_socket( sock, server_hostname = self.hostname )
+    self._socket = sock
+    self._buffer = bytearray()
+    flags = 0x02
+    payload = __string__( client_id )
+    if self.username is not None:
+      flags |= 0x80
+      payload += __string__( self.username )
+    if self.password is not None:
+      flags |= 0x40
+      payload += __string__( self.password )
+    self.__send__( __packet__( 0x10, __string__('MQTT') + struct.pack('!BBH', 4, flags, self.keepalive) + payload ) )
+    packet = self.__read__( self.timeout )
+    if packet is None or packet[0] >> 4 != 2:
+      self.close()
+      raise IOError("MQTT connection not acknowledged")
+    if packet[1][1] != 0:
+      self.close()
+      raise IOError("MQTT connection refused (return code %d)" % packet[1][1])
+
+  """
+  Subscribes to the given topic filter.
+
+  @param topic_filter: required the MQTT topic filter.
+  @param auth: optional subscription signature returned by BBT.auth_client (ignored).
+  @param qos: optional quality of service (defaults to 0).
+  """
+  def subscribe(self, topic_filter, auth = None, qos = 0):
+    self.__send__( __packet__( 0x82, struct.pack('!H', self.__nextId__()) + __string__( topic_filter ) + struct.pack('!B', qos) ) )
+
+  def unsubscribe(self, topic_filter):
+    self.__send__( __packet__( 0xA2, struct.pack('!H', self.__nextId__()) + __string__( topic_filter ) ) )
+
+  """
+  Waits for the next message and returns it as a (topic, payload) tuple, or None if none arrived within timeout
+  seconds. Sends keep alive pings as needed. Raises IOError when the connection is lost.
+  """
+  def receive(self, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+      self.ping()
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      packet = self.__read__( min( remaining, self.keepalive / 2.0 ) if self.keepalive else remaining )
+      if packet is None:
+        continue
+      kind, body = packet
+      if kind >> 4 != 3:
+        continue
+      qos = ( kind >> 1 ) & 0x03
+      length = struct.unpack_from('!H', body)[0]
+      name = bytes( body[2:2 + length] ).decode('utf-8')
+      offset = 2 + length
+      if qos:
+        self.__send__( __packet__( 0x40, bytes( body[offset:offset + 2] ) ) )
+        offset += 2
+      return name, bytes( body[offset:] )
+
+  """
+  Sends a PINGREQ if nothing was sent for half of the keep alive interval.
+  """
+  def ping(self):
+    if self.keepalive and time.monotonic() - self._lastSent >= self.keepalive / 2.0:
+      self.__send__( b'\xc0\x00' )
+
+  def close(self):
+    sock = self._socket
+    self._socket = None
+    if sock is not None:
+      try:
+        sock.sendall( b'\xe0\x00' )
+      except (IOError, OSError):
+        pass
+      sock.close()
+
+  def __nextId__(self):
+    self._packetId = self._packetId % 65535 + 1
+    return self._packetId
+
+  def __send__(self, data):
+    if self._socket is None:
+      raise IOError("MQTT connection closed")
+    self._socket.sendall( data )
+    self._lastSent = time.monotonic()
+
+  """
+  Reads one packet and returns it as a (first byte, body) tuple, or None on timeout.
+  """
+  def __read__(self, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+      buf = self._buffer
+      if len(buf) >= 2:
+        length = 0
+        shift = 0
+        i = 1
+        while i < len(buf) and i <= 4:
+          length |= ( buf[i] & 0x7F ) << shift
+          shift += 7
+          i += 1
+          if not buf[i - 1] & 0x80:
+            if len(buf) >= i + length:
+              packet = ( buf[0], buf[i:i + length] )
+              del buf[:i + length]
+              return packet
+            break
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      if self._socket is None:
+        raise IOError("MQTT connection closed")
+      self._socket.settimeout( remaining )
+      try:
+        data = self._socket.recv( 65536 )
+      except socket.timeout:
+        return None
+      if not data:
+        raise IOError("MQTT connection closed by the broker")
+      buf.extend( data )
+
+class _Subscription:
+  __slots__ = ('channel', 'resource', 'topic', 'callback', 'read', 'write', 'ttl')
+
+  def __init__(self, channel, resource, callback, read, write, ttl):
+    self.channel  = channel
+    self.resource = resource
+    self.topic    = topic( channel, resource )
+    self.callback = callback
+    self.read     = read
+    self.write    = write
+    self.ttl      = ttl
+
+class Subscriber:
+  bbt                 = None
+  transport           = None
+  batch_size          = None
+  max_latency         = None
+  max_queue           = None
+  overflow            = None
+  reconnect_delay     = None
+  max_reconnect_delay = None
+  received            = 0
+  dropped             = 0
+  reconnects          = 0
+
+  """
+  Creates a subscriber. Subscribe to channels and resources with subscribe(), then call start() to connect.
+  Received messages are queued (at most max_queue messages) and delivered in batches of up to batch_size
+  DataPoint objects, waiting at most max_latency seconds to fill a batch. Batches are given to the callbacks of
+  the matching subscriptions and to on_batch, from a dispatcher thread; without callbacks, iterate over the
+  subscriber (for batch in subscriber, or async for batch in subscriber) to get them.
+  When the queue is full, the 'block' overflow policy stops reading from the connection until there is room
+  (backpressure to the broker), 'drop-oldest' and 'drop-newest' discard messages and count them in dropped.
+  The connection is reestablished with exponential backoff when lost and all subscriptions are renewed.
+
+  @param bbt: required the BBT connector, used to sign private and presence channel subscriptions.
+  @param transport: optional transport (defaults to MQTTTransport authenticated with the connector's secret key, or the token).
+  @param token: optional channel token to authenticate with instead of the secret key.
+  @param on_batch: optional function called with every batch.
+  @param batch_size: optional maximum number of messages in a batch (defaults to 100).
+  @param max_latency: optional maximum number of seconds to wait for a batch to fill (defaults to 0.05).
+  @param max_queue: optional maximum number of queued messages (defaults to 10000).
+  @param overflow: optional 'block', 'drop-oldest' or 'drop-newest' (defaults to 'block').
+  @param reconnect_delay: optional initial delay in seconds before reconnecting (defaults to 1).
+  @param max_reconnect_delay: optional maximum delay in seconds before reconnecting (defaults to 30).
+  @param client_id: optional client identifier, also used as the signed session id (defaults to a random one).
+  """
+  def __init__(self, bbt, transport = None, token = None, on_batch = None, batch_size = 100, max_latency = 0.05,
+               max_queue = 10000, overflow = 'block', reconnect_delay = 1.0, max_reconnect_delay = 30.0, client_id = None):
+    if overflow not in ('block', 'drop-oldest', 'drop-newest'):
+      raise ValueError("overflow must be 'block', 'drop-oldest' or 'drop-newest'")
+    if transport is None:
+      transport = MQTTTransport( username = 'token:%s' % token if token else bbt.skey )
+    self.bbt                 = bbt
+    self.transport           = transport
+    self.on_batch            = on_batch
+    self.batch_size          = batch_size
+    self.max_latency         = max_latency
+    self.max_queue           = max_queue
+    self.overflow            = overflow
+    self.reconnect_delay     = reconnect_delay
+    self.max_reconnect_delay = max_reconnect_delay
+    self.client_id           = client_id or "bbt-%s" % uuid.uuid4().hex[:16]
+    self.connected           = False
+    self._subscriptions      = {}
+    self._pending            = deque()
+    self._queue              = deque()
+    self._cond               = threading.Condition()
+    self._closed             = False
+    self._waiters            = []
+    self._reader             = None
+    self._dispatcher         = None
+
+  """
+  Subscribes to a channel resource. Private ('private-' prefix) and presence ('presence-' prefix) channel
+  subscriptions are signed with BBT.auth_client and the signature is given to the transport, unless the transport
+  does not use signatures (signed attribute set to False, as for MQTTTransport).
+
+  @param channel: required channel name, or '*' for all channels.
+  @param resource: optional resource name, or '*' for all resources (defaults to '*').
+  @param callback: optional function called with the batches of messages matching this subscription.
+  @param read: optional requested read permission, for signed subscriptions (defaults to True).
+  @param write: optional requested write permission, for signed subscriptions (defaults to False).
+  @param ttl: optional validity of the signature in seconds, 0 for no limit (defaults to 0).
+  """
+  def subscribe(self, channel, resource = '*', callback = None, read = True, write = False, ttl = 0):
+    sub = _Subscription( channel, resource, callback, read, write, ttl )
+    with self._cond:
+      self._subscriptions[sub.topic] = sub
+      self._pending.append( ( 'subscribe', sub ) )
+    if callback is not None and self._reader is not None:
+      self.start()
+    return self
+
+  def unsubscribe(self, channel, resource = '*'):
+    with self._cond:
+      sub = self._subscriptions.pop( topic( channel, resource ), None )
+      if sub is not None:
+        self._pending.append( ( 'unsubscribe', sub ) )
+    return self
+
+  """
+  Connects in a background thread, and starts the dispatcher thread if callbacks were given.
+  """
+  def start(self):
+    if self._reader is None:
+      self._reader = threading.Thread( target = self.__run__, name = "beebotte-subscriber", daemon = True )
+      self._reader.start()
+    if self._dispatcher is None and ( self.on_batch is not None or any( s.callback for s in self._subscriptions.values() ) ):
+      self._dispatcher = threading.Thread( target = self.__dispatch__, name = "beebotte-dispatcher", daemon = True )
+      self._dispatcher.start()
+    return self
+
+  """
+  Disconnects and stops the threads. Messages still queued are delivered by the dispatcher before it stops.
+
+  @param timeout: optional maximum number of seconds to wait for the threads to stop.
+  """
+  def close(self, timeout = None):
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+      self.__wake__()
+    for thread in ( self._reader, self._dispatcher ):
+      if thread is not None and thread is not threading.current_thread():
+        thread.join( timeout )
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Returns the next batch of messages, waiting at most timeout seconds (forever if None) for the first one.
+  Returns an empty list on timeout and None once the subscriber is closed and the queue is empty.
+  """
+  def get(self, timeout = None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with self._cond:
+      while not self._queue:
+        if self._closed:
+          return None
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+          return []
+        self._cond.wait( remaining )
+      if len(self._queue) < self.batch_size and not self._closed:
+        linger = time.monotonic() + self.max_latency
+        while len(self._queue) < self.batch_size and not self._closed:
+          remaining = linger - time.monotonic()
+          if remaining <= 0:
+            break
+          self._cond.wait( remaining )
+      return self.__take__()
+
+  def __iter__(self):
+    while True:
+      batch = self.get()
+      if batch is None:
+        return
+      yield batch
+
+  def __aiter__(self):
+    return self
+
+  """
+  Returns the next batch like get(), without blocking the event loop: the coroutine waits on a future that the
+  reader thread resolves (call_soon_threadsafe) when the first message of a batch or a full batch is queued.
+  """
+  async def __anext__(self):
+    loop = asyncio.get_running_loop()
+    linger = None
+    while True:
+      with self._cond:
+        if self._queue:
+          if linger is None:
+            linger = loop.time() + self.max_latency
+          if len(self._queue) >= self.batch_size or self._closed or loop.time() >= linger:
+            return self.__take__()
+          timeout = linger - loop.time()
+        elif self._closed:
+          raise StopAsyncIteration
+        else:
+          timeout = None
+        waiter = ( loop, loop.create_future() )
+        self._waiters.append( waiter )
+      try:
+        await asyncio.wait( ( waiter[1], ), timeout = timeout )
+      finally:
+        with self._cond:
+          if waiter in self._waiters:
+            self._waiters.remove( waiter )
+
+  """
+  Removes a batch of at most batch_size messages from the queue. Must be called with the lock held.
+  """
+  def __take__(self):
+    n = min( len(self._queue), self.batch_size )
+    batch = [ self._queue.popleft() for _ in range(n) ]
+    self._cond.notify_all()
+    return batch
+
+  """
+  Resolves the futures of the coroutines waiting in __anext__. Must be called with the lock held.
+  """
+  def __wake__(self):
+    waiters = self._waiters
+    self._waiters = []
+    for loop, future in waiters:
+      try:
+        loop.call_soon_threadsafe( self.__resolve__, future )
+      except RuntimeError:
+        pass
+
+  @staticmethod
+  def __resolve__(future):
+    if not future.done():
+      future.set_result( None )
+
+  """
+  Returns the message as a DataPoint. Beebotte messages are JSON objects with data and ts attributes; other
+  payloads are returned as they are, timestamped on reception.
+  """
+  def __decode__(self, name, payload):
+    channel, _, resource = name.partition('/')
+    try:
+      message = json.loads( payload )
+    except ValueError:
+      message = payload
+    if isinstance(message, dict) and 'data' in message:
+      return DataPoint( message['data'], message.get('ts') or round(time.time() * 1000), channel, resource )
+    return DataPoint( message, round(time.time() * 1000), channel, resource )
+
+  """
+  Queues a received message, applying the overflow policy. Returns False if the subscriber was closed while
+  waiting for room.
+  """
+  def __enqueue__(self, point):
+    with self._cond:
+      self.received += 1
+      if len(self._queue) >= self.max_queue:
+        if self.overflow == 'drop-newest':
+          self.dropped += 1
+          return True
+        if self.overflow == 'drop-oldest':
+          self._queue.popleft()
+          self.dropped += 1
+        else:
+          while len(self._queue) >= self.max_queue and not self._closed:
+            self._cond.wait( 1.0 )
+            if len(self._queue) >= self.max_queue:
+              self.transport.ping()
+          if self._closed:
+            return False
+      self._queue.append( point )
+      self._cond.notify_all()
+      if self._waiters and ( len(self._queue) == 1 or len(self._queue) >= self.batch_size ):
+        self.__wake__()
+      return True
+
+  def __sendPending__(self):
+    while True:
+      with self._cond:
+        if not self._pending:
+          return
+        action, sub = self._pending.popleft()
+      if action == 'unsubscribe':
+        self.transport.unsubscribe( sub.topic )
+        continue
+      auth = None
+      if getattr(self.transport, 'signed', True) and ( sub.channel.startswith('private-') or sub.channel.startswith('presence-') ):
+        auth = self.bbt.auth_client( self.client_id, sub.channel, sub.resource, sub.ttl, sub.read, sub.write )
+      self.transport.subscribe( sub.topic, auth )
+
+  def __run__(self):
+    delay = self.reconnect_delay
+    first = True
+    while not self._closed:
+      try:
+        self.transport.connect( self.client_id )
+        with self._cond:
+          self._pending = deque( ( 'subscribe', sub ) for sub in self._subscriptions.values() )
+        if not first:
+          self.reconnects += 1
+        first = False
+        self.connected = True
+        delay = self.reconnect_delay
+        while not self._closed:
+          self.__sendPending__()
+          message = self.transport.receive( 0.2 )
+          if message is not None and not self.__enqueue__( self.__decode__( *message ) ):
+            break
+      except (IOError, OSError):
+        pass
+      finally:
+        self.connected = False
+        self.transport.close()
+      if self._closed:
+        break
+      with self._cond:
+        self._cond.wait( random.uniform( delay / 2.0, delay ) )
+      delay = min( self.max_reconnect_delay, delay * 2 )
+
+  def __dispatch__(self):
+    while True:
+      batch = self.get()
+      if batch is None:
+        return
+      with self._cond:
+        subscriptions = list( self._subscriptions.values() )
+      for sub in subscriptions:
+        if sub.callback is None:
+          continue
+        points = [ p for p in batch if matches( sub.topic, "%s/%s" % ( p.channel, p.resource ) ) ]
+        if points:
+          try:
+            sub.callback( points )
+          except Exception:
+            pass
+      if self.on_batch is not None:
+        try:
+          self.on_batch( batch )
+        except Exception:
+          pass
@@ -0,0 +1,437 @@
+"""HTTP transports of the BBT connector.
+
+A transport sends one HTTP request and returns a Response holding the status, the headers and the (decoded)
+body. RequestsTransport goes through a pooled requests session; HTTPClientTransport only needs the standard
+library and keeps http.client connections alive across calls. stream() returns a StreamedResponse whose body is
+read chunk by chunk. The modules a transport depends on are imported when it sends its first request, not when
+beebotte is imported.
+"""
+
+import time
+import zlib
+import select
+import threading
+
+try: import urllib.parse as urlparse
+except ImportError: import urlparse
+
+class Response:
+  __slots__ = ('status', 'headers', 'content')
+
+  """
+  Response of an HTTP request.
+
+  @param status: the HTTP status code.
+  @param headers: the response headers, a mapping with case insensitive get().
+  @param content: the response body in bytes, with its content encoding removed.
+  """
+  def __init__(self, status, headers, content):
+    self.status  = status
+    self.headers = headers
+    self.content = content
+
+  """
+  The response body decoded as UTF-8 (Beebotte responses are JSON).
+  """
+  @property
+  def text(self):
+    return self.content.decode( 'utf-8', 'replace' )
+
+class StreamedResponse:
+  __slots__ = ('status', 'headers', '_chunks', '_close')
+
+  """
+  Response of an HTTP request whose body has not been read yet. The body must be read to the end or the
+  response closed, for its connection to be reused or released.
+
+  @param status: the HTTP status code.
+  @param headers: the response headers, a mapping with case insensitive get().
+  @param chunks: function taking a chunk size and returning an iterator of the body chunks, with their content encoding removed.
+  @param close: optional function releasing the connection.
+  """
+  def __init__(self, status, headers, chunks, close = None):
+    self.status  = status
+    self.headers = headers
+    self._chunks = chunks
+    self._close  = close
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  """
+  Returns an iterator of the chunks of the body. Chunks hold at most chunk_size bytes as received, and may be
+  larger once decompressed.
+
+  @param chunk_size: optional number of bytes read at a time (defaults to 64 KiB).
+  """
+  def iter_content(self, chunk_size = 1 << 16):
+    return self._chunks( chunk_size )
+
+  """
+  Reads the rest of the body.
+  """
+  def read(self):
+    return b''.join( self.iter_content() )
+
+  def close(self):
+    close = self._close
+    self._close = None
+    if close is not None:
+      close()
+
+class Transport:
+  """
+  Interface of the transports given to BBT (transport parameter). Implementations must be thread-safe.
+  """
+
+  """
+  Sends an HTTP request.
+
+  @param method: required the HTTP method ('GET' or 'POST').
+  @param url: required the absolute URL.
+  @param body: optional the request body: bytes, string (sent UTF-8 encoded) or binary file positioned at its start.
+    A file body is sent with the Content-Length given in the headers.
+  @param headers: optional dict of request headers.
+
+  @return: a Response. Network failures raise IOError (OSError) subclasses.
+  """
+  def request(self, method, url, body = None, headers = None):
+    raise NotImplementedError
+
+  """
+  Sends an HTTP request and returns once the response headers are received, without reading the body.
+  The default implementation reads the whole body with request().
+
+  @return: a StreamedResponse. See request().
+  """
+  def stream(self, method, url, body = None, headers = None):
+    r = self.request( method, url, body, headers )
+    def chunks(chunk_size):
+      data = r.content
+      return ( data[i:i + chunk_size] for i in range( 0, len(data), chunk_size ) )
+    return StreamedResponse( r.status, r.headers, chunks )
+
+  """
+  Closes the pooled connections. The transport remains usable.
+  """
+  def close(self):
+    pass
+
+  """
+  Returns statistics of the connection pool: number of host pools, connections opened, requests sent and
+  connections currently idle in the pool. See BBT.pool_stats.
+  """
+  def pool_stats(self):
+    return { 'pools': 0, 'connections': 0, 'requests': 0, 'idle': 0 }
+
+class RequestsTransport(Transport):
+  pool_connections  = None
+  pool_maxsize      = None
+  pool_block        = None
+  keepalive_timeout = None
+
+  """
+  Transport over a requests session with a pooled HTTPAdapter. The requests package is imported on the first request.
+
+  @param pool_connections: optional number of per-host connection pools to keep (defaults to 10).
+  @param pool_maxsize: optional maximum number of connections kept alive per host (defaults to 10).
+  @param pool_block: optional indicates if requests should wait for a free connection when pool_maxsize connections are in use (defaults to False).
+  @param keepalive_timeout: optional number of seconds an idle pool is kept before its connections are closed (defaults to 60). None keeps connections open until close() is called.
+  """
+  def __init__(self, pool_connections = 10, pool_maxsize = 10, pool_block = False, keepalive_timeout = 60):
+    self.pool_connections  = pool_connections
+    self.pool_maxsize      = pool_maxsize
+    self.pool_block        = pool_block
+    self.keepalive_timeout = keepalive_timeout
+    self._session  = None
+    self._adapter  = None
+    self._lastUsed = 0
+    self._lock     = threading.Lock()
+
+  def request(self, method, url, body = None, headers = None):
+    if isinstance(body, str):
+      body = body.encode( 'utf-8' )
+    r = self.__session__().request( method, url, data = body, headers = headers )
+    return Response( r.status_code, r.headers, r.content )
+
+  def stream(self, method, url, body = None, headers = None):
+    if isinstance(body, str):
+      body = body.encode( 'utf-8' )
+    r = self.__session__().request( method, url, data = body, headers = headers, stream = True )
+    return StreamedResponse( r.status_code, r.headers, r.iter_content, r.close )
+
+  def close(self):
+    with self._lock:
+      if self._session is not None:
+        self._session.close()
+      self._session = None
+      self._adapter = None
+
+  def pool_stats(self):
+    stats = Transport.pool_stats( self )
+    with self._lock:
+      adapter = self._adapter
+    if adapter is None:
+      return stats
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+      pool = pools.get(key)
+      if pool is None:
+        continue
+      stats['pools'] += 1
+      stats['connections'] += pool.num_connections
+      stats['requests'] += pool.num_requests
+      if pool.pool is not None:
+        stats['idle'] += sum( 1 for conn in list(pool.pool.queue) if conn is not None )
+    return stats
+
+  """
+  Returns the pooled session, creating it on first use.
+  Idle connections are dropped if the pool has not been used for more than keepalive_timeout seconds.
+  """
+  def __session__(self):
+    with self._lock:
+      now = time.time()
+      if self._session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter( pool_connections = self.pool_connections, pool_maxsize = self.pool_maxsize, pool_block = self.pool_block )
+        session = requests.Session()
+        session.mount( 'http://', adapter )
+        session.mount( 'https://', adapter )
+        self._session = session
+        self._adapter = adapter
+      elif self.keepalive_timeout is not None and now - self._lastUsed > self.keepalive_timeout:
+        self._adapter.close()
+      self._lastUsed = now
+      return self._session
+
+class HTTPClientTransport(Transport):
+  pool_maxsize      = None
+  pool_block        = None
+  keepalive_timeout = None
+  timeout           = None
+  ssl_context       = None
+
+  """
+  Transport over the standard library http.client, without third party dependencies. Connections are kept
+  alive and reused across requests; up to pool_maxsize idle connections are kept per host. Connections
+  closed by the server while idle are detected before being reused. Gzip and deflate response bodies are decoded.
+  As with RequestsTransport, more than pool_maxsize connections to a host are opened when needed unless pool_block
+  is set, in which case requests wait for one of the pool_maxsize open connections to be released.
+
+  @param pool_maxsize: optional maximum number of connections kept per host (defaults to 10).
+  @param keepalive_timeout: optional number of seconds an idle connection is kept before being closed (defaults to 60). None keeps connections open until close() is called.
+  @param timeout: optional socket timeout in seconds, also the maximum time waited for a connection with pool_block (defaults to 60). None waits indefinitely.
+  @param ssl_context: optional ssl.SSLContext for HTTPS connections (defaults to ssl.create_default_context()).
+  @param pool_block: optional indicates if requests wait for a free connection rather than opening more than pool_maxsize connections to a host (defaults to False).
+  """
+  def __init__(self, pool_maxsize = 10, keepalive_timeout = 60, timeout = 60, ssl_context = None, pool_block = False):
+    self.pool_maxsize      = pool_maxsize
+    self.pool_block        = pool_block
+    self.keepalive_timeout = keepalive_timeout
+    self.timeout           = timeout
+    self.ssl_context       = ssl_context
+    self._idle     = {}
+    self._opened   = {}
+    self._requests = 0
+    self._lock     = threading.Lock()
+    self._cond     = threading.Condition( self._lock )
+
+  def request(self, method, url, body = None, headers = None):
+    key, conn, r = self.__send__( method, url, body, headers )
+    try:
+      content = r.read()
+    except Exception as e:
+      self.__discard__( key, conn )
+      raise self.__error__( e )
+    self.__done__( key, conn, r )
+    encoding = r.headers.get('Content-Encoding')
+    if encoding in ( 'gzip', 'deflate' ):
+      d = self.__decompressor__( encoding, content )
+      content = d.decompress( content ) + d.flush()
+    return Response( r.status, r.headers, content )
+
+  def stream(self, method, url, body = None, headers = None):
+    key, conn, r = self.__send__( method, url, body, headers )
+    state = { 'conn': conn }
+
+    def chunks(chunk_size):
+      encoding = r.headers.get('Content-Encoding')
+      d = None
+      while True:
+        try:
+          chunk = r.read( chunk_size )
+        except Exception as e:
+          close()
+          raise self.__error__( e )
+        if not chunk:
+          break
+        if encoding in ( 'gzip', 'deflate' ):
+          if d is None:
+            d = self.__decompressor__( encoding, chunk )
+          chunk = d.decompress( chunk )
+          if not chunk:
+            continue
+        yield chunk
+      if d is not None:
+        tail = d.flush()
+        if tail:
+          yield tail
+      if state['conn'] is not None:
+        state['conn'] = None
+        self.__done__( key, conn, r )
+
+    # a connection whose response was not read to the end cannot be reused
+    def close():
+      if state['conn'] is not None:
+        state['conn'] = None
+        self.__discard__( key, conn )
+
+    return StreamedResponse( r.status, r.headers, chunks, close )
+
+  def close(self):
+    with self._lock:
+      idle = self._idle
+      self._idle = {}
+    for key, conns in idle.items():
+      for conn, lastUsed in conns:
+        self.__discard__( key, conn )
+
+  def pool_stats(self):
+    with self._lock:
+      return { 'pools': sum( 1 for count in self._opened.values() if count ), 'connections': sum( self._opened.values() ),
+               'requests': self._requests, 'idle': sum( len(conns) for conns in self._idle.values() ) }
+
+  """
+  Sends a request and reads the status and headers of its response, on a pooled connection if one is available.
+
+  @return: a tuple of the connection pool key, the connection and the http.client response.
+  """
+  def __send__(self, method, url, body, headers):
+    import http.client
+    parts = urlparse.urlsplit( url )
+    key = ( parts.scheme, parts.hostname, parts.port )
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+    if isinstance(body, str):
+      body = body.encode( 'utf-8' )
+    while True:
+      conn, reused = self.__acquire__( key )
+      sent = False
+      try:
+        conn.request( method, path, body, headers or {} )
+        sent = True
+        return key, conn, conn.getresponse()
+      except ( http.client.HTTPException, OSError ) as e:
+        self.__discard__( key, conn )
+        # A kept alive connection may have been closed by the server in the meantime: the request is sent again
+        # on a new connection if it could not be sent, or if it is a GET that got no response.
+        stale = isinstance(e, ( http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError ))
+        if reused and stale and ( not sent or method == 'GET' ):
+          if hasattr(body, 'seek'):
+            body.seek( 0 )
+          continue
+        raise self.__error__( e )
+
+  """
+  Returns the exception to raise for a failure of http.client: OSError as is, protocol errors as ConnectionError.
+  """
+  def __error__(self, e):
+    if isinstance(e, OSError):
+      return e
+    return ConnectionError( "%s: %s" % ( type(e).__name__, e ) )
+
+  """
+  Returns the connection of a fully read response to the pool, unless the server closes it.
+  """
+  def __done__(self, key, conn, r):
+    with self._lock:
+      self._requests += 1
+    if r.will_close:
+      self.__discard__( key, conn )
+    else:
+      self.__release__( key, conn )
+
+  """
+  Returns a connection to the given host and whether it was reused from the pool. With pool_block, waits at most
+  timeout seconds for a connection when pool_maxsize connections are open, then raises a ConnectionError.
+  """
+  def __acquire__(self, key):
+    deadline = None if self.timeout is None else time.monotonic() + self.timeout
+    while True:
+      with self._lock:
+        conns = self._idle.get( key )
+        if not conns:
+          if self.pool_block and self._opened.get( key, 0 ) >= self.pool_maxsize:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+              raise ConnectionError( "no connection to %s available in the pool" % key[1] )
+            self._cond.wait( remaining )
+            continue
+          self._opened[key] = self._opened.get( key, 0 ) + 1
+          break
+        conn, lastUsed = conns.pop()
+      expired = self.keepalive_timeout is not None and time.time() - lastUsed > self.keepalive_timeout
+      if not expired and not self.__dropped__( conn ):
+        return conn, True
+      self.__discard__( key, conn )
+    import http.client
+    scheme, host, port = key
+    if scheme == 'https':
+      if self.ssl_context is None:
+        import ssl
+        self.ssl_context = ssl.create_default_context()
+      return http.client.HTTPSConnection( host, port, timeout = self.timeout, context = self.ssl_context ), False
+    return http.client.HTTPConnection( host, port, timeout = self.timeout ), False
+
+  def __release__(self, key, conn):
+    with self._lock:
+      conns = self._idle.setdefault( key, [] )
+      if len(conns) < self.pool_maxsize:
+        conns.append( ( conn, time.time() ) )
+        self._cond.notify()
+        return
+    self.__discard__( key, conn )
+
+  def __discard__(self, key, conn):
+    conn.close()
+    with self._lock:
+      if self._opened.get( key, 0 ) > 0:
+        self._opened[key] -= 1
+        self._cond.notify()
+
+  """
+  Indicates if an idle connection was closed by the server: its socket is readable (end of stream) while no
+  response is expected.
+  """
+  def __dropped__(self, conn):
+    if conn.sock is None:
+      return True
+    try:
+      return bool( select.select( [ conn.sock ], [], [], 0 )[0] )
+    except ( OSError, ValueError ):
+      return True
+
+  """
+  Returns a decompressor for a gzip or deflate body, given its first bytes. Deflate bodies are zlib streams,
+  or raw deflate streams from some servers.
+  """
+  def __decompressor__(self, encoding, head):
+    if encoding == 'deflate' and head and ord( head[:1] ) & 0x0f != 8:
+      return zlib.decompressobj( -zlib.MAX_WBITS )
+    return zlib.decompressobj( 32 + zlib.MAX_WBITS )
+
+"""
+Returns the transport used by BBT when none is given: a RequestsTransport if the requests package is installed,
+an HTTPClientTransport otherwise. requests is not imported until the first request.
+"""
+def defaultTransport(pool_connections = 10, pool_maxsize = 10, pool_block = False, keepalive_timeout = 60):
+  from importlib.util import find_spec
+  if find_spec( 'requests' ) is not None:
+    return RequestsTransport( pool_connections, pool_maxsize, pool_block, keepalive_timeout )
+  return HTTPClientTransport( pool_maxsize, keepalive_timeout, pool_block = pool_block )
@@ -0,0 +1,187 @@
+"""Shared uplink for multi-process producers.
+
+Worker processes hand their write and publish calls to a single sender process, which batches them into
+writeBulk/publishBulk calls (BatchingWriter) over one pooled connection.
+"""
+
+import time
+import multiprocessing
+
+from beebotte import BBT
+from beebotte.batching import BatchingWriter
+
+__counters__ = ( 'pending', 'sent', 'failed', 'dropped' )
+
+"""
+Main function of the sender process: feeds the records received on the queue to a BatchingWriter until the
+None sentinel is received.
+"""
+def __sender__(akey, skey, options, batching, records, counters):
+  bbt = BBT( akey, skey, **options )
+  writer = BatchingWriter( bbt, **batching )
+
+  def done(future):
+    name = 'failed' if future.exception() is not None else 'sent'
+    with counters['pending'].get_lock():
+      counters['pending'].value -= 1
+    with counters[name].get_lock():
+      counters[name].value += 1
+
+  try:
+    while True:
+      item = records.get()
+      if item is None:
+        break
+      kind, channel, resource, data, ts, source = item
+      if kind == 'write':
+        future = writer.write( channel, resource, data, ts )
+      else:
+        future = writer.publish( channel, resource, data, ts, source )
+      future.add_done_callback( done )
+  finally:
+    writer.close()
+    bbt.close()
+
+class Producer:
+  max_pending = None
+
+  """
+  Submission handle of an Uplink, to be given to worker processes (as a Process argument or a Pool initializer
+  argument). Submitting never blocks: when max_pending records are already waiting to be acknowledged, the
+  record is dropped and counted, and the call returns False.
+  Records are sent to the sender process by a background thread of the worker: let workers exit normally
+  (Pool.close() and join() rather than terminate()) so that the records they submitted are not lost.
+  """
+  def __init__(self, records, counters, max_pending):
+    self.max_pending = max_pending
+    self._records    = records
+    self._counters   = counters
+
+  """
+  Write (Persistent messages)
+  Submits data to be written to the resource with the given metadata.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to write to.
+  @param data: required the value to write (persist).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+
+  @return: true if the record was queued, false if it was dropped because of backpressure.
+  """
+  def write(self, channel, resource, data, ts = None):
+    return self.__submit__( ( 'write', channel, resource, data, ts if ts else round(time.time() * 1000), None ) )
+
+  """
+  Publish (Transient messages)
+  Submits data to be published to the resource with the given metadata.
+
+  @param channel: required the channel name.
+  @param resource: required the resource name to publish to.
+  @param data: required the data to publish (transient).
+  @param ts: optional timestamp in milliseconds (since epoch). If this parameter is not given, the local system time at the moment of the call is used.
+  @param source: optional additional data that will be appended to the published message.
+
+  @return: true if the record was queued, false if it was dropped because of backpressure.
+  """
+  def publish(self, channel, resource, data, ts = None, source = None):
+    return self.__submit__( ( 'publish', channel, resource, data, ts if ts else round(time.time() * 1000), source ) )
+
+  """
+  Returns the number of records submitted by all producers and not yet acknowledged.
+  """
+  def pending(self):
+    return self._counters['pending'].value
+
+  """
+  Returns the fill level of the uplink, between 0 (idle) and 1 (records are being dropped).
+  """
+  def backpressure(self):
+    return min( 1.0, self.pending() / float(self.max_pending) )
+
+  """
+  Returns the shared counters: pending, sent, failed and dropped records.
+  """
+  def stats(self):
+    return dict( ( name, self._counters[name].value ) for name in __counters__ )
+
+  def __submit__(self, item):
+    pending = self._counters['pending']
+    with pending.get_lock():
+      if pending.value >= self.max_pending:
+        full = True
+      else:
+        full = False
+        pending.value += 1
+    if full:
+      with self._counters['dropped'].get_lock():
+        self._counters['dropped'].value += 1
+      return False
+    self._records.put( item )
+    return True
+
+class Uplink(Producer):
+  process = None
+
+  """
+  Starts a sender process holding the only BBT connector, and returns the submission handle of the producers.
+  Give its producer() to the worker processes (the Uplink itself cannot be pickled), and close() the Uplink from
+  the parent process once they are done. Records are acknowledged in batches by a BatchingWriter in the sender process.
+
+  @param akey: required the user's API key (access key).
+  @param skey: required the user's secret key.
+  @param max_pending: optional maximum number of records submitted and not yet acknowledged before submissions are dropped (defaults to 100000).
+  @param max_batch_size: optional maximum number of records per bulk call (defaults to 500).
+  @param max_linger: optional maximum number of seconds a record waits before being sent (defaults to 0.5).
+  @param max_payload_bytes: optional maximum size in bytes of a bulk call body (defaults to 32768).
+  @param context: optional multiprocessing context used to create the queue, counters and process.
+  @param options: optional BBT constructor keyword arguments (hostname, port, ssl, retry_policy...). They must be picklable with the spawn start method.
+  """
+  def __init__(self, akey, skey, max_pending = 100000, max_batch_size = 500, max_linger = 0.5, max_payload_bytes = 32768,
+               context = None, **options):
+    ctx = context or multiprocessing
+    counters = dict( ( name, ctx.Value('q', 0) ) for name in __counters__ )
+    Producer.__init__( self, ctx.Queue(), counters, max_pending )
+    batching = { 'max_batch_size': max_batch_size, 'max_linger': max_linger, 'max_payload_bytes': max_payload_bytes }
+    self.process = ctx.Process( target = __sender__, args = ( akey, skey, options, batching, self._records, counters ),
+                                name = "beebotte-uplink", daemon = True )
+    self.process.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __getstate__(self):
+    raise TypeError("give Uplink.producer() to worker processes")
+
+  """
+  Returns the submission handle to give to worker processes.
+  """
+  def producer(self):
+    return Producer( self._records, self._counters, self.max_pending )
+
+  """
+  Waits until all submitted records are acknowledged.
+
+  @param timeout: optional maximum number of seconds to wait.
+
+  @return: true if no record is pending, false if the timeout expired.
+  """
+  def flush(self, timeout = None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while self.pending() > 0 and self.process.is_alive():
+      if deadline is not None and time.monotonic() >= deadline:
+        return False
+      time.sleep( 0.01 )
+    return self.pending() == 0
+
+  """
+  Sends the submitted records and stops the sender process. Must be called from the process that created the Uplink.
+
+  @param timeout: optional maximum number of seconds to wait for the sender process to stop.
+  """
+  def close(self, timeout = None):
+    if self.process.is_alive():
+      self._records.put( None )
+    self.process.join( timeout )
@@ -0,0 +1,7 @@
+"""Benchmarks for the Beebotte Python library.
+
+Runs the client against a local stand-in of the Beebotte API (benchmarks.mockserver) and reports
+throughput, latency percentiles and memory allocated per call. Run with:
+
+  python -m benchmarks.bench --help
+"""
@@ -0,0 +1,140 @@
+"""Throughput and latency benchmark of the Beebotte client against the local mock server.
+
+For each operation and concurrency level, runs the calls from a pool of threads sharing one BBT connector
+and reports calls per second, p50/p99 latency and the memory allocated per call (tracemalloc peak above
+the baseline, measured on a separate single threaded run).
+
+  python -m benchmarks.bench --calls 2000 --concurrency 1 8 32 --latency 0.002
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import tracemalloc
+
+from beebotte import BBT
+from benchmarks.mockserver import MockServer
+
+__operations__ = ( 'write', 'writeBulk', 'publish', 'read', 'auth_client' )
+
+def operation(bbt, name, bulk_size):
+  if name == 'write':
+    return lambda i: bbt.write( 'bench', 'temperature', 21.5 + i % 10 )
+  if name == 'writeBulk':
+    records = [ { 'resource': 'temperature', 'data': 21.5 + j % 10 } for j in range(bulk_size) ]
+    return lambda i: bbt.writeBulk( 'bench', records )
+  if name == 'publish':
+    return lambda i: bbt.publish( 'bench', 'temperature', 21.5 + i % 10, source = 'bench' )
+  if name == 'read':
+    return lambda i: bbt.read( 'bench', 'temperature', limit = 100 )
+  if name == 'auth_client':
+    return lambda i: bbt.auth_client( 'sid%d' % i, 'private-bench', 'temperature', read = True )
+  raise ValueError("unknown operation %s" % name)
+
+def percentile(values, p):
+  if not values:
+    return 0.0
+  index = min( len(values) - 1, int( round( p / 100.0 * ( len(values) - 1 ) ) ) )
+  return values[index]
+
+"""
+Runs calls invocations of the given operation from concurrency threads and returns the measured statistics.
+"""
+def measure(bbt, name, calls, concurrency, bulk_size):
+  call = operation( bbt, name, bulk_size )
+  latencies = []
+  errors = [ 0 ]
+  counter = iter( range(calls) )
+  lock = threading.Lock()
+
+  def worker():
+    local = []
+    failed = 0
+    while True:
+      with lock:
+        i = next( counter, None )
+      if i is None:
+        break
+      started = time.perf_counter()
+      try:
+        call(i)
+      except Exception:
+        failed += 1
+      local.append( time.perf_counter() - started )
+    with lock:
+      latencies.extend( local )
+      errors[0] += failed
+
+  call(0)
+  threads = [ threading.Thread( target = worker ) for _ in range(concurrency) ]
+  started = time.perf_counter()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.perf_counter() - started
+  latencies.sort()
+  return {
+    'operation':   name,
+    'concurrency': concurrency,
+    'calls':       calls,
+    'errors':      errors[0],
+    'calls_per_s': calls / elapsed if elapsed else 0.0,
+    'p50_ms':      percentile( latencies, 50 ) * 1000,
+    'p99_ms':      percentile( latencies, 99 ) * 1000,
+    'alloc_kib':   allocations( call, min( calls, 200 ) ) / 1024.0,
+  }
+
+"""
+Returns the average number of bytes allocated by one call (peak traced memory above the level before the call).
+"""
+def allocations(call, calls):
+  tracemalloc.start()
+  try:
+    total = 0
+    for i in range(calls):
+      before = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+      try:
+        call(i)
+      except Exception:
+        pass
+      total += tracemalloc.get_traced_memory()[1] - before
+    return total / float(calls) if calls else 0.0
+  finally:
+    tracemalloc.stop()
+
+def main(argv = None):
+  parser = argparse.ArgumentParser( description = "Benchmark the Beebotte client against a local mock server" )
+  parser.add_argument( '--calls', type = int, default = 1000, help = "calls per operation and concurrency level" )
+  parser.add_argument( '--concurrency', type = int, nargs = '+', default = [1, 8, 32] )
+  parser.add_argument( '--operations', nargs = '+', default = list(__operations__), choices = __operations__ )
+  parser.add_argument( '--bulk-size', type = int, default = 100, help = "records per writeBulk call" )
+  parser.add_argument( '--latency', type = float, default = 0, help = "seconds of latency added by the mock server" )
+  parser.add_argument( '--error-rate', type = float, default = 0, help = "probability of an injected server error" )
+  parser.add_argument( '--json', action = 'store_true', help = "print the results as JSON lines" )
+  args = parser.parse_args( argv )
+
+  results = []
+  with MockServer( latency = args.latency, error_rate = args.error_rate ) as server:
+    for concurrency in args.concurrency:
+      bbt = BBT( server.akey, server.skey, hostname = server.hostname, port = server.port, pool_maxsize = max( concurrency, 1 ) )
+      with bbt:
+        for name in args.operations:
+          result = measure( bbt, name, args.calls, concurrency, args.bulk_size )
+          results.append( result )
+          if args.json:
+            print( json.dumps( result ) )
+          else:
+            print( "%-12s c=%-4d %10.1f calls/s  p50 %8.3f ms  p99 %8.3f ms  %8.1f KiB/call  errors %d" % (
+              result['operation'], result['concurrency'], result['calls_per_s'], result['p50_ms'], result['p99_ms'],
+              result['alloc_kib'], result['errors'] ) )
+          sys.stdout.flush()
+    if server.counters['auth_failures']:
+      print( "warning: %d requests failed signature verification" % server.counters['auth_failures'], file = sys.stderr )
+  return results
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,110 @@
+"""Cold start benchmark of the Beebotte client.
+
+Runs each scenario in fresh interpreters and reports the median wall time, compared with an interpreter that
+imports nothing: importing beebotte, creating a BBT connector, and making a first write against the local mock
+server with each transport. The 'requests' scenario shows the cost of importing requests, which beebotte defers
+to the first API call. With --modules, also lists the slowest imports of 'import beebotte' (python -X importtime).
+
+  python -m benchmarks.importtime --runs 20 --modules 10
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from benchmarks.mockserver import MockServer
+
+__scenarios__ = {
+  'interpreter': "pass",
+  'import':      "import beebotte",
+  'construct':   "import beebotte; beebotte.BBT( 'akey', 'skey' )",
+  'requests':    "import requests",
+  'first-call-requests': "from beebotte import BBT; from beebotte.transport import RequestsTransport; "
+                         "BBT( 'akey', 'skey', hostname = %(hostname)r, port = %(port)r, transport = RequestsTransport() ).write( 'bench', 'temperature', 21.5 )",
+  'first-call-http.client': "from beebotte import BBT; from beebotte.transport import HTTPClientTransport; "
+                            "BBT( 'akey', 'skey', hostname = %(hostname)r, port = %(port)r, transport = HTTPClientTransport() ).write( 'bench', 'temperature', 21.5 )",
+}
+
+def environment():
+  env = dict( os.environ )
+  root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+  env['PYTHONPATH'] = os.pathsep.join( p for p in ( root, env.get('PYTHONPATH') ) if p )
+  return env
+
+"""
+Returns the median wall time and in process time in milliseconds of running the code in new interpreters,
+(None, None) if it fails.
+"""
+def measure(code, runs, env):
+  timer = "import time; _started = time.perf_counter()\n%s\nprint( time.perf_counter() - _started )" % code
+  walls = []
+  inners = []
+  for i in range(runs):
+    started = time.perf_counter()
+    result = subprocess.run( [ sys.executable, '-c', timer ], env = env, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL )
+    walls.append( time.perf_counter() - started )
+    if result.returncode != 0:
+      return None, None
+    inners.append( float( result.stdout.decode().split()[-1] ) )
+  walls.sort()
+  inners.sort()
+  return walls[runs // 2] * 1000, inners[runs // 2] * 1000
+
+"""
+Returns the slowest imports of 'import beebotte' as (cumulative microseconds, module name), slowest first.
+"""
+def modules(env, count):
+  result = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'import beebotte' ], env = env,
+                           stdout = subprocess.DEVNULL, stderr = subprocess.PIPE )
+  entries = []
+  for line in result.stderr.decode().splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    selfTime, cumulative, name = line[len('import time:'):].split('|')
+    entries.append( ( int(cumulative), name.rstrip() ) )
+    # nested imports are listed before the top level import that triggered them
+    if not name.startswith('  '):
+      if name.strip() == 'beebotte':
+        break
+      entries = []
+  entries.sort( reverse = True )
+  return entries[:count]
+
+def main(argv = None):
+  parser = argparse.ArgumentParser( description = "Measure the cold start time of the Beebotte client" )
+  parser.add_argument( '--runs', type = int, default = 10, help = "interpreters started per scenario" )
+  parser.add_argument( '--scenarios', nargs = '+', default = list(__scenarios__), choices = list(__scenarios__) )
+  parser.add_argument( '--modules', type = int, default = 0, help = "number of slowest imports of 'import beebotte' to list" )
+  parser.add_argument( '--json', action = 'store_true', help = "print the results as JSON lines" )
+  args = parser.parse_args( argv )
+
+  env = environment()
+  results = []
+  with MockServer( akey = 'akey', skey = 'skey' ) as server:
+    baseline = None
+    for name in args.scenarios:
+      code = __scenarios__[name] % { 'hostname': server.hostname, 'port': server.port }
+      wall, inner = measure( code, args.runs, env )
+      if name == 'interpreter':
+        baseline = wall
+      result = { 'scenario': name, 'wall_ms': wall, 'in_process_ms': inner,
+                 'over_interpreter_ms': wall - baseline if wall is not None and baseline is not None else None }
+      results.append( result )
+      if args.json:
+        print( json.dumps( result ) )
+      elif wall is None:
+        print( "%-24s failed (missing dependency?)" % name )
+      else:
+        print( "%-24s wall %8.1f ms  in process %8.1f ms%s" % ( name, wall, inner,
+          "  (+%.1f ms)" % result['over_interpreter_ms'] if result['over_interpreter_ms'] is not None and name != 'interpreter' else "" ) )
+      sys.stdout.flush()
+  if args.modules:
+    for cumulative, name in modules( env, args.modules ):
+      print( "%10.1f ms  %s" % ( cumulative / 1000.0, name ) )
+  return results
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,246 @@
+"""Local stand-in of the Beebotte MQTT broker.
+
+Accepts MQTT 3.1.1 clients (CONNECT, SUBSCRIBE, UNSUBSCRIBE, PUBLISH at QoS 0, PINGREQ, DISCONNECT) and routes
+messages to the matching subscriptions, with '+' and '#' wildcards. Messages can also be published from the
+server side with publish(), and connections dropped with disconnect() to exercise reconnection. Can be given
+to MockServer to forward the messages published through the REST API:
+
+  python -m benchmarks.mockbroker --port 1883
+"""
+
+import json
+import time
+import struct
+import socket
+import argparse
+import threading
+import socketserver
+
+from beebotte.stream import matches
+
+class MockBroker:
+  usernames = None
+
+  """
+  Creates a stand-in MQTT broker listening on the given address. Call start() to serve clients from a background
+  thread and stop() to shut it down.
+
+  @param host: optional the address to listen on (defaults to 127.0.0.1).
+  @param port: optional the port to listen on. 0 picks a free port (defaults to 0).
+  @param usernames: optional user names accepted on CONNECT; None accepts any client.
+  """
+  def __init__(self, host = '127.0.0.1', port = 0, usernames = None):
+    self.usernames = usernames
+    self.counters  = { 'connections': 0, 'subscriptions': 0, 'published': 0, 'delivered': 0, 'refused': 0 }
+    self._clients  = set()
+    self._lock     = threading.Lock()
+    self._thread   = None
+
+    broker = self
+    class Handler(_Handler):
+      mock = broker
+    self.server = socketserver.ThreadingTCPServer( (host, port), Handler, bind_and_activate = False )
+    self.server.allow_reuse_address = True
+    self.server.daemon_threads = True
+    self.server.server_bind()
+    self.server.server_activate()
+
+  @property
+  def port(self):
+    return self.server.server_address[1]
+
+  @property
+  def hostname(self):
+    return self.server.server_address[0]
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  def start(self):
+    self._thread = threading.Thread( target = self.server.serve_forever, name = "beebotte-mockbroker", daemon = True )
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self.disconnect()
+    self.server.shutdown()
+    self.server.server_close()
+    if self._thread is not None:
+      self._thread.join()
+
+  def count(self, name, n = 1):
+    with self._lock:
+      self.counters[name] += n
+
+  """
+  Sends a message to the clients subscribed to a matching topic filter.
+
+  @param topic_name: required the topic, as channel/resource.
+  @param payload: required the message, bytes or an object encoded in JSON.
+  """
+  def publish(self, topic_name, payload):
+    if not isinstance(payload, bytes):
+      payload = json.dumps( payload ).encode()
+    self.count( 'published' )
+    with self._lock:
+      clients = list( self._clients )
+    for client in clients:
+      client.deliver( topic_name, payload )
+
+  """
+  Publishes a Beebotte message as the REST publish and write endpoints do.
+  """
+  def publishRecord(self, channel, resource, data, ts = None, source = None):
+    message = { 'channel': channel, 'resource': resource, 'data': data, 'ts': ts or int( time.time() * 1000 ) }
+    if source is not None:
+      message['source'] = source
+    self.publish( "%s/%s" % ( channel, resource ), message )
+
+  """
+  Drops all client connections.
+  """
+  def disconnect(self):
+    with self._lock:
+      clients = list( self._clients )
+    for client in clients:
+      client.drop()
+
+class _Handler(socketserver.BaseRequestHandler):
+  mock = None
+
+  def setup(self):
+    self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+    self.filters = set()
+    self.lock = threading.Lock()
+    self.closed = False
+
+  def recv(self, n):
+    data = b''
+    while len(data) < n:
+      chunk = self.request.recv( n - len(data) )
+      if not chunk:
+        raise IOError("connection closed")
+      data += chunk
+    return data
+
+  def packet(self):
+    kind = self.recv(1)[0]
+    length = 0
+    shift = 0
+    while True:
+      byte = self.recv(1)[0]
+      length |= ( byte & 0x7F ) << shift
+      shift += 7
+      if not byte & 0x80:
+        break
+    return kind, self.recv( length ) if length else b''
+
+  def send(self, kind, body = b''):
+    header = bytearray( ( kind, ) )
+    length = len(body)
+    while True:
+      byte = length % 128
+      length //= 128
+      header.append( byte | 0x80 if length else byte )
+      if not length:
+        break
+    with self.lock:
+      if not self.closed:
+        self.request.sendall( bytes(header) + body )
+
+  def deliver(self, topic_name, payload):
+    with self.lock:
+      filters = list( self.filters )
+    if any( matches( f, topic_name ) for f in filters ):
+      name = topic_name.encode()
+      try:
+        self.send( 0x30, struct.pack('!H', len(name)) + name + payload )
+        self.mock.count( 'delivered' )
+      except (IOError, OSError):
+        pass
+
+  def drop(self):
+    with self.lock:
+      self.closed = True
+    try:
+      self.request.shutdown( socket.SHUT_RDWR )
+    except (IOError, OSError):
+      pass
+
+  def strings(self, body, offset):
+    length = struct.unpack_from('!H', body, offset)[0]
+    return body[offset + 2:offset + 2 + length].decode(), offset + 2 + length
+
+  def handle(self):
+    mock = self.mock
+    try:
+      kind, body = self.packet()
+      if kind >> 4 != 1:
+        return
+      flags = body[7]
+      offset = 10
+      client_id, offset = self.strings( body, offset )
+      username = None
+      if flags & 0x80:
+        username, offset = self.strings( body, offset )
+      if mock.usernames is not None and username not in mock.usernames:
+        mock.count( 'refused' )
+        return self.send( 0x20, b'\x00\x04' )
+      self.send( 0x20, b'\x00\x00' )
+      mock.count( 'connections' )
+      with mock._lock:
+        mock._clients.add( self )
+      while True:
+        kind, body = self.packet()
+        command = kind >> 4
+        if command == 8:
+          packet_id = body[:2]
+          offset = 2
+          granted = b''
+          while offset < len(body):
+            topic_filter, offset = self.strings( body, offset )
+            offset += 1
+            with self.lock:
+              self.filters.add( topic_filter )
+            granted += b'\x00'
+            mock.count( 'subscriptions' )
+          self.send( 0x90, packet_id + granted )
+        elif command == 10:
+          offset = 2
+          while offset < len(body):
+            topic_filter, offset = self.strings( body, offset )
+            with self.lock:
+              self.filters.discard( topic_filter )
+          self.send( 0xB0, body[:2] )
+        elif command == 3:
+          topic_name, offset = self.strings( body, 0 )
+          if ( kind >> 1 ) & 0x03:
+            offset += 2
+          mock.publish( topic_name, bytes( body[offset:] ) )
+        elif command == 12:
+          self.send( 0xD0 )
+        elif command == 14:
+          return
+    except (IOError, OSError, IndexError, struct.error):
+      pass
+    finally:
+      with mock._lock:
+        mock._clients.discard( self )
+
+def main():
+  parser = argparse.ArgumentParser( description = "Local stand-in of the Beebotte MQTT broker" )
+  parser.add_argument( '--host', default = '127.0.0.1' )
+  parser.add_argument( '--port', type = int, default = 1883 )
+  args = parser.parse_args()
+  broker = MockBroker( args.host, args.port )
+  print( "Serving MQTT on %s:%s" % ( broker.hostname, broker.port ) )
+  try:
+    broker.server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == '__main__':
+  main()
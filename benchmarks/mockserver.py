@@ -0,0 +1,267 @@
+"""Local stand-in of the Beebotte REST API.
+
+Serves the read, public read, write and publish endpoints over HTTP/1.1 keep-alive, verifies the Content-MD5
+and Authorization signatures produced by BBT, accepts gzip and deflate compressed bodies, and can inject
+latency, errors and payload limits. Written and published records can be forwarded to a MockBroker.
+Can be used from tests and benchmarks, or started on its own:
+
+  python -m benchmarks.mockserver --port 8080 --akey KEY --skey SECRET
+"""
+
+import hmac
+import json
+import time
+import zlib
+import base64
+import random
+import socket
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+__errors__ = {
+  1101: ( 400, "Authentication failed" ),
+  1201: ( 500, "Internal server error" ),
+  1406: ( 400, "Payload limit exceeded" ),
+}
+
+class MockServer:
+  akey          = None
+  skey          = None
+  latency       = None
+  error_rate    = None
+  error_codes   = None
+  payload_limit = None
+  read_size     = None
+  verify        = None
+  broker        = None
+  now           = None
+
+  """
+  Creates a stand-in Beebotte API server listening on the given address. Call start() to serve requests from a
+  background thread and stop() to shut it down.
+
+  @param akey: optional the API key accepted by the server (defaults to 'akey').
+  @param skey: optional the secret key used to verify signatures (defaults to 'skey').
+  @param host: optional the address to listen on (defaults to 127.0.0.1).
+  @param port: optional the port to listen on. 0 picks a free port (defaults to 0).
+  @param latency: optional delay in seconds added to every response, or a tuple (min, max) for a uniformly distributed delay (defaults to 0).
+  @param error_rate: optional probability of answering a valid request with an injected error (defaults to 0).
+  @param error_codes: optional Beebotte error codes to inject, chosen at random. Accepts 1101, 1201 and 1406 (defaults to all three).
+  @param payload_limit: optional maximum body size in bytes of write and publish requests; larger bodies get a 1406 error. None for no limit.
+  @param read_size: optional number of records available for each resource (defaults to 10000).
+  @param verify: optional indicates if signatures and content hashes are verified (defaults to True).
+  @param broker: optional MockBroker (benchmarks.mockbroker) to which written and published records are forwarded.
+  @param now: optional fixed time in milliseconds at which generated records end, so that reads spread over several
+    seconds see the same records. None for the current time (defaults to None).
+  """
+  def __init__(self, akey = 'akey', skey = 'skey', host = '127.0.0.1', port = 0, latency = 0, error_rate = 0,
+               error_codes = (1101, 1201, 1406), payload_limit = None, read_size = 10000, verify = True, broker = None, now = None):
+    self.akey          = akey
+    self.skey          = skey
+    self.latency       = latency
+    self.error_rate    = error_rate
+    self.error_codes   = tuple(error_codes)
+    self.payload_limit = payload_limit
+    self.read_size     = read_size
+    self.verify        = verify
+    self.broker        = broker
+    self.now           = now
+    self.counters      = { 'requests': 0, 'reads': 0, 'writes': 0, 'publishes': 0, 'records': 0, 'errors': 0, 'auth_failures': 0, 'compressed': 0 }
+    self._lock         = threading.Lock()
+    self._thread       = None
+
+    server = self
+    class Handler(_Handler):
+      mock = server
+    self.httpd = ThreadingHTTPServer( (host, port), Handler )
+    self.httpd.daemon_threads = True
+
+  @property
+  def port(self):
+    return self.httpd.server_address[1]
+
+  @property
+  def hostname(self):
+    return self.httpd.server_address[0]
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  def start(self):
+    self._thread = threading.Thread( target = self.httpd.serve_forever, name = "beebotte-mockserver", daemon = True )
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    if self._thread is not None:
+      self._thread.join()
+
+  def count(self, name, n = 1):
+    with self._lock:
+      self.counters[name] += n
+
+  """
+  Returns the expected Authorization header of a request, computed as BBT.sign does.
+  """
+  def signature(self, verb, md5, c_type, date, uri):
+    stringToSign = "%s\n%s\n%s\n%s\n%s" % ( verb, md5, c_type, date, uri )
+    digest = hmac.new( self.skey.encode(), stringToSign.encode(), hashlib.sha1 ).digest()
+    return "%s:%s" % ( self.akey, bytes.decode( base64.b64encode( digest ) ) )
+
+  """
+  Returns the records of a resource matching the given read query, most recent first.
+  Records are generated: one per second, ending at the current time (or at now if it is set).
+  """
+  def records(self, query):
+    now = self.now if self.now is not None else int(time.time()) * 1000
+    now -= now % 1000
+    limit = min( int( query.get('limit', 1) ), self.read_size )
+    newest = now
+    if 'to' in query:
+      newest = min( newest, int(query['to']) )
+    oldest = now - ( self.read_size - 1 ) * 1000
+    if 'from' in query:
+      oldest = max( oldest, int(query['from']) )
+    newest -= ( newest - now ) % 1000
+    result = []
+    ts = newest
+    while ts >= oldest and len(result) < limit:
+      result.append( { 'data': float( ts // 1000 % 1000 ), 'ts': ts } )
+      ts -= 1000
+    return result
+
+class _Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  mock = None
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+  def log_message(self, format, *args):
+    pass
+
+  def __reply__(self, status, body):
+    data = json.dumps( body, separators=(',', ':') ).encode()
+    self.send_response( status )
+    self.send_header( 'Content-Type', 'application/json' )
+    self.send_header( 'Content-Length', str(len(data)) )
+    self.end_headers()
+    self.wfile.write( data )
+
+  def __error__(self, errcode):
+    status, message = __errors__[errcode]
+    self.mock.count( 'errors' )
+    self.__reply__( status, { 'error': { 'code': errcode, 'message': message } } )
+
+  def __delay__(self):
+    latency = self.mock.latency
+    if isinstance(latency, (tuple, list)):
+      latency = random.uniform( latency[0], latency[1] )
+    if latency:
+      time.sleep( latency )
+
+  def __authorized__(self, verb, md5, uri):
+    if not self.mock.verify:
+      return True
+    expected = self.mock.signature( verb, md5, self.headers.get('Content-Type', ''), self.headers.get('Date', ''), uri )
+    if not hmac.compare_digest( expected, self.headers.get('Authorization', '') ):
+      self.mock.count( 'auth_failures' )
+      return False
+    return True
+
+  def __inject__(self):
+    mock = self.mock
+    if mock.error_rate and mock.error_codes and random.random() < mock.error_rate:
+      self.__error__( random.choice( mock.error_codes ) )
+      return True
+    return False
+
+  def do_GET(self):
+    self.mock.count( 'requests' )
+    self.__delay__()
+    parts = urlsplit( self.path )
+    segments = parts.path.strip('/').split('/')
+    query = dict( parse_qsl( parts.query ) )
+    if parts.path.startswith('/vi/public/data/read/') and len(segments) == 7:
+      pass
+    elif parts.path.startswith('/v1/data/read/') and len(segments) == 5:
+      if not self.__authorized__( 'GET', '', self.path ):
+        return self.__error__( 1101 )
+    else:
+      return self.__reply__( 404, { 'error': { 'code': 1303, 'message': "Resource not found" } } )
+    if self.__inject__():
+      return
+    self.mock.count( 'reads' )
+    self.__reply__( 200, self.mock.records( query ) )
+
+  def do_POST(self):
+    self.mock.count( 'requests' )
+    body = self.rfile.read( int( self.headers.get('Content-Length', 0) ) )
+    self.__delay__()
+    path = urlsplit( self.path ).path
+    segments = path.strip('/').split('/')
+    if path.startswith('/v1/data/write/') and len(segments) in (4, 5):
+      counter = 'writes'
+    elif path.startswith('/v1/data/publish/') and len(segments) in (4, 5):
+      counter = 'publishes'
+    else:
+      return self.__reply__( 404, { 'error': { 'code': 1303, 'message': "Resource not found" } } )
+    md5 = self.headers.get('Content-MD5', '')
+    if self.mock.verify and md5 != bytes.decode( base64.b64encode( hashlib.md5( body ).digest() ) ):
+      self.mock.count( 'auth_failures' )
+      return self.__error__( 1101 )
+    if not self.__authorized__( 'POST', md5, self.path ):
+      return self.__error__( 1101 )
+    if self.mock.payload_limit is not None and len(body) > self.mock.payload_limit:
+      return self.__error__( 1406 )
+    if self.__inject__():
+      return
+    encoding = self.headers.get('Content-Encoding')
+    if encoding in ('gzip', 'deflate'):
+      try:
+        body = zlib.decompress( body, 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS )
+      except zlib.error:
+        return self.__reply__( 400, { 'error': { 'code': 1401, 'message': "Invalid compressed body" } } )
+      self.mock.count( 'compressed' )
+    try:
+      payload = json.loads( body )
+    except ValueError:
+      return self.__reply__( 400, { 'error': { 'code': 1401, 'message': "Invalid JSON body" } } )
+    records = payload['data'] if len(segments) == 4 else [ payload ]
+    self.mock.count( counter )
+    self.mock.count( 'records', len(records) if isinstance(records, list) else 1 )
+    if self.mock.broker is not None and isinstance(records, list):
+      for record in records:
+        resource = record.get('resource') if len(segments) == 4 else segments[4]
+        self.mock.broker.publishRecord( segments[3], resource, record.get('data'), record.get('ts'), record.get('source') )
+    self.__reply__( 200, True )
+
+def main():
+  parser = argparse.ArgumentParser( description = "Local stand-in of the Beebotte REST API" )
+  parser.add_argument( '--host', default = '127.0.0.1' )
+  parser.add_argument( '--port', type = int, default = 8080 )
+  parser.add_argument( '--akey', default = 'akey' )
+  parser.add_argument( '--skey', default = 'skey' )
+  parser.add_argument( '--latency', type = float, default = 0, help = "seconds added to every response" )
+  parser.add_argument( '--error-rate', type = float, default = 0, help = "probability of an injected error" )
+  parser.add_argument( '--error-codes', type = int, nargs = '+', default = [1101, 1201, 1406], choices = sorted(__errors__) )
+  parser.add_argument( '--payload-limit', type = int, default = None, help = "maximum write/publish body size in bytes" )
+  args = parser.parse_args()
+  server = MockServer( args.akey, args.skey, args.host, args.port, args.latency, args.error_rate, args.error_codes, args.payload_limit )
+  print( "Serving on http://%s:%s" % ( server.hostname, server.port ) )
+  try:
+    server.httpd.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == '__main__':
+  main()
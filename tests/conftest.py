@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from beebotte import BBT
+from benchmarks.mockserver import MockServer
+
+@pytest.fixture
+def server():
+  with MockServer( read_size = 2000 ) as mock:
+    yield mock
+
+@pytest.fixture
+def bbt(server):
+  with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port ) as client:
+    yield client
@@ -0,0 +1,125 @@
+import math
+from array import array
+
+import pytest
+
+from beebotte import DataPointArray, Resource
+from beebotte import aggregate as module
+from beebotte.aggregate import Deadband, ChangeOnly, Window, lttb, minmax, downsample, aggregate
+
+def feed(write_filter, samples):
+  return [ sent for data, ts in samples for sent in write_filter.feed( data, ts ) ]
+
+def test_deadband_sends_significant_changes():
+  samples = [ ( 10, 0 ), ( 10.5, 1000 ), ( 11.2, 2000 ), ( 11.5, 3000 ), ( 'off', 4000 ), ( 'off', 5000 ) ]
+  assert feed( Deadband( 1.0 ), samples ) == [ ( 10, 0 ), ( 11.2, 2000 ), ( 'off', 4000 ) ]
+
+def test_deadband_max_silence():
+  samples = [ ( 10, 0 ), ( 10, 1000 ), ( 10, 2000 ), ( 10, 3000 ) ]
+  assert feed( Deadband( 1.0, max_silence = 2 ), samples ) == [ ( 10, 0 ), ( 10, 2000 ) ]
+
+def test_change_only():
+  samples = [ ( 1, 0 ), ( 1, 1000 ), ( 1.01, 2000 ), ( 1.01, 3000 ), ( 1, 4000 ) ]
+  assert feed( ChangeOnly(), samples ) == [ ( 1, 0 ), ( 1.01, 2000 ), ( 1, 4000 ) ]
+  assert ChangeOnly().flush() == []
+
+def test_window_sends_one_aggregate_per_window():
+  window = Window( 1, 'mean' )
+  samples = [ ( 1, 100 ), ( 3, 900 ), ( 10, 1000 ), ( 20, 1500 ), ( 5, 3200 ) ]
+  assert feed( window, samples ) == [ ( 2.0, 0 ), ( 15.0, 1000 ) ]
+  assert window.flush() == [ ( 5.0, 3000 ) ]
+  assert window.flush() == []
+
+def test_window_statistics_dict():
+  window = Window( 10, ( 'min', 'max', 'count', 'sum', 'first', 'last' ) )
+  feed( window, [ ( 4, 0 ), ( 1, 1000 ), ( 9, 2000 ), ( 2, 3000 ) ] )
+  assert window.flush() == [ ( { 'min': 1, 'max': 9, 'count': 4, 'sum': 16, 'first': 4, 'last': 2 }, 0 ) ]
+  with pytest.raises(ValueError):
+    Window( 1, 'median' )
+
+def series(n):
+  ts = [ i * 1000 for i in range(n) ]
+  values = [ math.sin( i / 10.0 ) for i in range(n) ]
+  values[n // 3] = 50.0
+  values[2 * n // 3] = -50.0
+  return ts, values
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+  ts, values = series( 1000 )
+  selected = lttb( ts, values, 100 )
+  assert len(selected) == 100
+  assert selected == sorted( set(selected) )
+  assert selected[0] == 0 and selected[-1] == 999
+  assert 333 in selected and 666 in selected
+  assert lttb( ts[:10], values[:10], 20 ) == list(range(10))
+  assert lttb( ts, values, 2 ) == [ 0, 999 ]
+
+def test_lttb_numpy_matches_pure_python(monkeypatch):
+  pytest.importorskip('numpy')
+  ts, values = series( 1000 )
+  fast = lttb( ts, values, 100 )
+  monkeypatch.setattr( module, 'numpy', None )
+  assert lttb( ts, values, 100 ) == fast
+
+def test_minmax_keeps_the_extremes_of_each_bucket():
+  ts, values = series( 1000 )
+  selected = minmax( ts, values, 100 )
+  assert len(selected) <= 100
+  assert selected == sorted( set(selected) )
+  assert 333 in selected and 666 in selected
+
+def test_downsample_records_keeps_their_order():
+  ts, values = series( 500 )
+  records = [ { 'data': v, 'ts': t } for t, v in zip( ts, values ) ][::-1]
+  result = downsample( records, 50, 'minmax' )
+  assert len(result) <= 50
+  assert [ r['ts'] for r in result ] == sorted( ( r['ts'] for r in result ), reverse = True )
+  assert downsample( records[:10], 50 ) == records[:10]
+  with pytest.raises(ValueError):
+    downsample( records, 50, 'average' )
+
+def test_downsample_columns():
+  ts, values = series( 500 )
+  points = DataPointArray( array( 'q', ts ), array( 'd', values ), 'c', 'r' )
+  result = downsample( points, 50 )
+  assert isinstance(result, DataPointArray) and len(result) == 50
+  assert ( result.channel, result.resource ) == ( 'c', 'r' )
+  assert result.ts[0] == 0 and result.ts[-1] == ts[-1]
+
+@pytest.mark.parametrize( 'stat, expected', [
+  ( 'mean', [ 1.5, 4.0 ] ), ( 'sum', [ 3.0, 8.0 ] ), ( 'min', [ 1.0, 3.0 ] ), ( 'max', [ 2.0, 5.0 ] ),
+  ( 'count', [ 2.0, 2.0 ] ), ( 'first', [ 1.0, 5.0 ] ), ( 'last', [ 2.0, 3.0 ] ),
+] )
+def test_aggregate_columns(stat, expected):
+  points = DataPointArray( array( 'q', [ 0, 500, 2000, 2500 ] ), array( 'd', [ 1, 2, 5, 3 ] ), 'c', 'r' )
+  result = aggregate( points, 1, stat )
+  assert list( result.ts ) == [ 0, 2000 ]
+  assert list( result.data ) == expected
+  assert len( aggregate( DataPointArray(), 1 ) ) == 0
+
+"""
+Client recording the writes it receives.
+"""
+class Recorder:
+  def __init__(self):
+    self.writes = []
+
+  def write(self, channel, resource, data, ts = None):
+    self.writes.append( ( data, ts ) )
+    return True
+
+def test_resource_write_filter():
+  bbt = Recorder()
+  resource = Resource( bbt, 'c', 'r', write_filter = Window( 1, 'max' ) )
+  assert resource.write( 1, 100 ) is None
+  assert resource.write( 7, 200 ) is None
+  assert resource.write( 3, 1100 ) is True
+  assert resource.flush() is True
+  assert bbt.writes == [ ( 7, 0 ), ( 3, 1000 ) ]
+  assert Resource( bbt, 'c', 'r' ).flush() is None
+
+def test_resource_read_max_points(bbt, server):
+  records = Resource( bbt, 'c', 'r' ).read( limit = 1000, max_points = 100 )
+  assert len(records) == 100
+  assert records[0]['ts'] > records[-1]['ts']
+  assert len( Resource( bbt, 'c', 'r' ).read( limit = 1000, owner = 'someone', max_points = 50, method = 'minmax' ) ) <= 50
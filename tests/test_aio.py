@@ -0,0 +1,95 @@
+import time
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from beebotte import DataPointArray, CircuitOpenError, InternalError
+from beebotte.aio import AsyncBBT
+from beebotte.cache import ReadCache
+from beebotte.retry import RetryPolicy, CircuitBreaker
+
+def run(server, test, **options):
+  async def main():
+    async with AsyncBBT( server.akey, server.skey, hostname = server.hostname, port = server.port, **options ) as bbt:
+      return await test(bbt)
+  return asyncio.run( main() )
+
+def test_read_and_write(server):
+  async def test(bbt):
+    assert len( await bbt.read( 'c', 'r', limit = 10 ) ) == 10
+    assert await bbt.write( 'c', 'r', 1.5 ) is True
+    assert await bbt.publishBulk( 'c', [ { 'resource': 'r', 'data': 1 } ] ) is True
+  run( server, test )
+  assert server.counters['auth_failures'] == 0
+
+def test_read_as_columns(server):
+  async def test(bbt):
+    columns = await bbt.read( 'c', 'r', limit = 20, as_columns = True )
+    assert isinstance(columns, DataPointArray)
+    assert len(columns) == 20 and list( columns.ts ) == sorted( columns.ts )
+  run( server, test )
+
+def test_read_many(server):
+  async def test(bbt):
+    return await bbt.read_many( [ ( 'c', 'r' ), ( 'c', 'r', { 'limit': 3, 'owner': 'someone' } ) ], max_concurrency = 1 )
+  results = run( server, test )
+  assert [ len(r) for r in results ] == [ 1, 3 ]
+
+def test_read_many_timeout(server):
+  server.latency = 0.5
+  async def test(bbt):
+    return await bbt.read_many( [ ( 'c', 'r' ) ], timeout = 0.1 )
+  results = run( server, test )
+  assert isinstance( results[0], TimeoutError )
+
+def test_read_iter(server):
+  server.now = round( time.time() * 1000 )
+  async def test(bbt):
+    return [ point.ts async for point in bbt.read_iter( 'c', 'r', page_size = 300 ) ]
+  timestamps = run( server, test )
+  assert len(timestamps) == server.read_size
+  assert timestamps == sorted( set(timestamps), reverse = True )
+
+def test_read_stream(server):
+  async def test(bbt):
+    return [ len(batch) async for batch in bbt.read_stream( 'c', 'r', limit = 25, batch_size = 10 ) ]
+  assert run( server, test ) == [ 10, 10, 5 ]
+
+def test_streamed_bulk_write(server):
+  async def test(bbt):
+    return await bbt.writeBulk( 'c', [ { 'resource': 'r', 'data': i } for i in range(100) ] )
+  assert run( server, test, stream_threshold = 10, compression = 'gzip', compression_threshold = 10 ) is True
+  assert server.counters['records'] == 100
+  assert server.counters['compressed'] == 1
+
+def test_options_are_passed_to_the_connector():
+  bbt = AsyncBBT( 'akey', 'skey', compression = 'deflate', compression_level = 9, stream_threshold = 5 )
+  assert ( bbt.compression, bbt.compression_level, bbt.stream_threshold ) == ( 'deflate', 9, 5 )
+  assert bbt.transport is None
+  with pytest.raises(ValueError):
+    AsyncBBT( 'akey', 'skey', cache = ReadCache() )
+
+def test_external_session_is_used_and_left_open(server):
+  import aiohttp
+  async def main():
+    async with aiohttp.ClientSession() as session:
+      async with AsyncBBT( server.akey, server.skey, hostname = server.hostname, port = server.port, transport = session ) as bbt:
+        assert await bbt.write( 'c', 'r', 1 ) is True
+        assert bbt.pool_stats()['limit'] == session.connector.limit
+      assert not session.closed
+  asyncio.run( main() )
+  assert server.counters['records'] == 1
+
+def test_breaker_raises_the_last_error(server):
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  async def test(bbt):
+    with pytest.raises(InternalError):
+      await bbt.read( 'c', 'r' )
+    with pytest.raises(CircuitOpenError):
+      await bbt.read( 'c', 'r' )
+  run( server, test, retry_policy = RetryPolicy( max_attempts = 5, backoff = 0.001 ),
+       circuit_breaker = CircuitBreaker( failure_threshold = 2, recovery_timeout = 60 ) )
+  assert server.counters['requests'] == 2
@@ -0,0 +1,146 @@
+import time
+import threading
+
+import pytest
+
+from beebotte import BBT, PayloadLimitError
+from beebotte.batching import BatchingWriter, CoalescingPublisher
+from benchmarks.mockserver import MockServer
+
+"""
+Client recording the bulk calls it receives.
+"""
+class Recorder:
+  def __init__(self):
+    self.calls = []
+    self.lock = threading.Lock()
+
+  def writeBulk(self, channel, records):
+    with self.lock:
+      self.calls.append( ( 'write', channel, list(records) ) )
+    return True
+
+  def publishBulk(self, channel, records):
+    with self.lock:
+      self.calls.append( ( 'publish', channel, list(records) ) )
+    return True
+
+def test_records_are_grouped_per_channel_and_kind():
+  bbt = Recorder()
+  with BatchingWriter( bbt, max_linger = 60 ) as writer:
+    futures = [ writer.write( 'a', 'r', 1 ), writer.write( 'b', 'r', 2 ), writer.publish( 'a', 'r', 3, source = 's' ), writer.write( 'a', 'r', 4 ) ]
+    assert writer.flush( 5 )
+  assert all( f.result() is True for f in futures )
+  calls = { ( kind, channel ): [ r['data'] for r in records ] for kind, channel, records in bbt.calls }
+  assert calls == { ( 'write', 'a' ): [ 1, 4 ], ( 'write', 'b' ): [ 2 ], ( 'publish', 'a' ): [ 3 ] }
+
+def test_full_batches_are_sent_without_waiting_for_the_linger():
+  bbt = Recorder()
+  writer = BatchingWriter( bbt, max_batch_size = 10, max_linger = 60 )
+  futures = [ writer.write( 'c', 'r', i ) for i in range(25) ]
+  futures[19].result( 5 )
+  assert [ len(records) for _, _, records in bbt.calls ] == [ 10, 10 ]
+  writer.close( 5 )
+  assert [ len(records) for _, _, records in bbt.calls ] == [ 10, 10, 5 ]
+
+def test_batches_are_sent_after_the_linger():
+  bbt = Recorder()
+  with BatchingWriter( bbt, max_linger = 0.05 ) as writer:
+    assert writer.write( 'c', 'r', 1 ).result( 5 ) is True
+
+def test_batches_do_not_exceed_the_payload_limit():
+  bbt = Recorder()
+  with BatchingWriter( bbt, max_payload_bytes = 500, max_linger = 60 ) as writer:
+    for i in range(100):
+      writer.write( 'c', 'r', i, ts = 1500000000000 + i )
+    assert writer.flush( 5 )
+  assert sum( len(records) for _, _, records in bbt.calls ) == 100
+  assert len(bbt.calls) > 1
+  assert all( len( writer._encoder.encode(records) ) <= 500 for _, _, records in bbt.calls )
+
+def test_closed_writer_rejects_records():
+  writer = BatchingWriter( Recorder() )
+  writer.close()
+  with pytest.raises(RuntimeError):
+    writer.write( 'c', 'r', 1 )
+
+def test_batching_writer_splits_batches_over_the_payload_limit():
+  with MockServer( payload_limit = 2000 ) as server:
+    with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port ) as bbt:
+      with BatchingWriter( bbt, max_payload_bytes = 100000, max_linger = 0.01 ) as writer:
+        futures = [ writer.write( 'c', 'r', i ) for i in range(300) ]
+        futures.append( writer.write( 'c', 'r', 'x' * 3000 ) )
+        assert writer.flush( 10 )
+      assert all( f.result() is True for f in futures[:-1] )
+      with pytest.raises(PayloadLimitError):
+        futures[-1].result()
+      assert writer.max_payload_bytes < 100000
+  assert server.counters['records'] == 300
+
+def test_publisher_sends_the_latest_value_of_each_resource():
+  bbt = Recorder()
+  with CoalescingPublisher( bbt, interval = 60 ) as publisher:
+    for i in range(10):
+      publisher.publish( 'c', 'a', i, ts = 1000 + i )
+    publisher.publish( 'c', 'b', 'on', source = 's' )
+    publisher.publish( 'd', 'a', 1 )
+    assert publisher.flush() == 3
+    assert publisher.flush() == 0
+    assert publisher.stats() == { 'published': 3, 'coalesced': 9, 'calls': 2, 'errors': 0 }
+  records = { ( channel, r['resource'] ): r for _, channel, records in bbt.calls for r in records }
+  assert records[( 'c', 'a' )] == { 'resource': 'a', 'data': 9, 'ts': 1009 }
+  assert records[( 'c', 'b' )]['source'] == 's'
+  assert all( kind == 'publish' for kind, _, _ in bbt.calls )
+
+def test_publisher_flushes_every_interval():
+  bbt = Recorder()
+  with CoalescingPublisher( bbt, interval = 0.05 ) as publisher:
+    publisher.publish( 'c', 'r', 1 )
+    deadline = time.monotonic() + 5
+    while not bbt.calls and time.monotonic() < deadline:
+      time.sleep( 0.01 )
+    assert len(bbt.calls) == 1
+
+def test_publisher_min_interval():
+  bbt = Recorder()
+  with CoalescingPublisher( bbt, interval = 60, min_interval = 60, min_intervals = { ( 'c', 'fast' ): 0 } ) as publisher:
+    publisher.publish( 'c', 'slow', 1 )
+    publisher.publish( 'c', 'fast', 1 )
+    assert publisher.flush() == 2
+    publisher.publish( 'c', 'slow', 2 )
+    publisher.publish( 'c', 'fast', 2 )
+    assert publisher.flush() == 1
+    publisher.set_min_interval( 'c', 'slow', 0 )
+    assert publisher.flush() == 1
+    publisher.publish( 'c', 'slow', 3 )
+    assert publisher.flush( force = True ) == 1
+
+"""
+Client failing the first bulk call.
+"""
+class FailingOnce(Recorder):
+  def publishBulk(self, channel, records):
+    if not self.calls:
+      self.calls.append( None )
+      raise IOError("down")
+    return Recorder.publishBulk( self, channel, records )
+
+def test_publisher_resends_failed_values_unless_replaced():
+  bbt = FailingOnce()
+  with CoalescingPublisher( bbt, interval = 60 ) as publisher:
+    publisher.publish( 'c', 'r', 1 )
+    assert publisher.flush() == 0
+    assert publisher.errors == 1 and isinstance( publisher.last_error, IOError )
+    assert publisher.flush() == 1
+  assert bbt.calls[1][2][0]['data'] == 1
+
+def test_closing_the_publisher_sends_pending_values():
+  bbt = Recorder()
+  publisher = CoalescingPublisher( bbt, interval = 60, min_interval = 60 )
+  publisher.publish( 'c', 'r', 1 )
+  publisher.flush()
+  publisher.publish( 'c', 'r', 2 )
+  publisher.close()
+  assert [ records[0]['data'] for _, _, records in bbt.calls ] == [ 1, 2 ]
+  with pytest.raises(RuntimeError):
+    publisher.publish( 'c', 'r', 3 )
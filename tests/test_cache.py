@@ -0,0 +1,140 @@
+import time
+import threading
+
+import pytest
+
+from beebotte import BBT
+from beebotte.cache import ReadCache
+
+@pytest.fixture
+def cached(server):
+  with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port, cache = ReadCache( ttl = { 'raw': 60 } ) ) as client:
+    yield client
+
+def test_repeated_reads_are_served_from_the_cache(cached, server):
+  first = cached.read( 'c', 'r', limit = 5 )
+  assert cached.read( 'c', 'r', limit = 5 ) is first
+  assert server.counters['reads'] == 1
+  assert ( cached.cache.hits, cached.cache.misses ) == ( 1, 1 )
+
+def test_queries_are_cached_separately(cached, server):
+  cached.read( 'c', 'r', limit = 5 )
+  cached.read( 'c', 'r', limit = 6 )
+  cached.readPublic( 'owner', 'c', 'r', limit = 5 )
+  assert server.counters['reads'] == 3
+
+def test_writes_invalidate_the_resource(cached, server):
+  cached.read( 'c', 'r' )
+  cached.read( 'c', 'other' )
+  cached.write( 'c', 'r', 1 )
+  cached.read( 'c', 'r' )
+  cached.read( 'c', 'other' )
+  assert server.counters['reads'] == 3
+  cached.writeBulk( 'c', [ { 'resource': 'other', 'data': 2 } ] )
+  cached.read( 'c', 'other' )
+  assert server.counters['reads'] == 4
+
+def test_entries_expire():
+  cache = ReadCache( ttl = { 'raw': 0.05 } )
+  calls = []
+  load = lambda: calls.append(1) or len(calls)
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 1
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 1
+  time.sleep( 0.06 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 2
+
+def test_least_recently_used_entries_are_evicted():
+  cache = ReadCache( max_entries = 2, ttl = { 'raw': 60 } )
+  for resource in ( 'a', 'b' ):
+    cache.fetch( None, 'c', resource, { 'source': 'raw' }, lambda: resource )
+  cache.fetch( None, 'c', 'a', { 'source': 'raw' }, lambda: 'reloaded' )
+  cache.fetch( None, 'c', 'd', { 'source': 'raw' }, lambda: 'd' )
+  assert len(cache) == 2
+  assert cache.fetch( None, 'c', 'a', { 'source': 'raw' }, lambda: 'reloaded' ) == 'a'
+  assert cache.fetch( None, 'c', 'b', { 'source': 'raw' }, lambda: 'reloaded' ) == 'reloaded'
+
+def test_concurrent_identical_reads_are_coalesced(server):
+  server.latency = 0.2
+  with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port, cache = ReadCache( ttl = { 'raw': 60 } ) ) as bbt:
+    results = []
+    threads = [ threading.Thread( target = lambda: results.append( bbt.read( 'c', 'r', limit = 3 ) ) ) for _ in range(8) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  assert len(results) == 8
+  assert all( result is results[0] for result in results )
+  assert server.counters['reads'] == 1
+
+def test_errors_are_shared_and_not_cached():
+  cache = ReadCache( ttl = { 'raw': 60 } )
+  def fail():
+    raise IOError("down")
+  with pytest.raises(IOError):
+    cache.fetch( None, 'c', 'r', { 'source': 'raw' }, fail )
+  assert len(cache) == 0
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, lambda: 'ok' ) == 'ok'
+
+def test_reads_in_flight_during_a_write_are_not_cached():
+  cache = ReadCache( ttl = { 'raw': 60 } )
+  def load():
+    cache.invalidate( 'c', 'r' )
+    return 'stale'
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 'stale'
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, lambda: 'fresh' ) == 'fresh'
+
+def test_expired_entries_are_served_while_refreshed():
+  cache = ReadCache( ttl = { 'raw': 0.05 }, stale_ttl = 60 )
+  started = threading.Event()
+  release = threading.Event()
+  calls = []
+  def load():
+    calls.append(1)
+    if len(calls) > 1:
+      started.set()
+      release.wait( 5 )
+    return len(calls)
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 1
+  time.sleep( 0.06 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 1
+  assert started.wait( 5 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 1
+  assert len(calls) == 2
+  release.set()
+  deadline = time.monotonic() + 5
+  while cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) != 2 and time.monotonic() < deadline:
+    time.sleep( 0.01 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load ) == 2
+  assert cache.stale_hits >= 2
+
+def test_failed_refreshes_keep_the_stale_result():
+  cache = ReadCache( ttl = { 'raw': 0.05 }, stale_ttl = 60 )
+  def fail():
+    raise IOError("down")
+  cache.fetch( None, 'c', 'r', { 'source': 'raw' }, lambda: 'old' )
+  time.sleep( 0.06 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, fail ) == 'old'
+  time.sleep( 0.05 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, fail ) == 'old'
+
+def test_refreshes_in_flight_during_a_write_are_not_cached():
+  cache = ReadCache( ttl = { 'raw': 0.05 }, stale_ttl = 60 )
+  refreshed = threading.Event()
+  def load():
+    cache.invalidate( 'c' )
+    refreshed.set()
+    return 'stale'
+  cache.fetch( None, 'c', 'r', { 'source': 'raw' }, lambda: 'old' )
+  time.sleep( 0.06 )
+  cache.fetch( None, 'c', 'r', { 'source': 'raw' }, load )
+  assert refreshed.wait( 5 )
+  time.sleep( 0.05 )
+  assert cache.fetch( None, 'c', 'r', { 'source': 'raw' }, lambda: 'fresh' ) == 'fresh'
+
+def test_invalidation_keeps_no_state_for_resources_not_cached():
+  cache = ReadCache( ttl = { 'raw': 60 } )
+  for i in range(100):
+    cache.invalidate( 'c', 'r%d' % i )
+  cache.clear()
+  assert len(cache) == 0
+  assert cache._index == {} and cache._inflight == {}
@@ -0,0 +1,65 @@
+import copy
+import pickle
+import time
+
+import pytest
+
+from beebotte import BBT, DataPoint, DataPointArray, NotFoundError
+
+def test_data_point_pickle_copy_and_equality():
+  point = DataPoint( { 'a': 1 }, 10, 'c', 'r' )
+  assert pickle.loads( pickle.dumps(point) ) == point
+  assert copy.copy(point) == point
+  assert copy.deepcopy(point) == point
+  assert point != DataPoint( { 'a': 1 }, 11, 'c', 'r' )
+  assert len( { DataPoint( 1, 10 ), DataPoint( 1, 10 ), DataPoint( 2, 10 ) } ) == 2
+  with pytest.raises(AttributeError):
+    point.ts = 11
+
+def test_read_write_and_publish(bbt, server):
+  assert len( bbt.read( 'c', 'r', limit = 10 ) ) == 10
+  assert bbt.write( 'c', 'r', 1.5 ) is True
+  assert bbt.publish( 'c', 'r', 'on', source = 'test' ) is True
+  assert bbt.writeBulk( 'c', [ { 'resource': 'r', 'data': 1 }, DataPoint( 2, 20, None, 'r' ) ] ) is True
+  assert server.counters['auth_failures'] == 0
+  assert server.counters['records'] == 4
+
+def test_unknown_endpoints_raise_not_found(bbt):
+  with pytest.raises(NotFoundError):
+    bbt.__getData__( '/v1/unknown', {} )
+
+def test_read_as_columns(bbt):
+  records = bbt.read( 'c', 'r', limit = 50 )
+  columns = bbt.read( 'c', 'r', limit = 50, as_columns = True )
+  assert isinstance(columns, DataPointArray)
+  assert list( columns.ts ) == sorted( r['ts'] for r in records )
+  assert list( columns.data ) == [ r['data'] for r in reversed(records) ]
+  window = columns.between( columns.ts[10], columns.ts[20] )
+  assert len(window) == 10 and window[0].ts == columns.ts[10]
+
+def test_read_iter_pages_through_the_whole_range(bbt, server):
+  server.now = round( time.time() * 1000 )
+  points = list( bbt.read_iter( 'c', 'r', page_size = 300 ) )
+  timestamps = [ p.ts for p in points ]
+  assert len(points) == server.read_size
+  assert timestamps == sorted( set(timestamps), reverse = True )
+
+def test_read_stream_batches(bbt):
+  batches = list( bbt.read_stream( 'c', 'r', limit = 25, batch_size = 10, as_columns = True ) )
+  assert [ len(b) for b in batches ] == [ 10, 10, 5 ]
+
+def test_read_many_reports_errors_per_read(bbt):
+  results = bbt.read_many( [ ( 'c', 'r' ), ( 'c', 'r', { 'limit': 3, 'owner': 'someone' } ), ( 'c', 'r', { 'limit': 'x' } ) ] )
+  assert len( results[0] ) == 1
+  assert len( results[1] ) == 3
+  assert isinstance( results[2], Exception )
+
+@pytest.mark.parametrize( 'compression', [ None, 'gzip' ] )
+def test_streamed_bulk_bodies_are_signed_and_compressed(server, compression):
+  with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port, stream_threshold = 100,
+            compression = compression, compression_threshold = 10 ) as bbt:
+    assert bbt.writeBulk( 'c', ( { 'resource': 'r', 'data': i } for i in range(1000) ) ) is True
+    assert bbt.publishBulk( 'c', [ { 'resource': 'r', 'data': i } for i in range(1000) ] ) is True
+  assert server.counters['auth_failures'] == 0
+  assert server.counters['records'] == 2000
+  assert server.counters['compressed'] == ( 2 if compression else 0 )
@@ -0,0 +1,91 @@
+import json
+import zlib
+
+import pytest
+
+from beebotte import DataPoint
+from beebotte.encoding import ArrayDecoder, BulkEncoder, iterArray, compress
+
+RECORDS = [
+  { 'data': 21.5, 'ts': 1500000000000 },
+  { 'data': -3, 'ts': 1500000001000 },
+  { 'data': 1.5e-7, 'ts': 1500000002000 },
+  { 'data': "tricky },{ string \"quoted\" ]", 'ts': 1500000003000 },
+  { 'data': { 'nested': [ 1, { 'a': '},' } ] }, 'ts': 1500000004000 },
+  { 'data': "café ☃ \U0001f600", 'ts': 1500000005000 },
+  { 'data': None, 'ts': 1500000006000 },
+  { 'data': [ True, False ], 'ts': 1500000007000 },
+]
+
+def decode(body, size):
+  decoder = ArrayDecoder()
+  values = []
+  for i in range( 0, len(body), size ):
+    values.extend( decoder.feed( body[i:i + size] ) )
+  values.extend( decoder.close() )
+  return values
+
+@pytest.mark.parametrize( 'size', [ 1, 2, 3, 7, 16, 64, 1 << 16 ] )
+def test_array_decoder_matches_json_loads(size):
+  body = json.dumps( RECORDS, ensure_ascii = False ).encode('utf-8')
+  assert decode( body, size ) == RECORDS
+
+def test_array_decoder_does_not_split_numbers():
+  body = b'[1.5, 20, 3e10, -4]'
+  for size in range( 1, len(body) + 1 ):
+    assert decode( body, size ) == [ 1.5, 20, 3e10, -4 ]
+
+def test_array_decoder_whitespace_and_empty_arrays():
+  assert decode( b' \n[ ]\r\n', 1 ) == []
+  assert decode( b'[ {"a" : 1} ,\n {"b":2} ]', 4 ) == [ { 'a': 1 }, { 'b': 2 } ]
+
+@pytest.mark.parametrize( 'body', [ b'{"a":1}', b'[1,2', b'[1 2]', b'[1,2]x', b'[{"a":1},' ] )
+def test_array_decoder_rejects_invalid_bodies(body):
+  with pytest.raises(ValueError):
+    decode( body, 3 )
+
+def test_iter_array():
+  chunks = [ b'[{"data":1,', b'"ts":2},{"da', b'ta":3,"ts":4}]' ]
+  assert list( iterArray( chunks ) ) == [ { 'data': 1, 'ts': 2 }, { 'data': 3, 'ts': 4 } ]
+
+@pytest.mark.parametrize( 'backend', [ 'json', 'orjson' ] )
+def test_bulk_encoder_output_is_valid_json(backend):
+  if backend == 'orjson':
+    pytest.importorskip('orjson')
+  encoder = BulkEncoder( backend )
+  records = [ { 'resource': 'r', 'data': 1.5, 'ts': 10 }, DataPoint( 'x', 20, None, 's' ), DataPoint( float('nan'), None, None, 't' ) ]
+  payload = json.loads( encoder.encode( records ) )
+  assert payload['data'][0] == { 'resource': 'r', 'data': 1.5, 'ts': 10 }
+  assert payload['data'][1] == { 'resource': 's', 'data': 'x', 'ts': 20 }
+  assert payload['data'][2]['resource'] == 't' and 'ts' not in payload['data'][2]
+  assert json.loads( encoder.encode( [] ) ) == { 'data': [] }
+  assert json.loads( encoder.encodeRecord( 2, 30, 'src' ) ) == { 'data': 2, 'ts': 30, 'source': 'src' }
+
+def test_record_size_matches_the_encoded_body():
+  encoder = BulkEncoder()
+  records = [ { 'resource': 'r', 'data': 1.5, 'ts': 10 }, DataPoint( 'x', 20, None, 's' ), DataPoint( 7, None, None, 'long-name' ) ]
+  overhead = len( encoder.encode( [] ) )
+  assert sum( encoder.recordSize(r) for r in records ) == len( encoder.encode( records ) ) - overhead + 1
+
+@pytest.mark.parametrize( 'encoding', [ None, 'gzip', 'deflate' ] )
+def test_encode_stream_matches_encode(encoding):
+  encoder = BulkEncoder()
+  records = [ { 'resource': 'r%d' % (i % 3), 'data': i * 0.5 } for i in range(5000) ]
+  body = encoder.encodeStream( iter(records), encoding, max_memory = 1024, chunk_size = 256 )
+  try:
+    data = body.rewind().read()
+    assert len(data) == body.length
+    assert body.resources == { 'r0', 'r1', 'r2' }
+    if encoding == 'gzip':
+      data = zlib.decompress( data, 16 + zlib.MAX_WBITS )
+    elif encoding == 'deflate':
+      data = zlib.decompress( data )
+    assert data == encoder.encode( records )
+  finally:
+    body.close()
+
+def test_compress_round_trip():
+  data = b'{"data":[' + b'1,' * 1000 + b'1]}'
+  assert zlib.decompress( compress( data, 'gzip' ), 16 + zlib.MAX_WBITS ) == data
+  with pytest.raises(ValueError):
+    compress( data, 'br' )
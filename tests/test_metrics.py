@@ -0,0 +1,71 @@
+import socket
+
+import pytest
+
+from beebotte import InternalError
+from beebotte.metrics import Histogram, Metrics, StatsdExporter, operation
+
+@pytest.mark.parametrize( 'method, uri, name', [
+  ( 'GET', '/v1/data/read/c/r?limit=10', 'read' ),
+  ( 'GET', '/vi/public/data/read/owner/c/r?limit=10', 'readPublic' ),
+  ( 'POST', '/v1/data/write/c/r', 'write' ),
+  ( 'POST', '/v1/data/write/c', 'writeBulk' ),
+  ( 'POST', '/v1/data/publish/c/r', 'publish' ),
+  ( 'POST', '/v1/data/publish/c', 'publishBulk' ),
+  ( 'GET', '/v1/unknown', 'unknown' ),
+  ( 'GET', '/v1/data/other/c/r', 'unknown' ),
+] )
+def test_operation_names(method, uri, name):
+  assert operation( method, uri ) == name
+
+def test_every_api_call_is_recorded(bbt, server):
+  metrics = Metrics( bbt )
+  bbt.read( 'c', 'r', limit = 5 )
+  bbt.readPublic( 'owner', 'c', 'r', limit = 5 )
+  list( bbt.read_stream( 'c', 'r', limit = 5 ) )
+  bbt.write( 'c', 'r', 1 )
+  bbt.writeBulk( 'c', [ { 'resource': 'r', 'data': 1 } ] )
+  bbt.publish( 'c', 'r', 1 )
+  bbt.publishBulk( 'c', [ { 'resource': 'r', 'data': 1 } ] )
+  calls = metrics.snapshot()['calls']
+  assert { op: call['count'] for op, call in calls.items() } == {
+    'read': 2, 'readPublic': 1, 'write': 1, 'writeBulk': 1, 'publish': 1, 'publishBulk': 1 }
+  assert 'sign' in calls['write']['phases'] and 'network' in calls['read']['phases']
+  assert metrics.bytes_sent > 0 and metrics.bytes_received > 0
+
+def test_errors_and_prometheus_output(bbt, server):
+  metrics = Metrics( bbt )
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  with pytest.raises(InternalError):
+    bbt.write( 'c', 'r', 1 )
+  assert metrics.snapshot()['errors'] == { 'write:500:1201': 1 }
+  text = metrics.prometheus()
+  assert 'beebotte_request_duration_seconds_count{operation="write"} 1' in text
+  assert 'beebotte_errors_total{operation="write",status="500",code="1201"} 1' in text
+  assert 'beebotte_request_duration_seconds_bucket{operation="write",le="+Inf"} 1' in text
+  assert '# TYPE beebotte_pool_connections gauge' in text
+
+def test_histogram_quantiles():
+  histogram = Histogram( ( 1, 2, 3 ) )
+  for value in ( 0.5, 1.5, 1.5, 2.5 ):
+    histogram.observe( value )
+  assert histogram.count == 4 and histogram.sum == 6.0
+  assert histogram.counts == [ 1, 2, 1, 0 ]
+  assert 1 <= histogram.quantile( 0.5 ) <= 2
+  assert Histogram().quantile( 0.5 ) == 0.0
+
+def test_statsd_exporter_sends_timers_and_counters(bbt):
+  receiver = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+  receiver.bind( ( '127.0.0.1', 0 ) )
+  receiver.settimeout( 5 )
+  exporter = StatsdExporter( port = receiver.getsockname()[1], prefix = 'test' )
+  try:
+    bbt.add_hook( exporter )
+    bbt.readPublic( 'owner', 'c', 'r' )
+    lines = receiver.recv( 65536 ).decode().split("\n")
+  finally:
+    exporter.close()
+    receiver.close()
+  assert lines[0].startswith( 'test.readPublic.duration:' ) and lines[0].endswith( '|ms' )
+  assert any( line.startswith( 'test.readPublic.received_bytes:' ) for line in lines )
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from beebotte import DataPoint
+from beebotte.mirror import Mirror
+
+NOW = 1500000000000
+
+def test_sync_downloads_only_new_records(bbt, server, tmp_path):
+  server.now = NOW
+  with Mirror( bbt, 'c', 'r', str( tmp_path / 'r' ), page_size = 300 ) as mirror:
+    assert mirror.sync() == server.read_size
+    assert ( mirror.first_ts, mirror.last_ts ) == ( NOW - ( server.read_size - 1 ) * 1000, NOW )
+    reads = server.counters['reads']
+    assert mirror.sync() == 0
+    server.now = NOW + 5000
+    assert mirror.sync() == 5
+    assert server.counters['reads'] == reads + 2
+    assert len(mirror) == server.read_size + 5
+    assert mirror.last_ts == NOW + 5000
+
+def test_range_queries(bbt, server, tmp_path):
+  server.now = NOW
+  with Mirror( bbt, 'c', 'r', str( tmp_path / 'r' ), owner = 'someone' ) as mirror:
+    mirror.sync( since = NOW - 99000 )
+    assert len(mirror) == 100
+    window = mirror.range( NOW - 10000, NOW - 5000 )
+    assert list( window.ts ) == list( range( NOW - 10000, NOW - 5000, 1000 ) )
+    assert list( window.data ) == [ float( ts // 1000 % 1000 ) for ts in window.ts ]
+    assert len( mirror.range() ) == 100
+    assert len( mirror.range( NOW + 1 ) ) == 0
+
+def test_reopened_mirror_discards_a_torn_record(bbt, server, tmp_path):
+  server.now = NOW
+  path = str( tmp_path / 'r' )
+  with Mirror( bbt, 'c', 'r', path ) as mirror:
+    mirror.sync( since = NOW - 9000 )
+  with open( path + '.ts', 'ab' ) as f:
+    f.write( b'\x01\x02\x03\x04\x05\x06\x07\x08' )
+  with open( path + '.val', 'ab' ) as f:
+    f.write( b'\x01\x02\x03' )
+  with Mirror( bbt, 'c', 'r', path ) as mirror:
+    assert len(mirror) == 10
+    assert os.path.getsize( path + '.ts' ) == os.path.getsize( path + '.val' ) == 80
+    assert mirror.last_ts == NOW
+
+"""
+Client returning the given points from read_iter, most recent first.
+"""
+class Points:
+  def __init__(self, points):
+    self.points = points
+
+  def read_iter(self, channel, resource, time_range = None, page_size = None, owner = None):
+    return iter( self.points )
+
+def test_only_numeric_values_are_stored(tmp_path):
+  bbt = Points( [ DataPoint( 'on', 2000 ), DataPoint( 1, 1000 ) ] )
+  with Mirror( bbt, 'c', 'r', str( tmp_path / 'r' ) ) as mirror:
+    with pytest.raises(ValueError):
+      mirror.sync()
+    assert len(mirror) == 0
@@ -0,0 +1,127 @@
+import time
+
+import pytest
+
+from beebotte import BBT, InternalError, ServiceUnavailableError, UsageLimitError, CircuitOpenError, AuthenticationError
+from beebotte.retry import RetryPolicy, RateLimiter, CircuitBreaker
+
+"""
+Send function of __execute__ answering each call with the next of the given responses.
+"""
+class Flaky:
+  def __init__(self, bbt, responses):
+    self.bbt = bbt
+    self.responses = list(responses)
+    self.calls = 0
+
+  def __call__(self):
+    self.calls += 1
+    response = self.responses.pop(0)
+    return self.bbt.__processResponse__( response )
+
+def error(status, errcode = 1201, headers = None):
+  return { 'status': status, 'data': '{"error":{"code":%d,"message":"failed"}}' % errcode, 'headers': headers }
+
+OK = { 'status': 200, 'data': 'true' }
+
+@pytest.mark.parametrize( 'body', [ '[]', '{"error":"oops"}', '<html>Bad gateway</html>', '{"error":{"message":"no code"}}' ] )
+def test_non_beebotte_error_bodies_keep_their_status(body):
+  bbt = BBT( 'akey', 'skey' )
+  with pytest.raises(ServiceUnavailableError) as info:
+    bbt.__processResponse__( { 'status': 503, 'data': body } )
+  assert info.value.status == 503
+  assert info.value.code is None
+
+def test_error_attributes():
+  bbt = BBT( 'akey', 'skey' )
+  with pytest.raises(UsageLimitError) as info:
+    bbt.__processResponse__( error( 429, 1501, { 'Retry-After': '7' } ) )
+  assert ( info.value.status, info.value.code, info.value.retry_after ) == ( 429, 1501, 7 )
+
+def test_reads_are_retried_on_failures():
+  bbt = BBT( 'akey', 'skey', retry_policy = RetryPolicy( backoff = 0.001 ) )
+  send = Flaky( bbt, [ error(500), error(503), OK ] )
+  assert bbt.__execute__( send, True ) is True
+  assert send.calls == 3
+  assert bbt.retry_policy.retries == 2
+
+def test_writes_are_only_retried_when_rejected():
+  bbt = BBT( 'akey', 'skey', retry_policy = RetryPolicy( backoff = 0.001 ) )
+  send = Flaky( bbt, [ error(503), error(500), OK ] )
+  with pytest.raises(InternalError):
+    bbt.__execute__( send, False )
+  assert send.calls == 2
+
+def test_client_errors_are_not_retried():
+  bbt = BBT( 'akey', 'skey', retry_policy = RetryPolicy( backoff = 0.001 ) )
+  send = Flaky( bbt, [ error(400, 1101), OK ] )
+  with pytest.raises(AuthenticationError):
+    bbt.__execute__( send, True )
+  assert send.calls == 1
+
+def test_retry_after_longer_than_the_maximum_gives_up():
+  policy = RetryPolicy( backoff = 0.001, max_retry_after = 5 )
+  bbt = BBT( 'akey', 'skey', retry_policy = policy )
+  send = Flaky( bbt, [ error(429, 1501, { 'Retry-After': '60' }), OK ] )
+  with pytest.raises(UsageLimitError):
+    bbt.__execute__( send, True )
+  assert policy.giveups == 1
+
+def test_breaker_opens_and_rejects_calls():
+  breaker = CircuitBreaker( failure_threshold = 2, recovery_timeout = 60 )
+  bbt = BBT( 'akey', 'skey', circuit_breaker = breaker )
+  for _ in range(2):
+    with pytest.raises(InternalError):
+      bbt.__execute__( Flaky( bbt, [ error(500) ] ), True )
+  assert breaker.state == CircuitBreaker.OPEN
+  send = Flaky( bbt, [ OK ] )
+  with pytest.raises(CircuitOpenError):
+    bbt.__execute__( send, True )
+  assert send.calls == 0
+  assert breaker.stats()['rejected'] == 1
+
+def test_breaker_raises_the_last_error_when_it_opens_during_retries():
+  breaker = CircuitBreaker( failure_threshold = 2, recovery_timeout = 60 )
+  bbt = BBT( 'akey', 'skey', retry_policy = RetryPolicy( max_attempts = 5, backoff = 0.001 ), circuit_breaker = breaker )
+  send = Flaky( bbt, [ { 'status': 503, 'data': '[]' } ] * 5 )
+  with pytest.raises(ServiceUnavailableError) as info:
+    bbt.__execute__( send, True )
+  assert info.value.status == 503
+  assert send.calls == 2
+  assert breaker.state == CircuitBreaker.OPEN
+
+def test_breaker_half_open_trial():
+  breaker = CircuitBreaker( failure_threshold = 1, recovery_timeout = 0.05 )
+  bbt = BBT( 'akey', 'skey', circuit_breaker = breaker )
+  with pytest.raises(InternalError):
+    bbt.__execute__( Flaky( bbt, [ error(500) ] ), True )
+  time.sleep( 0.06 )
+  assert bbt.__execute__( Flaky( bbt, [ OK ] ), True ) is True
+  assert breaker.state == CircuitBreaker.CLOSED
+
+def test_client_errors_do_not_open_the_breaker():
+  breaker = CircuitBreaker( failure_threshold = 1 )
+  bbt = BBT( 'akey', 'skey', circuit_breaker = breaker )
+  with pytest.raises(AuthenticationError):
+    bbt.__execute__( Flaky( bbt, [ error(400, 1101) ] ), True )
+  assert breaker.state == CircuitBreaker.CLOSED
+
+def test_rate_limiter_delays_calls_over_the_burst():
+  limiter = RateLimiter( 100, burst = 2 )
+  assert limiter.reserve() == 0
+  assert limiter.reserve() == 0
+  assert limiter.reserve() > 0
+  assert limiter.stats()['delayed'] == 1
+
+def test_retries_against_the_mock_server(server):
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  breaker = CircuitBreaker( failure_threshold = 3, recovery_timeout = 60 )
+  with BBT( server.akey, server.skey, hostname = server.hostname, port = server.port,
+            retry_policy = RetryPolicy( max_attempts = 5, backoff = 0.001 ), circuit_breaker = breaker ) as bbt:
+    with pytest.raises(InternalError):
+      bbt.read( 'c', 'r' )
+    assert server.counters['errors'] == 3
+    with pytest.raises(CircuitOpenError):
+      bbt.read( 'c', 'r' )
+    assert server.counters['requests'] == 3
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+
+import pytest
+
+from beebotte import BBT, InternalError
+from beebotte.spool import Spool, isRejection
+from beebotte.transport import Transport
+
+def test_drain_sends_records_in_order(bbt, server, tmp_path):
+  with Spool( bbt, str(tmp_path), batch_size = 50 ) as spool:
+    for i in range(120):
+      spool.write( 'c', 'r', i, ts = 1000 + i )
+    assert spool.pending() > 0
+    assert spool.drain() == 120
+    assert spool.pending() == 0
+  assert server.counters['writes'] == 3
+  assert server.counters['records'] == 120
+
+def test_batches_do_not_mix_channels(bbt, server, tmp_path):
+  with Spool( bbt, str(tmp_path) ) as spool:
+    spool.write( 'a', 'r', 1 )
+    spool.write( 'b', 'r', 2 )
+    spool.write( 'a', 'r', 3 )
+    assert spool.drain() == 3
+  assert server.counters['writes'] == 3
+
+def test_failed_drain_keeps_records(bbt, server, tmp_path):
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  with Spool( bbt, str(tmp_path) ) as spool:
+    spool.writeBulk( 'c', [ { 'resource': 'r', 'data': i } for i in range(10) ] )
+    pending = spool.pending()
+    with pytest.raises(InternalError):
+      spool.drain()
+    assert spool.pending() == pending
+    server.error_rate = 0
+    assert spool.drain() == 10
+  assert not os.path.exists( os.path.join( str(tmp_path), 'dead-letter.jsonl' ) )
+
+def test_reopen_resumes_after_acknowledged_records(bbt, server, tmp_path):
+  spool = Spool( bbt, str(tmp_path), batch_size = 10 )
+  for i in range(25):
+    spool.write( 'c', 'r', i )
+  assert spool.drain( max_batches = 1 ) == 10
+  spool.close()
+
+  with Spool( bbt, str(tmp_path), batch_size = 10 ) as spool:
+    assert spool.drain() == 15
+  assert server.counters['records'] == 25
+
+def test_torn_record_is_discarded_on_reopen(bbt, server, tmp_path):
+  spool = Spool( bbt, str(tmp_path) )
+  spool.write( 'c', 'r', 1 )
+  spool.write( 'c', 'r', 2 )
+  spool.close()
+  segment = os.path.join( str(tmp_path), sorted( n for n in os.listdir( str(tmp_path) ) if n.endswith('.log') )[-1] )
+  with open( segment, 'ab' ) as f:
+    f.write( b'\x00\x00\x00\x40partial' )
+
+  with Spool( bbt, str(tmp_path) ) as spool:
+    assert spool.drain() == 2
+    spool.write( 'c', 'r', 3 )
+    assert spool.drain() == 1
+
+def test_segments_rotate_and_are_removed_once_acknowledged(bbt, tmp_path):
+  with Spool( bbt, str(tmp_path), segment_bytes = 512 ) as spool:
+    for i in range(100):
+      spool.write( 'c', 'r', i )
+    assert len( [ n for n in os.listdir( str(tmp_path) ) if n.endswith('.log') ] ) > 1
+    assert spool.drain() == 100
+    assert len( [ n for n in os.listdir( str(tmp_path) ) if n.endswith('.log') ] ) == 1
+
+def test_drop_newest_overflow(bbt, tmp_path):
+  with Spool( bbt, str(tmp_path), max_bytes = 1024, segment_bytes = 256, overflow = 'drop-newest' ) as spool:
+    stored = sum( spool.write( 'c', 'r', i ) for i in range(100) )
+    assert 0 < stored < 100
+    assert spool.dropped == 100 - stored
+    assert spool.drain() == stored
+
+def test_drop_oldest_overflow_keeps_recent_records(bbt, server, tmp_path):
+  with Spool( bbt, str(tmp_path), max_bytes = 2048, segment_bytes = 256 ) as spool:
+    for i in range(200):
+      spool.write( 'c', 'r', i, ts = 1000 + i )
+    assert spool.dropped > 0
+    assert spool.drain() == 200 - spool.dropped
+
+def test_payload_limit_splits_batches(tmp_path):
+  from benchmarks.mockserver import MockServer
+  with MockServer( payload_limit = 5000 ) as server:
+    bbt = BBT( server.akey, server.skey, hostname = server.hostname, port = server.port )
+    with Spool( bbt, str(tmp_path) ) as spool:
+      for i in range(400):
+        spool.write( 'c', 'r', i * 1.5 )
+      assert spool.drain() == 400
+      assert spool.pending() == 0
+      assert spool.rejected == 0
+    bbt.close()
+  assert server.counters['records'] == 400
+
+def test_refused_records_go_to_the_dead_letter_file(tmp_path):
+  from benchmarks.mockserver import MockServer
+  with MockServer( payload_limit = 5000 ) as server:
+    bbt = BBT( server.akey, server.skey, hostname = server.hostname, port = server.port )
+    with Spool( bbt, str(tmp_path) ) as spool:
+      spool.write( 'c', 'r', 1 )
+      spool.write( 'c', 'big', 'x' * 6000 )
+      spool.write( 'c', 'r', 2 )
+      assert spool.drain() == 2
+      assert spool.pending() == 0
+      assert spool.rejected == 1
+      with open( spool.deadLetterPath() ) as f:
+        entries = [ json.loads(line) for line in f ]
+    bbt.close()
+  assert len(entries) == 1
+  assert entries[0]['resource'] == 'big'
+  assert entries[0]['status'] == 400
+  assert entries[0]['code'] == 1406
+
+def test_authentication_failures_are_retried(server, tmp_path):
+  bbt = BBT( server.akey, 'wrong', hostname = server.hostname, port = server.port )
+  with Spool( bbt, str(tmp_path) ) as spool:
+    spool.write( 'c', 'r', 1 )
+    with pytest.raises(Exception):
+      spool.drain()
+    assert spool.pending() > 0
+    assert spool.rejected == 0
+  bbt.close()
+
+"""
+Transport of a host that cannot be reached, counting the connection attempts.
+"""
+class Unreachable(Transport):
+  def __init__(self):
+    self.attempts = 0
+
+  def request(self, method, url, body = None, headers = None):
+    self.attempts += 1
+    raise ConnectionRefusedError("unreachable")
+
+  def close(self):
+    pass
+
+def test_writes_while_offline_do_not_bring_retries_forward(tmp_path):
+  transport = Unreachable()
+  bbt = BBT( 'akey', 'skey', transport = transport )
+  with Spool( bbt, str(tmp_path), retry_interval = 5.0 ) as spool:
+    spool.start()
+    for i in range(200):
+      spool.write( 'c', 'r', i )
+      time.sleep( 0.005 )
+    assert spool.pending() > 0
+  assert 1 <= transport.attempts <= 2
+
+def error(status, body):
+  try:
+    BBT( 'akey', 'skey' ).__processResponse__( { 'status': status, 'data': body } )
+  except Exception as e:
+    return e
+
+@pytest.mark.parametrize( 'status, body, rejected', [
+  ( 400, '{"error":{"code":1406,"message":"too large"}}', True ),
+  ( 404, '{"error":{"code":1301,"message":"unknown resource"}}', True ),
+  ( 413, '<html>Request Entity Too Large</html>', True ),
+  ( 400, '{"error":{"code":1101,"message":"authentication failed"}}', False ),
+  ( 408, '{"error":{"code":1201,"message":"timeout"}}', False ),
+  ( 429, '{"error":{"code":1501,"message":"rate limited"}}', False ),
+  ( 403, '<html>Forbidden by proxy</html>', False ),
+  ( 500, '{"error":{"code":1201,"message":"internal error"}}', False ),
+] )
+def test_only_beebotte_refusals_are_rejections(status, body, rejected):
+  assert isRejection( error( status, body ) ) is rejected
+  assert isRejection( ConnectionRefusedError() ) is False
+
+def test_background_drain_retries_after_the_interval(bbt, server, tmp_path):
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  with Spool( bbt, str(tmp_path), retry_interval = 0.2 ) as spool:
+    spool.start()
+    spool.write( 'c', 'r', 1 )
+    time.sleep( 0.1 )
+    server.error_rate = 0
+    deadline = time.monotonic() + 5
+    while spool.pending() and time.monotonic() < deadline:
+      time.sleep( 0.01 )
+    assert spool.pending() == 0
+  assert server.counters['records'] == 1
@@ -0,0 +1,165 @@
+import time
+import asyncio
+
+import pytest
+
+from beebotte import BBT
+from beebotte.stream import Subscriber, MQTTTransport, topic, matches
+from benchmarks.mockbroker import MockBroker
+
+@pytest.fixture
+def broker():
+  with MockBroker() as mock:
+    yield mock
+
+def subscriber(broker, **options):
+  transport = MQTTTransport( hostname = broker.hostname, port = broker.port )
+  return Subscriber( BBT( 'akey', 'skey' ), transport = transport, reconnect_delay = 0.05, **options )
+
+def until(condition, timeout = 5):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, "timed out"
+    time.sleep( 0.01 )
+
+def test_topic_filters():
+  assert topic( 'c' ) == 'c/+'
+  assert topic( '*', 'r' ) == '+/r'
+  assert matches( 'c/+', 'c/r' ) and matches( '#', 'c/r' )
+  assert not matches( 'c/r', 'c/other' ) and not matches( 'c', 'c/r' )
+
+def test_callbacks_receive_matching_messages(broker):
+  received = []
+  batches = []
+  sub = subscriber( broker, on_batch = batches.append )
+  sub.subscribe( 'c', 'r', callback = received.extend )
+  sub.subscribe( 'other' )
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 2 )
+    for i in range(10):
+      broker.publishRecord( 'c', 'r', i, ts = 1000 + i )
+    broker.publishRecord( 'other', 'x', 'ignored' )
+    until( lambda: sum( len(b) for b in batches ) == 11 )
+  assert [ ( p.data, p.ts, p.channel, p.resource ) for p in received ] == [ ( i, 1000 + i, 'c', 'r' ) for i in range(10) ]
+
+def test_iteration_returns_batches(broker):
+  sub = subscriber( broker, batch_size = 4, max_latency = 0.05 )
+  sub.subscribe( 'c' )
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    for i in range(10):
+      broker.publishRecord( 'c', 'r', i )
+    until( lambda: sub.received == 10 )
+    batches = [ sub.get( 1 ) for _ in range(3) ]
+    assert sub.get( 0.05 ) == []
+  assert [ [ p.data for p in b ] for b in batches ] == [ [ 0, 1, 2, 3 ], [ 4, 5, 6, 7 ], [ 8, 9 ] ]
+  assert sub.get() is None
+
+def test_async_iteration(broker):
+  sub = subscriber( broker, batch_size = 5, max_latency = 0.05 )
+  sub.subscribe( 'c' )
+  async def main():
+    values = []
+    async for batch in sub:
+      values.extend( p.data for p in batch )
+      if len(values) == 12:
+        sub.close()
+    return values
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    async def publish():
+      await asyncio.sleep( 0.05 )
+      for i in range(12):
+        broker.publishRecord( 'c', 'r', i )
+    async def run():
+      task = asyncio.ensure_future( publish() )
+      values = await asyncio.wait_for( main(), 5 )
+      await task
+      return values
+    assert asyncio.run( run() ) == list(range(12))
+
+def test_async_iteration_does_not_block_the_loop(broker):
+  sub = subscriber( broker, max_latency = 0.01 )
+  sub.subscribe( 'c' )
+  async def main():
+    ticks = 0
+    consumer = asyncio.ensure_future( sub.__anext__() )
+    while not consumer.done():
+      ticks += 1
+      if ticks == 5:
+        broker.publishRecord( 'c', 'r', 1 )
+      await asyncio.sleep( 0.01 )
+    return ticks, consumer.result()
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    ticks, batch = asyncio.run( asyncio.wait_for( main(), 5 ) )
+  assert ticks >= 5
+  assert [ p.data for p in batch ] == [ 1 ]
+
+def test_subscriptions_are_renewed_after_reconnecting(broker):
+  sub = subscriber( broker )
+  sub.subscribe( 'c', 'r' )
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    broker.disconnect()
+    until( lambda: sub.reconnects == 1 and broker.counters['subscriptions'] == 2 )
+    broker.publishRecord( 'c', 'r', 'after' )
+    batch = sub.get( 5 )
+  assert [ p.data for p in batch ] == [ 'after' ]
+
+@pytest.mark.parametrize( 'overflow, expected', [ ( 'drop-newest', [ 0, 1, 2, 3, 4 ] ), ( 'drop-oldest', [ 15, 16, 17, 18, 19 ] ) ] )
+def test_overflow_drops_messages(broker, overflow, expected):
+  sub = subscriber( broker, max_queue = 5, overflow = overflow )
+  sub.subscribe( 'c' )
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    for i in range(20):
+      broker.publishRecord( 'c', 'r', i )
+    until( lambda: sub.received == 20 )
+    assert sub.dropped == 15
+    assert [ p.data for p in sub.get( 1 ) ] == expected
+
+def test_block_overflow_keeps_every_message(broker):
+  sub = subscriber( broker, max_queue = 5, batch_size = 3 )
+  sub.subscribe( 'c' )
+  values = []
+  with sub:
+    until( lambda: broker.counters['subscriptions'] == 1 )
+    for i in range(50):
+      broker.publishRecord( 'c', 'r', i )
+    until( lambda: sub.received >= 5 )
+    while len(values) < 50:
+      values.extend( p.data for p in sub.get( 5 ) )
+  assert values == list(range(50))
+  assert sub.dropped == 0
+
+"""
+Transport recording the subscriptions it is given, for signed transports.
+"""
+class Recorder:
+  signed = True
+
+  def __init__(self):
+    self.subscriptions = []
+
+  def connect(self, client_id):
+    pass
+
+  def subscribe(self, topic_filter, auth = None):
+    self.subscriptions.append( ( topic_filter, auth ) )
+
+  def receive(self, timeout):
+    time.sleep( timeout )
+
+  def close(self):
+    pass
+
+def test_private_and_presence_subscriptions_are_signed():
+  transport = Recorder()
+  sub = Subscriber( BBT( 'akey', 'skey' ), transport = transport, client_id = 'client' )
+  sub.subscribe( 'private-c', 'r' ).subscribe( 'presence-c' ).subscribe( 'public' )
+  with sub:
+    until( lambda: len(transport.subscriptions) == 3 )
+  auths = dict( transport.subscriptions )
+  assert auths['private-c/r'].startswith( 'akey:' ) and auths['presence-c/+'].startswith( 'akey:' )
+  assert auths['public/+'] is None
@@ -0,0 +1,126 @@
+import gzip
+import zlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from beebotte.transport import HTTPClientTransport, defaultTransport
+
+BODY = b'{"data":[' + b'1,' * 500 + b'1]}'
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  connections = 0
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connections += 1
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    body, encoding = BODY, None
+    if self.path == '/gzip':
+      body, encoding = gzip.compress( BODY ), 'gzip'
+    elif self.path == '/deflate':
+      body, encoding = zlib.compress( BODY ), 'deflate'
+    elif self.path == '/raw-deflate':
+      d = zlib.compressobj( 6, zlib.DEFLATED, -zlib.MAX_WBITS )
+      body, encoding = d.compress( BODY ) + d.flush(), 'deflate'
+    self.send_response( 200 )
+    self.send_header( 'Content-Length', str( len(body) ) )
+    if encoding:
+      self.send_header( 'Content-Encoding', encoding )
+    self.end_headers()
+    self.wfile.write( body )
+    # closes the connection without announcing it, as a server dropping idle keep-alive connections does
+    if self.path == '/drop':
+      self.close_connection = True
+
+@pytest.fixture
+def http():
+  server = ThreadingHTTPServer( ( '127.0.0.1', 0 ), Handler )
+  server.daemon_threads = True
+  server.lock = threading.Lock()
+  server.connections = 0
+  thread = threading.Thread( target = server.serve_forever, daemon = True )
+  thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+def url(server, path):
+  return "http://127.0.0.1:%d%s" % ( server.server_address[1], path )
+
+def test_connections_are_reused(http):
+  transport = HTTPClientTransport()
+  for _ in range(5):
+    assert transport.request( 'GET', url( http, '/' ) ).content == BODY
+  assert http.connections == 1
+  assert transport.pool_stats() == { 'pools': 1, 'connections': 1, 'requests': 5, 'idle': 1 }
+  transport.close()
+  assert transport.pool_stats()['connections'] == 0
+
+def test_connections_closed_while_idle_are_not_reused(http):
+  transport = HTTPClientTransport()
+  assert transport.request( 'GET', url( http, '/drop' ) ).status == 200
+  assert transport.request( 'GET', url( http, '/' ) ).content == BODY
+  assert http.connections == 2
+
+def test_gets_on_stale_connections_are_sent_again(http):
+  transport = HTTPClientTransport()
+  transport.__dropped__ = lambda conn: False
+  assert transport.request( 'GET', url( http, '/drop' ) ).status == 200
+  assert transport.request( 'GET', url( http, '/' ) ).content == BODY
+  assert http.connections == 2
+  assert transport.pool_stats()['connections'] == 1
+
+@pytest.mark.parametrize( 'path', [ '/gzip', '/deflate', '/raw-deflate' ] )
+def test_responses_are_decompressed(http, path):
+  transport = HTTPClientTransport()
+  assert transport.request( 'GET', url( http, path ) ).content == BODY
+  with transport.stream( 'GET', url( http, path ) ) as response:
+    assert b''.join( response.iter_content( 7 ) ) == BODY
+  assert http.connections == 1
+
+def test_default_timeout(http):
+  transport = HTTPClientTransport()
+  assert transport.timeout == 60
+  conn, reused = transport.__acquire__( ( 'http', '127.0.0.1', http.server_address[1] ) )
+  assert conn.timeout == 60 and not reused
+
+def test_pool_block_waits_for_a_free_connection(http):
+  transport = HTTPClientTransport( pool_maxsize = 1, pool_block = True, timeout = 5 )
+  held = transport.stream( 'GET', url( http, '/' ) )
+  results = []
+  waiter = threading.Thread( target = lambda: results.append( transport.request( 'GET', url( http, '/' ) ).content ) )
+  waiter.start()
+  waiter.join( 0.2 )
+  assert waiter.is_alive() and not results
+  assert held.read() == BODY
+  waiter.join( 5 )
+  assert results == [ BODY ]
+  assert http.connections == 1
+
+def test_pool_block_gives_up_after_the_timeout(http):
+  transport = HTTPClientTransport( pool_maxsize = 1, pool_block = True, timeout = 0.1 )
+  held = transport.stream( 'GET', url( http, '/' ) )
+  with pytest.raises(ConnectionError):
+    transport.request( 'GET', url( http, '/' ) )
+  held.close()
+  assert transport.request( 'GET', url( http, '/' ) ).content == BODY
+
+def test_pool_maxsize_only_bounds_idle_connections_without_pool_block(http):
+  transport = HTTPClientTransport( pool_maxsize = 1 )
+  held = [ transport.stream( 'GET', url( http, '/' ) ) for _ in range(3) ]
+  assert http.connections == 3
+  for response in held:
+    response.read()
+  assert transport.pool_stats()['idle'] == 1
+
+def test_default_transport_passes_pool_block():
+  transport = defaultTransport( pool_maxsize = 3, pool_block = True )
+  assert ( transport.pool_maxsize, transport.pool_block ) == ( 3, True )
@@ -0,0 +1,51 @@
+import queue
+import pickle
+import multiprocessing
+
+import pytest
+
+from beebotte.uplink import Uplink, Producer
+
+def produce(producer, worker, count):
+  for i in range(count):
+    producer.write( 'c', 'r', i )
+  producer.publish( 'c', 'r', worker, source = 'worker' )
+
+def uplink(server, **options):
+  return Uplink( server.akey, server.skey, hostname = server.hostname, port = server.port, max_linger = 0.01, **options )
+
+def test_workers_share_one_sender(server):
+  with uplink( server ) as link:
+    workers = [ multiprocessing.Process( target = produce, args = ( link.producer(), n, 100 ) ) for n in range(4) ]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    assert link.flush( 10 )
+    assert link.stats() == { 'pending': 0, 'sent': 404, 'failed': 0, 'dropped': 0 }
+  assert server.counters['records'] == 404
+  assert server.counters['writes'] + server.counters['publishes'] < 404
+
+def test_failed_records_are_counted(server):
+  server.error_rate = 1
+  server.error_codes = ( 1201, )
+  with uplink( server ) as link:
+    link.write( 'c', 'r', 1 )
+    assert link.flush( 10 )
+    assert link.stats()['failed'] == 1
+
+def test_submissions_over_max_pending_are_dropped():
+  counters = dict( ( name, multiprocessing.Value('q', 0) ) for name in ( 'pending', 'sent', 'failed', 'dropped' ) )
+  producer = Producer( queue.Queue(), counters, max_pending = 2 )
+  assert producer.write( 'c', 'r', 1 ) is True
+  assert producer.backpressure() == 0.5
+  assert producer.publish( 'c', 'r', 2 ) is True
+  assert producer.write( 'c', 'r', 3 ) is False
+  assert producer.backpressure() == 1.0
+  assert producer.stats() == { 'pending': 2, 'sent': 0, 'failed': 0, 'dropped': 1 }
+
+def test_only_the_producer_can_be_pickled(server):
+  with uplink( server ) as link:
+    with pytest.raises(TypeError):
+      pickle.dumps( link )
+    assert isinstance( link.producer(), Producer )